@@ -4,16 +4,22 @@
 """
 
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Callable, Any
+from concurrent.futures import Future, ThreadPoolExecutor
+import asyncio
+import threading
 import jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, object_session
 import os
 from dotenv import load_dotenv
 
 from models import User, get_db
+from principal_cache import user_principal_cache
+from entitlements import Entitlements, entitlement_resolver
 
 # 加载环境变量
 load_dotenv()
@@ -26,6 +32,10 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7天
 # 密码哈希上下文
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# 密码哈希线程池配置
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "32"))
+
 # HTTP Bearer认证
 security = HTTPBearer(auto_error=False)
 
@@ -38,6 +48,73 @@ def get_password_hash(password: str) -> str:
     """生成密码哈希"""
     return pwd_context.hash(password)
 
+# 密码哈希线程池
+class PasswordHashPool:
+    """bcrypt计算专用的有界线程池，避免阻塞事件循环"""
+    
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_limit: int = PASSWORD_HASH_QUEUE_LIMIT):
+        """
+        Args:
+            workers: 工作线程数
+            queue_limit: 允许排队等待的任务数，超出时直接拒绝（背压）
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+    
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """在线程池中执行哈希计算，队列已满时返回503"""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="服务繁忙，请稍后重试",
+                headers={"Retry-After": "1"},
+            )
+        
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        
+        # 名额在计算真正结束时归还：请求被取消时工作线程可能仍在计算
+        future.add_done_callback(self._finished)
+        return await asyncio.wrap_future(future)
+    
+    def _finished(self, future: Future):
+        """任务结束（完成、失败或排队中被取消）时归还名额并计数"""
+        self._slots.release()
+        with self._lock:
+            if future.cancelled():
+                self.cancelled += 1
+            elif future.exception() is not None:
+                self.failed += 1
+            else:
+                self.succeeded += 1
+    
+    def stats(self) -> dict:
+        return {
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected
+        }
+
+password_hash_pool = PasswordHashPool()
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """验证密码（在哈希线程池中执行）"""
+    return await password_hash_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """生成密码哈希（在哈希线程池中执行）"""
+    return await password_hash_pool.run(get_password_hash, password)
+
 # 用户认证
 def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
     """验证用户凭据"""
@@ -54,6 +131,23 @@ def authenticate_user(db: Session, username: str, password: str) -> Optional[Use
     
     return user
 
+async def authenticate_user_async(db: Session, username: str, password: str) -> Optional[User]:
+    """验证用户凭据（数据库查询和密码校验都不阻塞事件循环）"""
+    user = await run_in_threadpool(
+        lambda: db.query(User).filter(
+            (User.username == username) | (User.email == username)
+        ).first()
+    )
+    
+    if not user:
+        return None
+    if not await verify_password_async(password, user.password_hash):
+        return None
+    if not user.is_active:
+        return None
+    
+    return user
+
 # JWT令牌创建
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """创建访问令牌"""
@@ -68,8 +162,23 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# 从JWT令牌解析用户
+def get_user_from_token(db: Session, token: str) -> Optional[User]:
+    """解析JWT令牌并加载用户，令牌无效或用户不存在时返回None"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            return None
+    except jwt.InvalidTokenError:
+        return None
+    
+    # 常见情况下命中认证主体缓存，无需查询数据库
+    return user_principal_cache.get_by_subject(db, username)
+
 # 获取当前用户
-async def get_current_user(
+# 认证主体缓存未命中时会查询数据库，因此定义为同步函数，由FastAPI在线程池中执行
+def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
     db: Session = Depends(get_db)
 ) -> User:
@@ -83,18 +192,7 @@ async def get_current_user(
     if credentials is None:
         raise credentials_exception
     
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except jwt.InvalidTokenError:
-        raise credentials_exception
-    
-    user = db.query(User).filter(
-        (User.username == username) | (User.email == username)
-    ).first()
+    user = get_user_from_token(db, credentials.credentials)
     
     if user is None:
         raise credentials_exception
@@ -107,7 +205,7 @@ async def get_current_user(
     return user
 
 # 获取当前用户（可选，允许匿名访问）
-async def get_current_user_optional(
+def get_current_user_optional(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
     db: Session = Depends(get_db)
 ) -> Optional[User]:
@@ -115,18 +213,7 @@ async def get_current_user_optional(
     if credentials is None:
         return None
     
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-    except jwt.InvalidTokenError:
-        return None
-    
-    user = db.query(User).filter(
-        (User.username == username) | (User.email == username)
-    ).first()
+    user = get_user_from_token(db, credentials.credentials)
     
     if user is None or not user.is_active:
         return None
@@ -183,8 +270,17 @@ def check_course_access(user: Optional[User], course_access_level: str, user_has
     return False
 
 # 视频播放权限检查
-def check_video_access(user: Optional[User], course, lesson=None) -> dict:
-    """检查视频播放权限"""
+def check_video_access(user: Optional[User], course, lesson=None,
+                       entitlements: Optional[Entitlements] = None) -> dict:
+    """
+    检查视频播放权限
+    
+    Args:
+        user: 当前用户（匿名为None）
+        course: 课程
+        lesson: 章节（可选）
+        entitlements: 用户权益，未传入时按用户所在的数据库会话解析（有缓存）
+    """
     
     # 处理匿名用户
     if user is None:
@@ -214,10 +310,9 @@ def check_video_access(user: Optional[User], course, lesson=None) -> dict:
         return permission_info
     
     # 检查用户是否已报名该课程
-    user_has_enrollment = any(
-        enrollment.course_id == course.id and enrollment.payment_status == "paid"
-        for enrollment in user.enrollments
-    )
+    if entitlements is None:
+        entitlements = entitlement_resolver.get(object_session(user), user.id)
+    user_has_enrollment = entitlements.has_paid(course.id)
     
     # 检查课程访问权限
     has_access = check_course_access(user, course.access_level, user_has_enrollment)
@@ -0,0 +1,88 @@
+"""
+后台周期任务
+用于在FastAPI启动钩子中运行定时刷盘、清理等维护任务
+"""
+
+import asyncio
+from typing import Callable, Optional
+
+
+class PeriodicTask:
+    def __init__(self, name: str, func: Callable[[], object], interval: float,
+                 run_on_stop: bool = False):
+        """
+        初始化周期任务
+        
+        Args:
+            name: 任务名称
+            func: 同步任务函数（在线程池中执行，不阻塞事件循环）
+            interval: 执行间隔(秒)
+            run_on_stop: 停止时是否再执行一次（用于关闭前刷盘）
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.run_on_stop = run_on_stop
+        
+        self._task: Optional[asyncio.Task] = None
+        self._event_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake_event: Optional[asyncio.Event] = None
+        self.runs = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+    
+    def start(self):
+        """启动任务（需在事件循环中调用）"""
+        if self._task is None or self._task.done():
+            self._event_loop = asyncio.get_running_loop()
+            self._wake_event = asyncio.Event()
+            self._task = self._event_loop.create_task(self._loop())
+    
+    def wake(self):
+        """
+        提前执行下一次任务（不等到间隔结束）
+        
+        可在任意线程调用，只通知事件循环、不在调用方线程执行任务；任务未启动时忽略
+        """
+        loop, wake_event = self._event_loop, self._wake_event
+        if loop is None or wake_event is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(wake_event.set)
+    
+    async def stop(self):
+        """停止任务"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._event_loop = None
+        self._wake_event = None
+        
+        if self.run_on_stop:
+            await self.run_once()
+    
+    async def run_once(self):
+        """立即执行一次任务"""
+        try:
+            await asyncio.to_thread(self.func)
+            self.runs += 1
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            print(f"后台任务 {self.name} 执行失败: {str(e)}")
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake_event.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake_event.clear()
+            await self.run_once()
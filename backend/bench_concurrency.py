@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+并发延迟基准测试
+在耗时的统计请求执行期间，测量 /api/courses 的并发延迟（p50/p99）
+
+用法:
+    python bench_concurrency.py --records 200000 --requests 400 --concurrency 16
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="并发延迟基准测试")
+    parser.add_argument("--records", type=int, default=200000, help="测试用户的学习记录数")
+    parser.add_argument("--courses", type=int, default=30, help="课程数量")
+    parser.add_argument("--requests", type=int, default=400, help="课程列表请求总数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发请求数")
+    parser.add_argument("--heavy-path", default="/api/user/stats", help="后台持续请求的耗时接口")
+    parser.add_argument("--port", type=int, default=8765, help="测试服务端口")
+    return parser.parse_args()
+
+
+def seed_database(args):
+    """写入测试数据，返回测试用户名和密码"""
+    from sqlalchemy import insert
+    from models import SessionLocal, create_tables, User, Course, UserCourse, LearningRecord
+    from auth import get_password_hash
+    
+    create_tables()
+    db = SessionLocal()
+    try:
+        user = User(
+            username="bench",
+            email="bench@xxdfq.com",
+            password_hash=get_password_hash("bench123"),
+            role="student"
+        )
+        db.add(user)
+        
+        courses = [
+            Course(
+                title=f"基准课程{i}",
+                description="基准测试课程" * 20,
+                age_range="8-10",
+                stage="expression",
+                duration="10节课",
+                icon="🎨",
+                color="#f5a623",
+                status="published",
+                access_level="free",
+                sort_order=i
+            )
+            for i in range(args.courses)
+        ]
+        db.add_all(courses)
+        db.flush()
+        
+        for course in courses:
+            db.add(UserCourse(user_id=user.id, course_id=course.id, progress=50))
+        
+        now = datetime.utcnow()
+        batch = []
+        for i in range(args.records):
+            batch.append({
+                "user_id": user.id,
+                "course_id": courses[i % len(courses)].id,
+                "action": "progress",
+                "progress": i % 100,
+                "duration": 60,
+                "created_at": now - timedelta(minutes=i)
+            })
+            if len(batch) >= 10000:
+                db.execute(insert(LearningRecord), batch)
+                batch = []
+        if batch:
+            db.execute(insert(LearningRecord), batch)
+        
+        db.commit()
+    finally:
+        db.close()
+    
+    return "bench", "bench123"
+
+
+def request(url, headers=None, data=None):
+    """发送请求并返回耗时（毫秒）"""
+    req = urllib.request.Request(url, headers=headers or {}, data=data)
+    started = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=60) as resp:
+        body = resp.read()
+    return (time.perf_counter() - started) * 1000, body
+
+
+def measure(base_url, args):
+    """并发请求课程列表，返回延迟列表"""
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda _: request(base_url + "/api/courses")[0],
+            range(args.requests)
+        ))
+    return results
+
+
+def summarize(name, latencies):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name}: n={len(latencies)} mean={statistics.mean(latencies):.1f}ms "
+          f"p50={p50:.1f}ms p99={p99:.1f}ms max={latencies[-1]:.1f}ms")
+
+
+def main():
+    args = parse_args()
+    
+    # 使用临时SQLite数据库，必须在导入应用模块之前设置
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    
+    print(f"写入测试数据: {args.courses} 门课程, {args.records} 条学习记录...")
+    username, password = seed_database(args)
+    
+    import uvicorn
+    from main import app
+    
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    
+    base_url = f"http://127.0.0.1:{args.port}"
+    
+    # 获取JWT令牌
+    _, body = request(
+        base_url + "/api/auth/login",
+        headers={"Content-Type": "application/json"},
+        data=json.dumps({"username": username, "password": password}).encode()
+    )
+    token = json.loads(body)["access_token"]
+    auth_headers = {"Authorization": f"Bearer {token}"}
+    
+    heavy_ms, _ = request(base_url + args.heavy_path, headers=auth_headers)
+    print(f"单次耗时请求 {args.heavy_path}: {heavy_ms:.1f}ms")
+    
+    # 基线：无耗时请求
+    request(base_url + "/api/courses")
+    summarize("基线 /api/courses", measure(base_url, args))
+    
+    # 后台持续发送耗时请求
+    stop = threading.Event()
+    
+    def heavy_loop():
+        while not stop.is_set():
+            request(base_url + args.heavy_path, headers=auth_headers)
+    
+    heavy_threads = [threading.Thread(target=heavy_loop, daemon=True) for _ in range(2)]
+    for t in heavy_threads:
+        t.start()
+    
+    try:
+        summarize(f"并发 {args.heavy_path} 时 /api/courses", measure(base_url, args))
+    finally:
+        stop.set()
+        for t in heavy_threads:
+            t.join()
+        server.should_exit = True
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
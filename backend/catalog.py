@@ -0,0 +1,160 @@
+"""
+课程目录缓存
+缓存课程章节数、课程列表响应等很少变化的目录数据，课程/章节写入时失效
+"""
+
+import os
+import json
+import threading
+from typing import Dict, Iterable, Optional, Any, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from cache_utils import TTLCache
+from models import Course, Lesson
+
+
+# 课程目录缓存配置
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "300"))  # 秒
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "256"))
+
+# 课程ID -> 章节数
+lesson_count_cache = TTLCache(maxsize=4096, ttl=CATALOG_CACHE_TTL, name="lesson_counts")
+
+
+def get_lesson_counts(db: Session, course_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    批量获取课程章节数
+    
+    Args:
+        db: 数据库会话
+        course_ids: 课程ID列表
+        
+    Returns:
+        课程ID -> 章节数（未缓存的课程用一次GROUP BY查询补齐）
+    """
+    counts = {}
+    missing = []
+    for course_id in set(course_ids):
+        count = lesson_count_cache.get(course_id)
+        if count is None:
+            missing.append(course_id)
+        else:
+            counts[course_id] = count
+    
+    if missing:
+        rows = db.query(Lesson.course_id, func.count(Lesson.id)).filter(
+            Lesson.course_id.in_(missing)
+        ).group_by(Lesson.course_id).all()
+        
+        loaded = dict(rows)
+        for course_id in missing:
+            counts[course_id] = loaded.get(course_id, 0)
+            lesson_count_cache.set(course_id, counts[course_id])
+    
+    return counts
+
+
+def dump_json(data: Any) -> bytes:
+    """序列化为与FastAPI JSONResponse一致的JSON字节"""
+    return json.dumps(
+        jsonable_encoder(data),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+
+class CatalogCache:
+    def __init__(self, maxsize: int = CATALOG_CACHE_SIZE, ttl: float = CATALOG_CACHE_TTL):
+        """
+        初始化课程目录响应缓存
+        
+        缓存条目带有写入时的目录版本号，课程/章节写入会递增版本号，
+        旧版本的条目随即失效，无需逐个清理
+        
+        Args:
+            maxsize: 最大缓存条目数
+            ttl: 缓存存活时间(秒)
+        """
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl, name="catalog")
+        self._version = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def version(self) -> int:
+        return self._version
+    
+    def bump(self) -> int:
+        """递增目录版本号，使所有已缓存的响应失效"""
+        with self._lock:
+            self._version += 1
+            return self._version
+    
+    def get(self, key: Tuple) -> Optional[Any]:
+        """获取当前版本的缓存响应，不存在或版本过期时返回None"""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != self._version:
+            return None
+        return entry[1]
+    
+    def set(self, key: Tuple, version: int, value: Any):
+        """
+        缓存响应
+        
+        Args:
+            key: 缓存键（接口 + 筛选条件 + 查看者类别）
+            version: 开始查询数据库前读取的版本号，查询期间目录有写入时该条目不会被命中
+            value: 序列化后的响应（CachedResponse）
+        """
+        self.entries.set(key, (version, value))
+    
+    def clear(self):
+        self.entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        stats = self.entries.stats()
+        stats["version"] = self._version
+        return stats
+
+
+# 进程级单例
+catalog_cache = CatalogCache()
+
+
+# 章节增删改时失效对应课程的章节数
+@event.listens_for(Lesson, "after_insert")
+@event.listens_for(Lesson, "after_update")
+@event.listens_for(Lesson, "after_delete")
+def _invalidate_lesson_count(mapper, connection, target):
+    lesson_count_cache.pop(target.course_id)
+
+
+# 课程/章节写入时递增目录版本号
+# flush时立即递增；提交后再递增一次，避免其他请求在提交前读到旧数据并以新版本号缓存
+@event.listens_for(Course, "after_insert")
+@event.listens_for(Course, "after_update")
+@event.listens_for(Course, "after_delete")
+@event.listens_for(Lesson, "after_insert")
+@event.listens_for(Lesson, "after_update")
+@event.listens_for(Lesson, "after_delete")
+def _bump_catalog_version(mapper, connection, target):
+    catalog_cache.bump()
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["catalog_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_catalog_version_after_commit(session):
+    if session.info.pop("catalog_changed", False):
+        catalog_cache.bump()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_catalog_changed(session):
+    session.info.pop("catalog_changed", None)
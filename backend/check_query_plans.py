@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+热点查询执行计划检查脚本
+在临时SQLite数据库上调用真实的接口和后台任务函数，记录它们执行的全部查询，
+逐条执行EXPLAIN QUERY PLAN，确认都走索引查找而不是全表扫描。
+查询语句直接来自业务代码，不需要在这里另行维护一份副本。
+存在全表扫描时以非零状态码退出，可用于回归检查。
+
+用法:
+    python check_query_plans.py
+"""
+
+import sys
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 使用临时数据库，必须在导入models之前设置
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+# 播放签名和会话加密都在本地计算，检查时使用占位配置即可
+for name, value in (
+    ("SECRET_KEY", "plan-check-secret-key-0123456789"),
+    ("TENCENT_SECRET_ID", "plan-check"), ("TENCENT_SECRET_KEY", "plan-check"),
+    ("TENCENT_VOD_APP_ID", "1"), ("TENCENT_VOD_PLAY_KEY", "plan-check")
+):
+    os.environ.setdefault(name, value)
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import main
+from auth import create_access_token, get_password_hash
+from models import (
+    engine, create_tables, SessionLocal, User, Course, Lesson, UserCourse, Enrollment, VodVideo
+)
+from playback_ingest import flush_playback_buffer
+from resume_positions import resume_position_store, flush_resume_positions
+from playback_rollups import sweep_rollup_viewers
+from session_manager import sweep_expired_sessions
+from vod_service import VodManager
+
+
+# 只检查读取和按条件修改的语句（INSERT没有执行计划可言）
+EXPLAINED_PREFIXES = ("SELECT", "UPDATE", "DELETE")
+
+
+def seed():
+    """写入一套最小数据，让各接口走到完整的查询路径"""
+    db = SessionLocal()
+    try:
+        db.add_all([
+            User(username="student", email="student@example.com",
+                 password_hash=get_password_hash("plan-check"), role="student"),
+            User(username="admin", email="admin@example.com",
+                 password_hash=get_password_hash("plan-check"), role="admin"),
+        ])
+        course = Course(
+            title="执行计划检查", description="", age_range="5-7", stage="启蒙", duration="8课时",
+            icon="", color="", status="published", access_level="premium"
+        )
+        db.add(course)
+        db.flush()
+        
+        lessons = [
+            Lesson(course_id=course.id, title=f"第{i + 1}课", description="", video_url="",
+                   duration=10, sort_order=i, is_free_preview=i == 0)
+            for i in range(3)
+        ]
+        db.add_all(lessons)
+        db.flush()
+        
+        db.add(VodVideo(
+            file_id="5285890000000000000", title="检查视频", course_id=course.id,
+            lesson_id=lessons[1].id, status="ready", duration=60
+        ))
+        db.add(UserCourse(user_id=1, course_id=course.id, progress=0, completed=False))
+        db.add(Enrollment(user_id=1, course_id=course.id, payment_status="paid", payment_amount=0))
+        db.commit()
+    finally:
+        db.close()
+
+
+def hot_paths(client: TestClient):
+    """热点路径：(名称, 调用)，都是真实的路由或后台任务函数"""
+    student = {"Authorization": f"Bearer {create_access_token({'sub': 'student'})}"}
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': 'admin'})}"}
+    start = (datetime.utcnow() - timedelta(days=1)).isoformat()
+    
+    def cookie_session():
+        web = TestClient(main.app, base_url="https://testserver")
+        web.post("/api/auth/web/login", json={"username": "student", "password": "plan-check"})
+        return web.get("/api/auth/web/me")
+    
+    def resume_position():
+        # 清掉读缓存，检查按主键回源数据库的查询
+        resume_position_store.clear()
+        return client.get("/api/vod/playback/resume/1", headers=student)
+    
+    def signature_cleanup():
+        db = SessionLocal()
+        try:
+            return VodManager(db).cleanup_expired_signatures()
+        finally:
+            db.close()
+    
+    return [
+        ("课程列表", lambda: client.get("/api/courses")),
+        ("课程列表（分页）", lambda: client.get("/api/courses?limit=20")),
+        ("课程章节", lambda: client.get("/api/courses/1/lessons", headers=student)),
+        ("课程视频", lambda: client.get("/api/vod/course/1/videos?limit=20", headers=student)),
+        ("播放启动", lambda: client.get("/api/vod/video/1/bootstrap", headers=student)),
+        ("视频详情", lambda: client.get("/api/vod/video/1", headers=student)),
+        ("播放心跳", lambda: client.post(
+            "/api/vod/playback/record",
+            json={"video_id": 1, "play_duration": 15, "progress": 30, "position": 18},
+            headers=student
+        )),
+        ("播放心跳刷盘", flush_playback_buffer),
+        ("续播位置刷盘", flush_resume_positions),
+        ("续播位置", resume_position),
+        ("用户播放历史", lambda: client.get("/api/vod/playback/history", headers=student)),
+        ("更新学习进度", lambda: client.put(
+            "/api/user/courses/1/progress",
+            json={"progress": 40, "lesson_id": 2, "duration": 60},
+            headers=student
+        )),
+        ("学习统计", lambda: client.get("/api/user/stats", headers=student)),
+        ("视频统计", lambda: client.get("/api/vod/statistics/1", headers=admin)),
+        ("播放分析汇总", lambda: client.get(
+            f"/api/vod/analytics/playback?dimension=video&keys=1&granularity=hour&start={start}",
+            headers=admin
+        )),
+        ("Cookie会话", cookie_session),
+        ("过期会话清理", sweep_expired_sessions),
+        ("过期观看人明细清理", sweep_rollup_viewers),
+        ("过期签名清理", signature_cleanup),
+    ]
+
+
+def capture(func):
+    """执行一次调用，返回期间执行的 [(SQL, 参数)]（同一语句只保留第一次）"""
+    statements = {}
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(EXPLAINED_PREFIXES):
+            params = parameters[0] if executemany and parameters else parameters
+            statements.setdefault(statement, params)
+    
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        func()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    
+    return list(statements.items())
+
+
+def explain(statement, parameters):
+    """返回语句的执行计划明细"""
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def main_check():
+    create_tables()
+    seed()
+    client = TestClient(main.app, base_url="https://testserver")
+    
+    failures = 0
+    for name, func in hot_paths(client):
+        statements = capture(func)
+        if not statements:
+            print(f"⚪ {name}（命中缓存或无查询）")
+            continue
+        
+        for statement, parameters in statements:
+            plan = explain(statement, parameters)
+            # SCAN表示全表（或全索引）扫描；SEARCH ... USING INDEX 表示索引查找；
+            # SCAN CONSTANT ROW是IN列表中的常量，不是表扫描
+            scans = [step for step in plan if step.startswith("SCAN") and step != "SCAN CONSTANT ROW"]
+            status = "❌" if scans else "✅"
+            failures += 1 if scans else 0
+            
+            print(f"{status} {name}: {' '.join(statement.split())[:120]}")
+            for step in plan:
+                print(f"     {step}")
+    
+    if failures:
+        print(f"\n{failures} 条热点查询未使用索引")
+        sys.exit(1)
+    
+    print("\n所有热点查询均使用索引查找")
+
+
+if __name__ == "__main__":
+    main_check()
@@ -3,19 +3,46 @@ Web会话依赖注入
 """
 
 from fastapi import Depends, HTTPException, status, Request
+from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
 
 from session_manager import WebSessionManager
 from cookie_utils import CookieManager
 from models import get_db, User
-from auth import get_current_user_optional
+from auth import SECRET_KEY, security, get_user_from_token
+from principal_cache import user_principal_cache
+
+
+# 前端页面来源（CORS白名单；修改数据的请求只接受这些来源携带的Cookie会话）
+FRONTEND_ORIGINS = ["http://localhost:8080", "http://127.0.0.1:8080"]
+
+# 不会产生副作用的请求方法
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def cookie_session_allowed(request: Request) -> bool:
+    """
+    当前请求能否使用Cookie会话认证（防止跨站请求伪造）
+    
+    修改数据的请求带有Origin时，只接受前端来源或同源请求的Cookie；
+    Origin为null（本地文件、沙箱页面）时只能使用Bearer令牌
+    """
+    if request.method in SAFE_METHODS:
+        return True
+    
+    origin = request.headers.get("origin")
+    if origin is None:
+        return True
+    if origin in FRONTEND_ORIGINS:
+        return True
+    return origin != "null" and urlsplit(origin).netloc == request.headers.get("host")
 
 
 # 初始化管理器
 def get_session_manager(db: Session = Depends(get_db)):
     """获取会话管理器"""
-    from auth import SECRET_KEY
     return WebSessionManager(db, SECRET_KEY, session_timeout=3600*24*7)  # 7天
 
 
@@ -24,75 +51,122 @@ def get_cookie_manager():
     return CookieManager()
 
 
-# Web会话依赖
-async def get_web_session(
+class Principal:
+    """一次请求解析出的认证主体"""
+    
+    def __init__(self, user: Optional[User] = None, source: Optional[str] = None,
+                 session: Optional[Dict[str, Any]] = None,
+                 session_user: Optional[User] = None,
+                 token_user: Optional[User] = None):
+        """
+        Args:
+            user: 当前有效用户（匿名时为None）
+            source: 认证来源，session 或 jwt
+            session: Web会话数据（没有有效会话时为None）
+            session_user: Web会话对应的用户（可能已被禁用）
+            token_user: Bearer令牌对应的用户（可能已被禁用）
+        """
+        self.user = user
+        self.source = source
+        self.session = session
+        self.session_user = session_user
+        self.token_user = token_user
+
+
+def resolve_principal(request: Request, db: Session,
+                      credentials: Optional[HTTPAuthorizationCredentials] = None) -> Principal:
+    """
+    解析当前请求的认证主体：优先使用Web Session，其次使用JWT
+    
+    跨站发起的修改数据请求忽略Cookie会话（见cookie_session_allowed）。
+    每个请求只解析一次，结果缓存在request.state上，供所有认证依赖共享
+    """
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        return principal
+    
+    principal = Principal()
+    
+    # 1. 尝试从Web Session获取用户
+    session_id = get_cookie_manager().get_session_id(request)
+    if session_id and cookie_session_allowed(request):
+        session_data = get_session_manager(db).get_session(session_id)
+        if session_data:
+            principal.session = session_data
+            principal.session_user = user_principal_cache.get_by_id(
+                db, session_data["user_id"]
+            )
+            
+            if principal.session_user and principal.session_user.is_active:
+                principal.user = principal.session_user
+                principal.source = "session"
+    
+    # 2. 尝试从JWT获取用户（已有Web Session时也解析，供只接受Bearer令牌的依赖使用）
+    if credentials is not None:
+        principal.token_user = get_user_from_token(db, credentials.credentials)
+        if principal.user is None and principal.token_user and principal.token_user.is_active:
+            principal.user = principal.token_user
+            principal.source = "jwt"
+    
+    request.state.principal = principal
+    return principal
+
+
+def get_principal(
     request: Request,
-    session_manager: WebSessionManager = Depends(get_session_manager),
-    cookie_manager: CookieManager = Depends(get_cookie_manager),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
     db: Session = Depends(get_db)
+) -> Principal:
+    """获取当前请求的认证主体（请求内只解析一次）"""
+    return resolve_principal(request, db, credentials)
+
+
+# Web会话依赖
+async def get_web_session(
+    principal: Principal = Depends(get_principal)
 ) -> Dict[str, Any]:
     """
     获取Web会话（用于需要认证的端点）
     
     如果会话无效，返回401错误
     """
-    # 从Cookie获取会话ID
-    session_id = cookie_manager.get_session_id(request)
-    
-    if not session_id:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="未认证",
-            headers={"WWW-Authenticate": "Cookie"},
-        )
-    
-    # 获取会话数据
-    session_data = session_manager.get_session(session_id)
-    
-    if not session_data:
+    if not principal.session:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="会话已过期或无效",
             headers={"WWW-Authenticate": "Cookie"},
         )
     
-    return session_data
+    return principal.session
 
 
 async def get_web_session_optional(
-    request: Request,
-    session_manager: WebSessionManager = Depends(get_session_manager),
-    cookie_manager: CookieManager = Depends(get_cookie_manager),
-    db: Session = Depends(get_db)
+    principal: Principal = Depends(get_principal)
 ) -> Optional[Dict[str, Any]]:
     """
     获取Web会话（可选，允许匿名访问）
     
     如果会话无效，返回None
     """
-    # 从Cookie获取会话ID
-    session_id = cookie_manager.get_session_id(request)
-    
-    if not session_id:
-        return None
-    
-    # 获取会话数据
-    session_data = session_manager.get_session(session_id)
-    
-    return session_data
+    return principal.session
 
 
 async def get_current_user_from_session(
-    session_data: Dict[str, Any] = Depends(get_web_session),
-    db: Session = Depends(get_db)
+    principal: Principal = Depends(get_principal)
 ) -> User:
     """
     从Web会话获取当前用户
     
     用于替换原有的get_current_user依赖
     """
-    user_id = session_data["user_id"]
-    user = db.query(User).filter(User.id == user_id).first()
+    if not principal.session:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="会话已过期或无效",
+            headers={"WWW-Authenticate": "Cookie"},
+        )
+    
+    user = principal.session_user
     
     if not user:
         raise HTTPException(
@@ -110,58 +184,56 @@ async def get_current_user_from_session(
 
 
 async def get_current_user_from_session_optional(
-    session_data: Optional[Dict[str, Any]] = Depends(get_web_session_optional),
-    db: Session = Depends(get_db)
+    principal: Principal = Depends(get_principal)
 ) -> Optional[User]:
     """
     从Web会话获取当前用户（可选）
     
     用于替换原有的get_current_user_optional依赖
     """
-    if not session_data:
+    if principal.source != "session":
         return None
     
-    user_id = session_data["user_id"]
-    user = db.query(User).filter(User.id == user_id).first()
+    return principal.user
+
+
+# Bearer令牌认证依赖（修改数据的管理接口使用，不接受Cookie会话）
+async def get_current_user_from_token(
+    principal: Principal = Depends(get_principal)
+) -> User:
+    """
+    从Bearer令牌获取当前用户
     
-    if not user or not user.is_active:
-        return None
+    错误响应与auth.get_current_user一致，认证主体与其他认证依赖共享
+    """
+    user = principal.token_user
+    
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无效的认证凭据",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    if not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="用户已被禁用"
+        )
     
     return user
 
 
 # 混合认证依赖（支持Session和JWT）
 async def get_current_user_hybrid(
-    request: Request,
-    db: Session = Depends(get_db),
-    session_manager: WebSessionManager = Depends(get_session_manager),
-    cookie_manager: CookieManager = Depends(get_cookie_manager)
+    principal: Principal = Depends(get_principal)
 ) -> Optional[User]:
     """
     混合认证：优先使用Web Session，其次使用JWT
     
-    用于需要向后兼容的端点
+    允许匿名访问，未登录时返回None
     """
-    # 1. 尝试从Web Session获取用户
-    session_id = cookie_manager.get_session_id(request)
-    if session_id:
-        session_data = session_manager.get_session(session_id)
-        if session_data:
-            user_id = session_data["user_id"]
-            user = db.query(User).filter(User.id == user_id).first()
-            if user and user.is_active:
-                return user
-    
-    # 2. 尝试从JWT获取用户
-    from auth import get_current_user_optional
-    try:
-        user = await get_current_user_optional(request=request, db=db)
-        if user:
-            return user
-    except:
-        pass
-    
-    return None
+    return principal.user
 
 
 async def require_current_user_hybrid(
@@ -176,6 +248,7 @@ async def require_current_user_hybrid(
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="需要登录",
+            headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return current_user
\ No newline at end of file
+    return current_user
@@ -0,0 +1,151 @@
+"""
+用户课程权益
+一次查询出用户已付费和已加入的课程ID集合并缓存，权限检查只需集合查找；
+报名记录/用户课程写入时失效
+"""
+
+import os
+from typing import FrozenSet, Dict, Any
+
+from sqlalchemy import event, inspect, union_all, select, literal
+from sqlalchemy.orm import Session
+
+from cache_utils import TTLCache
+from models import Enrollment, UserCourse
+
+
+# 权益缓存配置
+ENTITLEMENT_CACHE_SIZE = int(os.getenv("ENTITLEMENT_CACHE_SIZE", "4096"))
+ENTITLEMENT_CACHE_TTL = int(os.getenv("ENTITLEMENT_CACHE_TTL", "60"))  # 秒
+
+
+class Entitlements:
+    """用户的课程权益集合"""
+    __slots__ = ("user_id", "paid_course_ids", "enrolled_course_ids")
+    
+    def __init__(self, user_id: int, paid_course_ids: FrozenSet[int], enrolled_course_ids: FrozenSet[int]):
+        self.user_id = user_id
+        self.paid_course_ids = paid_course_ids  # 已支付的报名
+        self.enrolled_course_ids = enrolled_course_ids  # 已加入（user_courses）
+    
+    def has_paid(self, course_id: int) -> bool:
+        return course_id in self.paid_course_ids
+    
+    def has_enrolled(self, course_id: int) -> bool:
+        return course_id in self.enrolled_course_ids
+
+
+class EntitlementResolver:
+    def __init__(self, maxsize: int = ENTITLEMENT_CACHE_SIZE, ttl: float = ENTITLEMENT_CACHE_TTL):
+        """
+        初始化权益解析器
+        
+        Args:
+            maxsize: 最大缓存用户数
+            ttl: 缓存存活时间(秒)
+        """
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl, name="entitlements")
+    
+    def get(self, db: Session, user_id: int) -> Entitlements:
+        """
+        获取用户权益（未缓存时用一次查询加载）
+        
+        Args:
+            db: 数据库会话
+            user_id: 用户ID
+            
+        Returns:
+            用户权益集合
+        """
+        entitlements = self.cache.get(user_id)
+        if entitlements is not None:
+            return entitlements
+        
+        rows = db.execute(union_all(
+            select(literal("paid"), Enrollment.course_id).where(
+                Enrollment.user_id == user_id,
+                Enrollment.payment_status == "paid"
+            ),
+            select(literal("enrolled"), UserCourse.course_id).where(
+                UserCourse.user_id == user_id
+            )
+        )).all()
+        
+        entitlements = Entitlements(
+            user_id,
+            frozenset(course_id for kind, course_id in rows if kind == "paid"),
+            frozenset(course_id for kind, course_id in rows if kind == "enrolled")
+        )
+        self.cache.set(user_id, entitlements)
+        return entitlements
+    
+    def invalidate(self, user_id: int):
+        self.cache.pop(user_id)
+    
+    def clear(self):
+        self.cache.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+
+# 进程级单例
+entitlement_resolver = EntitlementResolver()
+
+
+# 决定权益的字段：只有这些字段变化的更新才需要失效（进度更新不影响权益）
+_ENTITLEMENT_FIELDS = {
+    Enrollment: ("user_id", "course_id", "payment_status"),
+    UserCourse: ("user_id", "course_id"),
+}
+
+
+def _mark_entitlement_user(target):
+    """立即失效，并记录到会话中；提交后再失效一次，避免其他请求在提交前读到旧数据并写回缓存"""
+    entitlement_resolver.invalidate(target.user_id)
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("entitlement_users", set()).add(target.user_id)
+
+
+# 报名/加入课程、删除记录时失效
+@event.listens_for(Enrollment, "after_insert")
+@event.listens_for(Enrollment, "after_delete")
+@event.listens_for(UserCourse, "after_insert")
+@event.listens_for(UserCourse, "after_delete")
+def _invalidate_entitlements(mapper, connection, target):
+    _mark_entitlement_user(target)
+
+
+# 更新时只在权益相关字段变化时失效（进度等字段的更新不影响缓存）
+@event.listens_for(Enrollment, "after_update")
+@event.listens_for(UserCourse, "after_update")
+def _invalidate_entitlements_on_update(mapper, connection, target):
+    state = inspect(target)
+    fields = _ENTITLEMENT_FIELDS[mapper.class_]
+    if not any(state.attrs[name].history.has_changes() for name in fields):
+        return
+    
+    # 记录换了用户时原用户不一定已加载，直接清空全部缓存（极少发生）
+    if state.attrs.user_id.history.has_changes():
+        entitlement_resolver.clear()
+        session = Session.object_session(target)
+        if session is not None:
+            session.info["entitlement_clear"] = True
+        return
+    
+    _mark_entitlement_user(target)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_entitlements_after_commit(session):
+    if session.info.pop("entitlement_clear", False):
+        entitlement_resolver.clear()
+    for user_id in session.info.pop("entitlement_users", ()):
+        entitlement_resolver.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_entitlement_users(session):
+    session.info.pop("entitlement_clear", None)
+    session.info.pop("entitlement_users", None)
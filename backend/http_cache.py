@@ -0,0 +1,86 @@
+"""
+HTTP条件请求工具
+为目录类接口生成强ETag，处理If-None-Match并按课程访问级别设置Cache-Control
+"""
+
+import os
+import hashlib
+from typing import Optional, Dict
+
+from fastapi import Request
+from fastapi.responses import Response
+
+
+# 免费内容允许浏览器/CDN直接复用的时间
+HTTP_CACHE_MAX_AGE = int(os.getenv("HTTP_CACHE_MAX_AGE", "60"))  # 秒
+
+# 访问级别 -> Cache-Control
+# 免费内容可共享缓存；付费内容每次都要向服务器确认（命中ETag时只返回304）；内部内容不进入共享缓存
+CACHE_CONTROL_BY_ACCESS_LEVEL = {
+    "free": f"public, max-age={HTTP_CACHE_MAX_AGE}",
+    "premium": "public, no-cache",
+    "internal": "private, no-cache",
+}
+
+# 内容随登录用户变化的响应
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(body: bytes) -> str:
+    """根据响应体生成强ETag"""
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def cache_control_for(access_level: Optional[str], personalized: bool = False) -> str:
+    """
+    按访问级别选择Cache-Control
+    
+    Args:
+        access_level: 课程访问级别（free/premium/internal）
+        personalized: 响应内容是否因用户而异（管理员视图、按报名过滤的章节等）
+    """
+    if personalized:
+        return PRIVATE_CACHE_CONTROL
+    return CACHE_CONTROL_BY_ACCESS_LEVEL.get(access_level, PRIVATE_CACHE_CONTROL)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match是否命中（按RFC 7232使用弱比较）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class CachedResponse:
+    """序列化好的JSON响应体及其ETag、Cache-Control"""
+    __slots__ = ("body", "etag", "cache_control", "vary", "headers")
+    
+    def __init__(self, body: bytes, cache_control: str, vary: Optional[str] = None,
+                 headers: Optional[Dict[str, str]] = None):
+        self.body = body
+        self.etag = make_etag(body)
+        self.cache_control = cache_control
+        self.vary = vary
+        self.headers = headers
+    
+    def to_response(self, request: Request) -> Response:
+        """生成响应，客户端缓存仍有效时返回304"""
+        headers = {"ETag": self.etag, "Cache-Control": self.cache_control}
+        if self.vary:
+            headers["Vary"] = self.vary
+        if self.headers:
+            headers.update(self.headers)
+        
+        if etag_matches(request, self.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
@@ -0,0 +1,387 @@
+"""
+用户学习统计汇总
+学习进度、报名、视频播放写入时在同一事务内增量更新user_learning_stats，
+/api/user/stats 只需按主键读取一行，不再扫描全部学习记录
+"""
+
+from datetime import datetime, date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import func, update, case, or_, bindparam, Date, DateTime, Integer
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import UserLearningStats, UserCourse, Enrollment, LearningRecord, VideoPlayRecord
+
+
+def _to_date(value) -> Optional[date]:
+    """func.date() 在SQLite返回字符串，在MySQL/PostgreSQL返回date"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _apply_learning_day(stats: UserLearningStats, day: date):
+    """把某天计入学习天数并更新连续学习天数（早于最近学习日的日期不影响连续天数）"""
+    last = stats.last_learning_date
+    if last is not None and day <= last:
+        return
+    
+    if last is not None and day - last == timedelta(days=1):
+        stats.current_streak += 1
+    else:
+        stats.current_streak = 1
+    
+    stats.learning_days += 1
+    stats.longest_streak = max(stats.longest_streak, stats.current_streak)
+    stats.last_learning_date = day
+
+
+def _learning_day_updates(day, previous_day=None) -> list:
+    """
+    把某天计入学习天数的SQL赋值（规则同_apply_learning_day）
+    
+    MySQL按顺序执行赋值、后面的表达式会读到前面已更新的列，
+    因此每个表达式只依赖排在它后面（尚未更新）的列
+    
+    Args:
+        day: 学习日期，批量更新时为绑定参数
+        previous_day: 前一天，day为绑定参数时必须同时传入
+    """
+    table = UserLearningStats.__table__.c
+    if previous_day is None:
+        previous_day = day - timedelta(days=1)
+    
+    is_new_day = or_(table.last_learning_date.is_(None), table.last_learning_date < day)
+    streak = case(
+        (table.last_learning_date == previous_day, table.current_streak + 1),
+        else_=1
+    )
+    return [
+        (table.longest_streak, case(
+            (is_new_day & (streak > table.longest_streak), streak),
+            else_=table.longest_streak
+        )),
+        (table.current_streak, case((is_new_day, streak), else_=table.current_streak)),
+        (table.learning_days, table.learning_days + case((is_new_day, 1), else_=0)),
+        (table.last_learning_date, case((is_new_day, day), else_=table.last_learning_date)),
+    ]
+
+
+def _update_learning_stats(db: Session, user_id: int, values: list):
+    """
+    在数据库中原子地更新统计行（SET col = col + delta，并发写入不会互相覆盖）
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        values: (列, 新值表达式) 列表，按顺序赋值
+    """
+    ensure_learning_stats(db, user_id)
+    db.execute(
+        update(UserLearningStats)
+        .where(UserLearningStats.user_id == user_id)
+        .ordered_values(*values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def build_learning_stats(db: Session, user_id: int) -> UserLearningStats:
+    """
+    从历史数据重新计算用户学习统计（首次访问时回填，或数据修复时使用）
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        
+    Returns:
+        未加入会话的统计对象
+    """
+    return build_learning_stats_batch(db, [user_id])[user_id]
+
+
+def build_learning_stats_batch(db: Session, user_ids: Iterable[int]) -> Dict[int, UserLearningStats]:
+    """
+    从历史数据批量重新计算多个用户的学习统计
+    
+    每项汇总按user_id分组一次查询，查询次数与用户数量无关
+    
+    Args:
+        db: 数据库会话
+        user_ids: 用户ID列表
+        
+    Returns:
+        {用户ID: 未加入会话的统计对象}
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    
+    course_totals = {
+        row[0]: row[1:]
+        for row in db.query(
+            UserCourse.user_id,
+            func.count(UserCourse.id),
+            func.coalesce(func.sum(UserCourse.progress), 0)
+        ).filter(UserCourse.user_id.in_(user_ids)).group_by(UserCourse.user_id)
+    }
+    
+    completed_courses = dict(
+        db.query(UserCourse.user_id, func.count(UserCourse.id)).filter(
+            UserCourse.user_id.in_(user_ids),
+            UserCourse.completed == True
+        ).group_by(UserCourse.user_id).all()
+    )
+    
+    paid_enrollments = dict(
+        db.query(Enrollment.user_id, func.count(Enrollment.id)).filter(
+            Enrollment.user_id.in_(user_ids),
+            Enrollment.payment_status == "paid"
+        ).group_by(Enrollment.user_id).all()
+    )
+    
+    record_totals = {
+        row[0]: row[1:]
+        for row in db.query(
+            LearningRecord.user_id,
+            func.coalesce(func.sum(LearningRecord.duration), 0),
+            func.max(LearningRecord.created_at)
+        ).filter(LearningRecord.user_id.in_(user_ids)).group_by(LearningRecord.user_id)
+    }
+    
+    play_totals = {
+        row[0]: row[1:]
+        for row in db.query(
+            VideoPlayRecord.user_id,
+            func.coalesce(func.sum(VideoPlayRecord.play_duration), 0),
+            func.max(VideoPlayRecord.ended_at)
+        ).filter(VideoPlayRecord.user_id.in_(user_ids)).group_by(VideoPlayRecord.user_id)
+    }
+    
+    # 学习日期：学习记录时间 + 播放记录的开始/结束时间
+    days = {user_id: set() for user_id in user_ids}
+    for column, owner in (
+        (LearningRecord.created_at, LearningRecord.user_id),
+        (VideoPlayRecord.started_at, VideoPlayRecord.user_id),
+        (VideoPlayRecord.ended_at, VideoPlayRecord.user_id),
+    ):
+        rows = db.query(owner, func.date(column)).filter(owner.in_(user_ids), column.isnot(None)).distinct()
+        for user_id, day in rows:
+            days[user_id].add(_to_date(day))
+    
+    result = {}
+    for user_id in user_ids:
+        courses = course_totals.get(user_id, (0, 0))
+        records = record_totals.get(user_id, (0, None))
+        plays = play_totals.get(user_id, (0, None))
+        activity = [value for value in (records[1], plays[1]) if value is not None]
+        
+        stats = UserLearningStats(
+            user_id=user_id,
+            total_courses=courses[0],
+            completed_courses=completed_courses.get(user_id, 0),
+            progress_sum=int(courses[1]),
+            paid_enrollments=paid_enrollments.get(user_id, 0),
+            total_learning_seconds=int(records[0]) + int(plays[0]),
+            learning_days=0,
+            current_streak=0,
+            longest_streak=0,
+            last_learning_date=None,
+            last_activity_at=max(activity) if activity else None
+        )
+        for day in sorted(days[user_id] - {None}):
+            _apply_learning_day(stats, day)
+        result[user_id] = stats
+    
+    return result
+
+
+def _insert_ignore(db: Session, rows: List[dict]):
+    """按数据库类型生成忽略主键冲突的多行INSERT语句"""
+    table = UserLearningStats.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        return mysql_insert(table).values(rows).prefix_with("IGNORE")
+    if dialect == "postgresql":
+        return postgresql_insert(table).values(rows).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite_insert(table).values(rows).on_conflict_do_nothing()
+    raise ValueError(f"不支持的数据库类型: {dialect}")
+
+
+def _backfill_learning_stats(db: Session, user_ids: Iterable[int]) -> int:
+    """
+    从历史数据回填统计行（不提交）
+    
+    回填时禁用autoflush：会话中尚未写入的本次变更不计入回填结果，
+    由调用方随后按增量补上，避免重复计算。
+    并发回填时INSERT忽略主键冲突，只保留先写入的一行
+    
+    Returns:
+        写入的新统计行数量
+    """
+    with db.no_autoflush:
+        rows = [
+            {
+                column.key: getattr(stats, column.key)
+                for column in UserLearningStats.__table__.columns
+                if column.key != "updated_at"
+            }
+            for stats in build_learning_stats_batch(db, user_ids).values()
+        ]
+        if not rows:
+            return 0
+        return db.execute(_insert_ignore(db, rows)).rowcount
+
+
+def ensure_learning_stats(db: Session, user_ids):
+    """
+    写路径使用：统计行不存在时回填，与本次写入同一事务提交
+    
+    Args:
+        db: 数据库会话
+        user_ids: 用户ID，或用户ID列表（一次查询确认全部用户的统计行）
+    """
+    user_ids = {user_ids} if isinstance(user_ids, int) else set(user_ids)
+    existing = {
+        row[0]
+        for row in db.query(UserLearningStats.user_id).filter(UserLearningStats.user_id.in_(user_ids))
+    }
+    missing = user_ids - existing
+    if missing:
+        _backfill_learning_stats(db, missing)
+
+
+def get_learning_stats(db: Session, user_id: int) -> UserLearningStats:
+    """
+    读路径使用：获取用户学习统计行，不存在时回填并立即提交
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        
+    Returns:
+        绑定到当前会话的统计对象
+    """
+    stats = db.get(UserLearningStats, user_id)
+    if stats is None:
+        if _backfill_learning_stats(db, [user_id]):
+            db.commit()
+        stats = db.get(UserLearningStats, user_id)
+    return stats
+
+
+def record_enrollment(db: Session, user_id: int, paid: bool):
+    """报名课程时更新统计（与报名记录同一事务提交）"""
+    _update_learning_stats(db, user_id, [
+        (UserLearningStats.total_courses, UserLearningStats.total_courses + 1),
+        (UserLearningStats.paid_enrollments, UserLearningStats.paid_enrollments + int(paid)),
+    ])
+
+
+def record_course_progress(db: Session, user_id: int,
+                           old_progress: int, new_progress: int,
+                           was_completed: bool, now_completed: bool):
+    """课程进度变化时更新统计（与进度更新同一事务提交）"""
+    progress_delta = (new_progress or 0) - (old_progress or 0)
+    completed_delta = int(bool(now_completed)) - int(bool(was_completed))
+    if not progress_delta and not completed_delta:
+        return
+    
+    _update_learning_stats(db, user_id, [
+        (UserLearningStats.progress_sum, UserLearningStats.progress_sum + progress_delta),
+        (UserLearningStats.completed_courses, UserLearningStats.completed_courses + completed_delta),
+    ])
+
+
+def record_learning_activity(db: Session, user_id: int, seconds: int,
+                             at: Optional[datetime] = None):
+    """
+    记录一次学习行为（学习记录或视频播放），累计时长并更新学习天数
+    
+    Args:
+        db: 数据库会话
+        user_id: 用户ID
+        seconds: 本次学习时长（秒）
+        at: 学习时间，默认当前UTC时间
+    """
+    at = at or datetime.utcnow()
+    record_learning_activities(db, {user_id: {"seconds": seconds, "at": at, "days": {at.date()}}})
+
+
+def record_learning_activities(db: Session, activities: Dict[int, Dict[str, Any]]):
+    """
+    批量记录多个用户的学习行为（播放心跳刷盘使用）
+    
+    缺失的统计行一次回填，各用户的累计时长和学习天数用一条executemany的UPDATE写入，
+    语句数量与用户数量无关
+    
+    Args:
+        db: 数据库会话
+        activities: {用户ID: {"seconds": 学习时长, "at": 最后学习时间, "days": 学习日期集合}}
+    """
+    if not activities:
+        return
+    
+    ensure_learning_stats(db, activities.keys())
+    
+    table = UserLearningStats.__table__
+    day_updates = _learning_day_updates(
+        bindparam("day", type_=Date), bindparam("previous_day", type_=Date)
+    )
+    
+    # 同一批跨越多天时，较早的日期逐轮先计入（每轮每个用户一天），最后一天随时长一起更新
+    earlier = {
+        user_id: sorted(activity["days"])[:-1]
+        for user_id, activity in activities.items()
+        if len(activity["days"]) > 1
+    }
+    for index in range(max((len(days) for days in earlier.values()), default=0)):
+        db.execute(
+            update(table).where(table.c.user_id == bindparam("uid")).ordered_values(*day_updates),
+            [
+                {"uid": user_id, "day": days[index], "previous_day": days[index] - timedelta(days=1)}
+                for user_id, days in earlier.items()
+                if len(days) > index
+            ]
+        )
+    
+    at = bindparam("at", type_=DateTime)
+    last_activity = table.c.last_activity_at
+    db.execute(
+        update(table).where(table.c.user_id == bindparam("uid")).ordered_values(
+            (table.c.total_learning_seconds, table.c.total_learning_seconds + bindparam("seconds", type_=Integer)),
+            (last_activity, case((or_(last_activity.is_(None), last_activity < at), at), else_=last_activity)),
+            *day_updates,
+        ),
+        [
+            {
+                "uid": user_id,
+                "seconds": max(0, int(activity["seconds"] or 0)),
+                "at": activity["at"],
+                "day": max(activity["days"]),
+                "previous_day": max(activity["days"]) - timedelta(days=1)
+            }
+            for user_id, activity in activities.items()
+        ]
+    )
+
+
+def current_streak(stats: UserLearningStats, today: Optional[date] = None) -> int:
+    """截止今天的连续学习天数（最近学习日早于昨天时连续中断，返回0）"""
+    today = today or datetime.utcnow().date()
+    if stats.last_learning_date is None or stats.last_learning_date < today - timedelta(days=1):
+        return 0
+    return stats.current_streak
+
+
+def rebuild_learning_stats(db: Session, user_ids: Iterable[int]):
+    """按历史数据重建统计（直接改库、导入数据后使用），调用方负责提交"""
+    for stats in build_learning_stats_batch(db, user_ids).values():
+        db.merge(stats)
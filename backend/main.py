@@ -5,29 +5,56 @@
 
 from fastapi import FastAPI, HTTPException, Depends, status, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 from datetime import datetime
+import os
+import anyio
 import uvicorn
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, text
 
 # 导入自定义模块
-from models import get_db, create_tables, User, Course, UserCourse, Lesson, Enrollment, LearningRecord
+from models import get_db, create_tables, get_pool_stats, User, Course, UserCourse, Lesson, Enrollment, LearningRecord
 from auth import (
-    get_current_user, get_current_user_optional, authenticate_user, create_access_token,
-    get_password_hash, check_video_access, generate_video_token,
-    security
+    authenticate_user_async, create_access_token,
+    get_password_hash_async, check_video_access, generate_video_token,
+    security, password_hash_pool
 )
 from vod_api import router as vod_router
 from dependencies import (
     get_session_manager, get_cookie_manager,
     get_current_user_from_session, get_current_user_from_session_optional,
-    get_current_user_hybrid, require_current_user_hybrid
+    get_current_user_hybrid, require_current_user_hybrid, get_current_user_from_token,
+    FRONTEND_ORIGINS
+)
+from session_manager import (
+    WebSessionManager, session_sweeper, sweep_expired_sessions, SESSION_SWEEP_INTERVAL_SECONDS
+)
+from session_store import (
+    session_store, activity_tracker, flush_session_activity, SESSION_ACTIVITY_FLUSH_SECONDS
 )
-from session_manager import WebSessionManager
 from cookie_utils import CookieManager
+from background import PeriodicTask
+from principal_cache import user_principal_cache
+from catalog import get_lesson_counts, catalog_cache, dump_json
+from http_cache import CachedResponse, cache_control_for
+from entitlements import entitlement_resolver
+from signature_cache import play_signature_cache
+from vod_service import video_stats_cache, playback_history_cache
+from playback_rollups import sweep_rollup_viewers, ROLLUP_SWEEP_INTERVAL_SECONDS
+from resume_positions import resume_position_store, flush_resume_positions, RESUME_POSITION_FLUSH_SECONDS
+from playback_ingest import playback_buffer, flush_playback_buffer, PLAYBACK_FLUSH_SECONDS
+from pagination import (
+    MAX_PAGE_SIZE, NEXT_CURSOR_HEADER,
+    paginate, parse_fields, project_columns, cursor_headers
+)
+from learning_stats import (
+    get_learning_stats, current_streak, record_enrollment,
+    record_course_progress, record_learning_activity
+)
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -41,11 +68,11 @@ app = FastAPI(
 # 配置CORS - 允许特定来源（支持HttpOnly Cookie）
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:8080", "http://127.0.0.1:8080", "null"],  # 允许前端来源，包括本地文件
+    allow_origins=[*FRONTEND_ORIGINS, "null"],  # 允许前端来源，包括本地文件（本地文件页面修改数据需使用Bearer令牌）
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],  # 允许所有请求头
-    expose_headers=["Set-Cookie", "Content-Disposition"],  # 允许前端访问Set-Cookie头
+    expose_headers=["Set-Cookie", "Content-Disposition", NEXT_CURSOR_HEADER],  # 允许前端访问Set-Cookie头和分页游标
     max_age=3600,  # 预检请求缓存时间
 )
 
@@ -107,6 +134,10 @@ class CourseResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+# 课程列表分页排序键：(列, 是否降序)，与原有的 sort_order, created_at DESC 顺序一致，id保证唯一
+COURSE_PAGE_KEYS = [(Course.sort_order, False), (Course.created_at, True), (Course.id, True)]
+COURSE_FIELDS = list(CourseResponse.model_fields)
+
 class LessonCreate(BaseModel):
     title: str
     description: str
@@ -125,6 +156,9 @@ class LessonResponse(BaseModel):
     sort_order: int
     created_at: datetime
 
+LESSON_PAGE_KEYS = [(Lesson.sort_order, False), (Lesson.created_at, False), (Lesson.id, False)]
+LESSON_FIELDS = list(LessonResponse.model_fields)
+
 class EnrollmentCreate(BaseModel):
     course_id: int
     payment_method: Optional[str] = None
@@ -142,17 +176,71 @@ class VideoAccessResponse(BaseModel):
     action: Optional[str] = None
     price: Optional[float] = None
 
+# 同步路由和数据库操作所用线程池的大小
+DB_THREADPOOL_SIZE = int(os.getenv("DB_THREADPOOL_SIZE", "40"))
+
+# 后台维护任务
+session_activity_task = PeriodicTask(
+    "session-activity-flush",
+    flush_session_activity,
+    interval=SESSION_ACTIVITY_FLUSH_SECONDS,
+    run_on_stop=True
+)
+session_sweep_task = PeriodicTask(
+    "session-sweeper",
+    sweep_expired_sessions,
+    interval=SESSION_SWEEP_INTERVAL_SECONDS
+)
+playback_flush_task = PeriodicTask(
+    "playback-flush",
+    flush_playback_buffer,
+    interval=PLAYBACK_FLUSH_SECONDS,
+    run_on_stop=True
+)
+# 心跳缓冲写满时提前唤醒刷盘任务，不在请求线程中写库
+playback_buffer.on_full = playback_flush_task.wake
+resume_flush_task = PeriodicTask(
+    "resume-position-flush",
+    flush_resume_positions,
+    interval=RESUME_POSITION_FLUSH_SECONDS,
+    run_on_stop=True
+)
+rollup_sweep_task = PeriodicTask(
+    "rollup-viewer-sweeper",
+    sweep_rollup_viewers,
+    interval=ROLLUP_SWEEP_INTERVAL_SECONDS
+)
+
 # 初始化数据库
 @app.on_event("startup")
-def startup_event():
-    """应用启动时创建数据库表"""
+async def startup_event():
+    """应用启动时创建数据库表并启动后台任务"""
     create_tables()
     print("数据库表已创建")
+    
+    anyio.to_thread.current_default_thread_limiter().total_tokens = DB_THREADPOOL_SIZE
+    
+    session_activity_task.start()
+    session_sweep_task.start()
+    playback_flush_task.start()
+    resume_flush_task.start()
+    rollup_sweep_task.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止后台任务（会话活动时间、播放心跳和续播位置最后刷盘一次）"""
+    await session_sweep_task.stop()
+    await rollup_sweep_task.stop()
+    await session_activity_task.stop()
+    await playback_flush_task.stop()
+    await resume_flush_task.stop()
 
 # 注册腾讯云点播API路由
 app.include_router(vod_router)
 
 # API路由
+# 访问数据库的路由使用同步def定义，由FastAPI在线程池中执行，避免阻塞事件循环；
+# 需要await的路由通过run_in_threadpool执行数据库操作
 @app.get("/")
 async def root():
     """API根路径"""
@@ -164,7 +252,7 @@ async def root():
     }
 
 @app.get("/api/health")
-async def health_check(db: Session = Depends(get_db)):
+def health_check(db: Session = Depends(get_db)):
     """健康检查"""
     try:
         # 测试数据库连接 - 使用text()包装SQL
@@ -185,9 +273,11 @@ async def health_check(db: Session = Depends(get_db)):
 async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     """用户注册"""
     # 检查用户名是否已存在
-    existing_user = db.query(User).filter(
-        or_(User.username == user_data.username, User.email == user_data.email)
-    ).first()
+    existing_user = await run_in_threadpool(
+        lambda: db.query(User).filter(
+            or_(User.username == user_data.username, User.email == user_data.email)
+        ).first()
+    )
     
     if existing_user:
         raise HTTPException(
@@ -199,15 +289,18 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     new_user = User(
         username=user_data.username,
         email=user_data.email,
-        password_hash=get_password_hash(user_data.password),
+        password_hash=await get_password_hash_async(user_data.password),
         full_name=user_data.full_name,
         role="student",
         is_active=True
     )
     
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    def save_user():
+        db.add(new_user)
+        db.commit()
+        db.refresh(new_user)
+    
+    await run_in_threadpool(save_user)
     
     # 创建访问令牌
     access_token = create_access_token(data={"sub": new_user.username})
@@ -233,7 +326,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
 @app.post("/api/auth/login", response_model=Token)
 async def login(login_data: UserLogin, db: Session = Depends(get_db)):
     """用户登录"""
-    user = authenticate_user(db, login_data.username, login_data.password)
+    user = await authenticate_user_async(db, login_data.username, login_data.password)
     
     if not user:
         raise HTTPException(
@@ -264,7 +357,7 @@ async def login(login_data: UserLogin, db: Session = Depends(get_db)):
     )
 
 @app.get("/api/users/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: User = Depends(require_current_user_hybrid)):
     """获取当前用户信息"""
     return UserResponse(
         id=current_user.id,
@@ -279,15 +372,32 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 
 # 课程管理API
 @app.get("/api/courses", response_model=List[CourseResponse])
-async def get_courses(
+def get_courses(
+    request: Request,
     age_range: Optional[str] = Query(None, description="年龄段筛选"),
     stage: Optional[str] = Query(None, description="成长阶段筛选"),
     access_level: Optional[str] = Query(None, description="访问级别筛选"),
     status: str = Query("published", description="课程状态"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页响应头X-Next-Cursor）"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页条数，不传且不带游标时返回全部"),
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，如 id,title,icon"),
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional)
+    current_user: Optional[User] = Depends(get_current_user_hybrid)
 ):
-    """获取课程列表，支持筛选 - 所有人都可访问"""
+    """获取课程列表，支持筛选和游标分页 - 所有人都可访问"""
+    is_admin = current_user is not None and current_user.role == "admin"
+    requested = parse_fields(fields, COURSE_FIELDS)
+    
+    # 命中缓存时直接返回序列化好的响应体，不查询数据库
+    cache_key = (
+        "courses", status, age_range, stage, access_level, is_admin,
+        cursor, limit, tuple(requested) if requested else None
+    )
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return cached.to_response(request)
+    
+    version = catalog_cache.version
     query = db.query(Course).filter(Course.status == status)
     
     # 应用筛选条件
@@ -299,36 +409,61 @@ async def get_courses(
         query = query.filter(Course.access_level == access_level)
     
     # 非管理员只能看到非内部课程
-    if not current_user or current_user.role != "admin":
+    if not is_admin:
         query = query.filter(Course.access_level != "internal")
     
-    courses = query.order_by(Course.sort_order, Course.created_at.desc()).all()
-    
-    return [
-        CourseResponse(
-            id=course.id,
-            title=course.title,
-            description=course.description,
-            short_description=course.short_description,
-            age_range=course.age_range,
-            stage=course.stage,
-            duration=course.duration,
-            icon=course.icon,
-            color=course.color,
-            cover_image=course.cover_image,
-            video_url=course.video_url,
-            access_level=course.access_level,
-            price=course.price,
-            status=course.status,
-            created_at=course.created_at,
-            updated_at=course.updated_at
-        )
-        for course in courses
-    ]
+    # 只加载请求的列（不请求description时不读取大文本列）
+    columns = project_columns(Course, requested, COURSE_PAGE_KEYS)
+    if columns is not None:
+        query = query.options(columns)
+    
+    courses, next_cursor = paginate(query, COURSE_PAGE_KEYS, cursor, limit)
+    
+    if requested is not None:
+        body = dump_json([{name: getattr(course, name) for name in requested} for course in courses])
+    else:
+        body = dump_json([
+            CourseResponse(
+                id=course.id,
+                title=course.title,
+                description=course.description,
+                short_description=course.short_description,
+                age_range=course.age_range,
+                stage=course.stage,
+                duration=course.duration,
+                icon=course.icon,
+                color=course.color,
+                cover_image=course.cover_image,
+                video_url=course.video_url,
+                access_level=course.access_level,
+                price=course.price,
+                status=course.status,
+                created_at=course.created_at,
+                updated_at=course.updated_at
+            )
+            for course in courses
+        ])
+    
+    # 管理员视图包含内部课程，不进入共享缓存
+    cached = CachedResponse(
+        body,
+        cache_control_for(access_level or "free", personalized=is_admin),
+        vary="Authorization, Cookie",
+        headers=cursor_headers(next_cursor)
+    )
+    catalog_cache.set(cache_key, version, cached)
+    
+    return cached.to_response(request)
 
 @app.get("/api/courses/{course_id}", response_model=CourseResponse)
-async def get_course(course_id: int, db: Session = Depends(get_db)):
+def get_course(course_id: int, request: Request, db: Session = Depends(get_db)):
     """获取单个课程详情"""
+    cache_key = ("course", course_id)
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return cached.to_response(request)
+    
+    version = catalog_cache.version
     course = db.query(Course).filter(Course.id == course_id).first()
     
     if not course:
@@ -337,7 +472,7 @@ async def get_course(course_id: int, db: Session = Depends(get_db)):
             detail="课程不存在"
         )
     
-    return CourseResponse(
+    body = dump_json(CourseResponse(
         id=course.id,
         title=course.title,
         description=course.description,
@@ -354,16 +489,27 @@ async def get_course(course_id: int, db: Session = Depends(get_db)):
         status=course.status,
         created_at=course.created_at,
         updated_at=course.updated_at
-    )
+    ))
+    
+    cached = CachedResponse(body, cache_control_for(course.access_level))
+    catalog_cache.set(cache_key, version, cached)
+    
+    return cached.to_response(request)
 
 # 课程章节API
 @app.get("/api/courses/{course_id}/lessons", response_model=List[LessonResponse])
-async def get_course_lessons(
+def get_course_lessons(
     course_id: int,
+    request: Request,
+    cursor: Optional[str] = Query(None, description="分页游标（上一页响应头X-Next-Cursor）"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页条数，不传且不带游标时返回全部"),
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，如 id,title,duration"),
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional)
+    current_user: Optional[User] = Depends(get_current_user_hybrid)
 ):
     """获取课程章节列表 - 允许匿名访问，但会根据权限过滤内容"""
+    requested = parse_fields(fields, LESSON_FIELDS)
+    version = catalog_cache.version
     course = db.query(Course).filter(Course.id == course_id).first()
     
     if not course:
@@ -375,43 +521,64 @@ async def get_course_lessons(
     # 检查课程访问权限
     permission_info = check_video_access(current_user, course)
     
-    # 获取所有章节
-    lessons_query = db.query(Lesson).filter(
-        Lesson.course_id == course_id
-    ).order_by(Lesson.sort_order)
-    
-    lessons = lessons_query.all()
-    
-    # 根据权限过滤章节
-    filtered_lessons = []
-    for lesson in lessons:
-        # 检查该章节的访问权限
-        lesson_permission_info = check_video_access(current_user, course, lesson)
-        if lesson_permission_info["has_access"]:
-            filtered_lessons.append(lesson)
-    
-    return [
-        LessonResponse(
-            id=lesson.id,
-            course_id=lesson.course_id,
-            title=lesson.title,
-            description=lesson.description,
-            video_url=lesson.video_url,
-            duration=lesson.duration,
-            is_free_preview=lesson.is_free_preview,
-            sort_order=lesson.sort_order,
-            created_at=lesson.created_at
-        )
-        for lesson in filtered_lessons
-    ]
+    # 有课程权限时返回全部章节，否则只返回免费预览章节，两种视图分别缓存
+    viewer = "full" if permission_info["has_access"] else "preview"
+    cache_key = (
+        "lessons", course_id, viewer,
+        cursor, limit, tuple(requested) if requested else None
+    )
+    cached = catalog_cache.get(cache_key)
+    if cached is not None:
+        return cached.to_response(request)
+    
+    lessons_query = db.query(Lesson).filter(Lesson.course_id == course_id)
+    
+    # 根据权限过滤章节：没有课程权限时只能看到免费预览章节（与check_video_access的章节规则一致）
+    if viewer == "preview":
+        lessons_query = lessons_query.filter(Lesson.is_free_preview == True)
+    
+    columns = project_columns(Lesson, requested, LESSON_PAGE_KEYS)
+    if columns is not None:
+        lessons_query = lessons_query.options(columns)
+    
+    lessons, next_cursor = paginate(lessons_query, LESSON_PAGE_KEYS, cursor, limit)
+    
+    if requested is not None:
+        body = dump_json([{name: getattr(lesson, name) for name in requested} for lesson in lessons])
+    else:
+        body = dump_json([
+            LessonResponse(
+                id=lesson.id,
+                course_id=lesson.course_id,
+                title=lesson.title,
+                description=lesson.description,
+                video_url=lesson.video_url,
+                duration=lesson.duration,
+                is_free_preview=lesson.is_free_preview,
+                sort_order=lesson.sort_order,
+                created_at=lesson.created_at
+            )
+            for lesson in lessons
+        ])
+    
+    # 付费课程的完整章节列表只对已报名用户可见，不进入共享缓存
+    cached = CachedResponse(
+        body,
+        cache_control_for(course.access_level, personalized=course.access_level != "free" and viewer == "full"),
+        vary="Authorization, Cookie",
+        headers=cursor_headers(next_cursor)
+    )
+    catalog_cache.set(cache_key, version, cached)
+    
+    return cached.to_response(request)
 
 # 视频访问API
 @app.get("/api/video/access/{course_id}", response_model=VideoAccessResponse)
-async def get_video_access(
+def get_video_access(
     course_id: int,
     lesson_id: Optional[int] = Query(None, description="章节ID"),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(require_current_user_hybrid)
 ):
     """获取视频访问权限和令牌"""
     course = db.query(Course).filter(Course.id == course_id).first()
@@ -463,21 +630,25 @@ async def get_video_access(
 
 # 用户课程管理API
 @app.get("/api/user/courses")
-async def get_user_courses(
+def get_user_courses(
     db: Session = Depends(get_db),
     current_user: User = Depends(require_current_user_hybrid)  # 使用混合认证
 ):
     """获取用户的课程"""
-    user_courses = db.query(UserCourse).filter(
+    # 一次联表查询获取用户课程及课程信息
+    user_courses = db.query(UserCourse, Course).join(
+        Course, Course.id == UserCourse.course_id
+    ).filter(
         UserCourse.user_id == current_user.id
     ).all()
     
+    # 课程章节数（缓存，未命中时一次GROUP BY查询）
+    lesson_counts = get_lesson_counts(db, [course.id for _, course in user_courses])
+    
     result = []
-    for uc in user_courses:
-        course = db.query(Course).filter(Course.id == uc.course_id).first()
+    for uc, course in user_courses:
         if course:
-            # 获取课程章节数
-            lesson_count = db.query(Lesson).filter(Lesson.course_id == course.id).count()
+            lesson_count = lesson_counts.get(course.id, 0)
             
             result.append({
                 "course": CourseResponse(
@@ -508,11 +679,11 @@ async def get_user_courses(
     return result
 
 @app.post("/api/user/courses/{course_id}/enroll")
-async def enroll_course(
+def enroll_course(
     course_id: int,
     enrollment_data: EnrollmentCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user_from_token)  # 修改数据只接受Bearer令牌
 ):
     """用户报名课程"""
     course = db.query(Course).filter(Course.id == course_id).first()
@@ -554,6 +725,7 @@ async def enroll_course(
     
     db.add(new_enrollment)
     db.add(new_user_course)
+    record_enrollment(db, current_user.id, paid=new_enrollment.payment_status == "paid")
     db.commit()
     
     return {
@@ -563,11 +735,11 @@ async def enroll_course(
     }
 
 @app.put("/api/user/courses/{course_id}/progress")
-async def update_course_progress(
+def update_course_progress(
     course_id: int,
     progress_data: ProgressUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(require_current_user_hybrid)
 ):
     """更新课程进度"""
     user_course = db.query(UserCourse).filter(
@@ -581,6 +753,9 @@ async def update_course_progress(
             detail="未找到该课程"
         )
     
+    old_progress = user_course.progress
+    was_completed = user_course.completed
+    
     # 更新进度
     user_course.progress = max(0, min(100, progress_data.progress))
     user_course.completed = user_course.progress >= 100
@@ -600,7 +775,14 @@ async def update_course_progress(
             duration=progress_data.duration or 0
         )
         db.add(learning_record)
+        record_learning_activity(db, current_user.id, learning_record.duration, user_course.last_accessed_at)
     
+    # 学习统计与进度同一事务提交
+    record_course_progress(
+        db, current_user.id,
+        old_progress, user_course.progress,
+        was_completed, user_course.completed
+    )
     db.commit()
     
     return {
@@ -612,62 +794,35 @@ async def update_course_progress(
 
 # 学习统计API
 @app.get("/api/user/stats")
-async def get_user_stats(
+def get_user_stats(
     db: Session = Depends(get_db),
     current_user: User = Depends(require_current_user_hybrid)  # 使用混合认证
 ):
-    """获取用户学习统计"""
-    # 获取用户课程
-    user_courses = db.query(UserCourse).filter(
-        UserCourse.user_id == current_user.id
-    ).all()
-    
-    # 获取学习记录
-    learning_records = db.query(LearningRecord).filter(
-        LearningRecord.user_id == current_user.id
-    ).all()
-    
-    # 计算统计
-    total_courses = len(user_courses)
-    completed_courses = len([uc for uc in user_courses if uc.completed])
-    ongoing_courses = total_courses - completed_courses
-    
-    # 计算平均进度
-    total_progress = sum(uc.progress for uc in user_courses)
-    average_progress = round(total_progress / max(total_courses, 1), 1)
+    """获取用户学习统计（读取增量维护的汇总行，首次访问时从历史数据回填）"""
+    stats = get_learning_stats(db, current_user.id)
     
-    # 计算总学习时长
-    total_duration = sum(record.duration for record in learning_records if record.duration)
-    total_hours = round(total_duration / 3600, 1)
-    
-    # 计算最近学习时间
-    recent_activity = None
-    if learning_records:
-        recent_activity = max(record.created_at for record in learning_records)
-    
-    # 计算连续学习天数（简化版）
-    learning_days = 18  # 实际项目中应该从数据库计算
+    total_courses = stats.total_courses
+    completed_courses = stats.completed_courses
     
     return {
         "total_courses": total_courses,
         "completed_courses": completed_courses,
-        "ongoing_courses": ongoing_courses,
-        "average_progress": average_progress,
-        "total_learning_hours": total_hours,
-        "learning_days": learning_days,
-        "recent_activity": recent_activity,
-        "enrollment_count": db.query(Enrollment).filter(
-            Enrollment.user_id == current_user.id,
-            Enrollment.payment_status == "paid"
-        ).count()
+        "ongoing_courses": total_courses - completed_courses,
+        "average_progress": round(stats.progress_sum / max(total_courses, 1), 1),
+        "total_learning_hours": round(stats.total_learning_seconds / 3600, 1),
+        "learning_days": current_streak(stats),  # 连续学习天数
+        "total_learning_days": stats.learning_days,
+        "longest_streak": stats.longest_streak,
+        "recent_activity": stats.last_activity_at,
+        "enrollment_count": stats.paid_enrollments
     }
 
 # 管理员API
 @app.post("/api/admin/courses", response_model=CourseResponse)
-async def create_course(
+def create_course(
     course_data: CourseCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user_from_token)
 ):
     """创建新课程（管理员权限）"""
     if current_user.role != "admin":
@@ -717,11 +872,11 @@ async def create_course(
     )
 
 @app.post("/api/admin/courses/{course_id}/lessons", response_model=LessonResponse)
-async def create_lesson(
+def create_lesson(
     course_id: int,
     lesson_data: LessonCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user_from_token)
 ):
     """创建课程章节（管理员权限）"""
     if current_user.role != "admin":
@@ -772,6 +927,33 @@ async def create_lesson(
         created_at=new_lesson.created_at
     )
 
+@app.get("/api/admin/metrics")
+async def get_admin_metrics(
+    current_user: User = Depends(require_current_user_hybrid)
+):
+    """获取后台任务和缓存的运行计数（管理员权限）"""
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="需要管理员权限"
+        )
+    
+    return {
+        "session_store": session_store.stats(),
+        "session_activity": activity_tracker.stats(),
+        "session_sweeper": session_sweeper.stats(),
+        "principal_cache": user_principal_cache.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "entitlements": entitlement_resolver.stats(),
+        "play_signatures": play_signature_cache.stats(),
+        "playback_buffer": playback_buffer.stats(),
+        "video_statistics": video_stats_cache.stats(),
+        "playback_history": playback_history_cache.stats(),
+        "resume_positions": resume_position_store.stats(),
+        "password_hash_pool": password_hash_pool.stats(),
+        "db_pool": get_pool_stats()
+    }
+
 # ============================================
 # Web会话认证API（HttpOnly Cookie + Server-Side Session）
 # ============================================
@@ -811,7 +993,7 @@ async def web_login(
 ):
     """Web用户登录（使用HttpOnly Cookie）"""
     # 验证用户凭据
-    user = authenticate_user(db, login_data.username, login_data.password)
+    user = await authenticate_user_async(db, login_data.username, login_data.password)
     
     if not user:
         raise HTTPException(
@@ -819,8 +1001,20 @@ async def web_login(
             detail="用户名或密码错误",
         )
     
+    # 用户信息需在创建会话（提交事务）之前读取，避免提交后重新加载
+    user_info = {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "full_name": user.full_name,
+        "role": user.role,
+        "avatar_url": user.avatar_url,
+        "bio": user.bio,
+        "created_at": user.created_at.isoformat() if user.created_at else None
+    }
+    
     # 创建Web会话
-    session_id = session_manager.create_session(user, request)
+    session_id = await run_in_threadpool(session_manager.create_session, user, request)
     
     # 设置Cookie过期时间（记住我：30天，否则：7天）
     max_age = 3600 * 24 * 30 if login_data.remember_me else 3600 * 24 * 7
@@ -829,16 +1023,7 @@ async def web_login(
     response = JSONResponse(content={
         "success": True,
         "message": "登录成功",
-        "user": {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "full_name": user.full_name,
-            "role": user.role,
-            "avatar_url": user.avatar_url,
-            "bio": user.bio,
-            "created_at": user.created_at.isoformat() if user.created_at else None
-        }
+        "user": user_info
     })
     
     # 设置HttpOnly Cookie
@@ -847,7 +1032,7 @@ async def web_login(
     return response
 
 @app.post("/api/auth/web/logout", response_model=WebLogoutResponse)
-async def web_logout(
+def web_logout(
     request: Request,
     session_manager: WebSessionManager = Depends(get_session_manager),
     cookie_manager: CookieManager = Depends(get_cookie_manager),
@@ -873,7 +1058,7 @@ async def web_logout(
     return response
 
 @app.post("/api/auth/web/logout-all", response_model=WebLogoutResponse)
-async def web_logout_all(
+def web_logout_all(
     current_user: User = Depends(require_current_user_hybrid),
     session_manager: WebSessionManager = Depends(get_session_manager),
     cookie_manager: CookieManager = Depends(get_cookie_manager),
@@ -896,7 +1081,7 @@ async def web_logout_all(
     return response
 
 @app.get("/api/auth/web/sessions", response_model=SessionsResponse)
-async def get_web_sessions(
+def get_web_sessions(
     current_user: User = Depends(require_current_user_hybrid),
     session_manager: WebSessionManager = Depends(get_session_manager)
 ):
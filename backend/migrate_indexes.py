@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+数据库索引迁移脚本
+为已有数据库补建models.py中声明的索引（create_tables只会创建缺失的表，不会给已有表加索引）
+
+用法:
+    python migrate_indexes.py          # 创建缺失的索引
+    python migrate_indexes.py --dry-run  # 只列出缺失的索引
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import inspect
+
+from models import Base, engine
+
+
+def find_missing_indexes():
+    """查找模型中声明但数据库中不存在的索引"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            # 表不存在时由create_tables创建（包含索引）
+            continue
+        
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                missing.append(index)
+    
+    return missing
+
+
+def migrate(dry_run: bool = False):
+    """创建缺失的索引"""
+    missing = find_missing_indexes()
+    
+    if not missing:
+        print("所有索引均已存在，无需迁移")
+        return
+    
+    for index in missing:
+        columns = ", ".join(column.name for column in index.columns)
+        if dry_run:
+            print(f"缺失索引: {index.name} ON {index.table.name} ({columns})")
+            continue
+        
+        print(f"创建索引: {index.name} ON {index.table.name} ({columns})")
+        index.create(bind=engine, checkfirst=True)
+    
+    if not dry_run:
+        print(f"索引迁移完成，共创建 {len(missing)} 个索引")
+
+
+if __name__ == "__main__":
+    migrate(dry_run="--dry-run" in sys.argv)
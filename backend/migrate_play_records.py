@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+播放记录唯一索引迁移脚本
+合并同一 (user_id, video_id) 的重复播放记录，删除旧的非唯一索引，
+再创建uq_play_records_user_video唯一索引（播放心跳upsert依赖该索引）
+
+合并规则：保留id最小的一行，播放时长累加，进度取最大值，
+开始时间取最早、结束/更新时间取最晚。
+已有重复记录的数据库需先运行本脚本，再运行migrate_indexes.py
+
+用法:
+    python migrate_play_records.py          # 合并重复记录并创建唯一索引
+    python migrate_play_records.py --dry-run  # 只统计重复记录
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import inspect, func, select, update, delete
+
+from models import engine, VideoPlayRecord
+
+
+OLD_INDEX_NAME = "ix_play_records_user_video"
+UNIQUE_INDEX_NAME = "uq_play_records_user_video"
+
+
+def find_duplicates(conn):
+    """查找有重复记录的 (user_id, video_id) 及其合并后的值"""
+    table = VideoPlayRecord.__table__
+    return conn.execute(
+        select(
+            table.c.user_id,
+            table.c.video_id,
+            func.min(table.c.id).label("keep_id"),
+            func.count().label("rows"),
+            func.sum(func.coalesce(table.c.play_duration, 0)).label("play_duration"),
+            func.max(func.coalesce(table.c.progress, 0)).label("progress"),
+            func.min(table.c.started_at).label("started_at"),
+            func.max(table.c.ended_at).label("ended_at"),
+            func.max(table.c.updated_at).label("updated_at")
+        ).group_by(
+            table.c.user_id, table.c.video_id
+        ).having(func.count() > 1)
+    ).all()
+
+
+def merge_duplicates(conn, duplicates) -> int:
+    """把每组重复记录合并到id最小的一行，返回删除的行数"""
+    table = VideoPlayRecord.__table__
+    removed = 0
+    
+    for group in duplicates:
+        conn.execute(update(table).where(table.c.id == group.keep_id).values(
+            play_duration=group.play_duration,
+            progress=group.progress,
+            completed=group.progress >= 95,
+            started_at=group.started_at,
+            ended_at=group.ended_at,
+            updated_at=group.updated_at
+        ))
+        result = conn.execute(delete(table).where(
+            table.c.user_id == group.user_id,
+            table.c.video_id == group.video_id,
+            table.c.id != group.keep_id
+        ))
+        removed += result.rowcount
+    
+    return removed
+
+
+def migrate(dry_run: bool = False):
+    """合并重复记录并创建唯一索引"""
+    table = VideoPlayRecord.__table__
+    inspector = inspect(engine)
+    
+    if table.name not in inspector.get_table_names():
+        print("video_play_records表不存在，启动应用时会按模型创建（包含唯一索引）")
+        return
+    
+    existing = {index["name"] for index in inspector.get_indexes(table.name)}
+    
+    with engine.begin() as conn:
+        duplicates = find_duplicates(conn)
+        print(f"发现 {len(duplicates)} 组重复播放记录，共 {sum(group.rows for group in duplicates)} 行")
+        
+        if dry_run:
+            return
+        
+        if duplicates:
+            print(f"已合并重复记录，删除 {merge_duplicates(conn, duplicates)} 行")
+        
+        if OLD_INDEX_NAME in existing:
+            print(f"删除旧索引: {OLD_INDEX_NAME}")
+            conn.exec_driver_sql(
+                f"DROP INDEX {OLD_INDEX_NAME} ON {table.name}" if engine.dialect.name == "mysql"
+                else f"DROP INDEX {OLD_INDEX_NAME}"
+            )
+        
+        if UNIQUE_INDEX_NAME not in existing:
+            index = next(index for index in table.indexes if index.name == UNIQUE_INDEX_NAME)
+            print(f"创建唯一索引: {UNIQUE_INDEX_NAME} ON {table.name} (user_id, video_id)")
+            index.create(bind=conn)
+    
+    print("播放记录迁移完成")
+
+
+if __name__ == "__main__":
+    migrate(dry_run="--dry-run" in sys.argv)
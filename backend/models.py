@@ -3,11 +3,14 @@
 使用SQLAlchemy ORM
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float
+from sqlalchemy import create_engine, event, Index, Column, Integer, String, Boolean, DateTime, Date, ForeignKey, Text, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
 from datetime import datetime
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -39,6 +42,10 @@ class User(Base):
 # 课程模型
 class Course(Base):
     __tablename__ = 'courses'
+    __table_args__ = (
+        # 课程列表：按状态、访问级别筛选并按sort_order排序
+        Index('ix_courses_status_access_sort', 'status', 'access_level', 'sort_order'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(200), nullable=False)
@@ -66,6 +73,9 @@ class Course(Base):
 # 用户课程关系模型
 class UserCourse(Base):
     __tablename__ = 'user_courses'
+    __table_args__ = (
+        Index('ix_user_courses_user_course', 'user_id', 'course_id'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -84,6 +94,9 @@ class UserCourse(Base):
 # 课程章节模型
 class Lesson(Base):
     __tablename__ = 'lessons'
+    __table_args__ = (
+        Index('ix_lessons_course_sort', 'course_id', 'sort_order'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     course_id = Column(Integer, ForeignKey('courses.id'), nullable=False)
@@ -102,6 +115,9 @@ class Lesson(Base):
 # 报名记录模型
 class Enrollment(Base):
     __tablename__ = 'enrollments'
+    __table_args__ = (
+        Index('ix_enrollments_user_course_status', 'user_id', 'course_id', 'payment_status'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -120,6 +136,9 @@ class Enrollment(Base):
 # 学习记录模型
 class LearningRecord(Base):
     __tablename__ = 'learning_records'
+    __table_args__ = (
+        Index('ix_learning_records_user_created', 'user_id', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -130,9 +149,32 @@ class LearningRecord(Base):
     duration = Column(Integer)  # 学习时长（秒）
     created_at = Column(DateTime, default=datetime.utcnow)
 
+# 用户学习统计汇总模型（随学习/播放写入增量维护，统计接口直接读取）
+class UserLearningStats(Base):
+    __tablename__ = 'user_learning_stats'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    total_courses = Column(Integer, default=0, nullable=False)
+    completed_courses = Column(Integer, default=0, nullable=False)
+    progress_sum = Column(Integer, default=0, nullable=False)  # 所有课程进度之和，用于计算平均进度
+    paid_enrollments = Column(Integer, default=0, nullable=False)
+    total_learning_seconds = Column(Integer, default=0, nullable=False)  # 学习记录+视频播放时长
+    learning_days = Column(Integer, default=0, nullable=False)  # 累计学习天数（按UTC日期去重）
+    current_streak = Column(Integer, default=0, nullable=False)  # 截止last_learning_date的连续学习天数
+    longest_streak = Column(Integer, default=0, nullable=False)
+    last_learning_date = Column(Date)
+    last_activity_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 # 腾讯云点播视频模型
 class VodVideo(Base):
     __tablename__ = 'vod_videos'
+    __table_args__ = (
+        # 课程视频列表：按课程和状态筛选并按创建时间排序
+        Index('ix_vod_videos_course_status_created', 'course_id', 'status', 'created_at'),
+        # 播放页前后章节：按章节查找可播放的视频
+        Index('ix_vod_videos_lesson_status', 'lesson_id', 'status'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     file_id = Column(String(100), unique=True, nullable=False)  # 腾讯云FileID
@@ -159,6 +201,13 @@ class VodVideo(Base):
 # 视频播放记录模型
 class VideoPlayRecord(Base):
     __tablename__ = 'video_play_records'
+    __table_args__ = (
+        # 每个用户每个视频一条记录，播放心跳按此唯一索引做upsert
+        Index('uq_play_records_user_video', 'user_id', 'video_id', unique=True),
+        # 视频统计的最近播放、用户播放历史
+        Index('ix_play_records_video_ended', 'video_id', 'ended_at'),
+        Index('ix_play_records_user_ended', 'user_id', 'ended_at'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -182,9 +231,57 @@ class VideoPlayRecord(Base):
     course = relationship("Course")
     lesson = relationship("Lesson")
 
+# 视频续播位置模型（秒级精度，每个用户每个视频一行，由播放心跳写入）
+class ResumePosition(Base):
+    __tablename__ = 'resume_positions'
+    
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    video_id = Column(Integer, ForeignKey('vod_videos.id'), primary_key=True)
+    position = Column(Float, default=0.0, nullable=False)  # 播放位置（秒）
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # 客户端上报时间，并发写入时保留较新的
+
+# 播放分析汇总模型（按小时/天、按视频/课程/设备类型预聚合，由心跳刷盘增量维护）
+class PlaybackRollup(Base):
+    __tablename__ = 'playback_rollups'
+    __table_args__ = (
+        # 按维度取值查询时间区间，同时是刷盘upsert的冲突键
+        Index('uq_playback_rollups_bucket', 'granularity', 'dimension', 'dimension_key', 'bucket_start', unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String(10), nullable=False)  # hour, day
+    bucket_start = Column(DateTime, nullable=False)  # 时间段起点（UTC）
+    dimension = Column(String(20), nullable=False)  # video, course, device
+    dimension_key = Column(String(50), nullable=False)  # 视频ID/课程ID/设备类型
+    plays = Column(Integer, default=0, nullable=False)  # 播放次数（间隔超过会话间隔后重新开始记为新的一次）
+    unique_viewers = Column(Integer, default=0, nullable=False)  # 时间段内去重观看人数
+    watch_seconds = Column(Integer, default=0, nullable=False)
+    completions = Column(Integer, default=0, nullable=False)  # 进度首次达到95%的次数
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# 播放分析汇总的观看人明细（用于unique_viewers去重，超过保留期后清理）
+class PlaybackRollupViewer(Base):
+    __tablename__ = 'playback_rollup_viewers'
+    __table_args__ = (
+        Index('uq_playback_rollup_viewers', 'granularity', 'dimension', 'dimension_key', 'bucket_start', 'user_id', unique=True),
+        Index('ix_playback_rollup_viewers_bucket', 'bucket_start'),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String(10), nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    dimension = Column(String(20), nullable=False)
+    dimension_key = Column(String(50), nullable=False)
+    user_id = Column(Integer, nullable=False)
+
 # 视频播放签名缓存模型
 class PlaySignature(Base):
     __tablename__ = 'play_signatures'
+    __table_args__ = (
+        Index('ix_play_signatures_file_user_expires', 'file_id', 'user_id', 'expires_at'),
+        # 过期签名清理
+        Index('ix_play_signatures_expires', 'expires_at'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     file_id = Column(String(100), nullable=False)
@@ -199,6 +296,11 @@ class PlaySignature(Base):
 # Web会话模型（HttpOnly Cookie + Server-Side Session）
 class Session(Base):
     __tablename__ = 'sessions'
+    __table_args__ = (
+        Index('ix_sessions_user_expires', 'user_id', 'expires_at'),
+        # 过期会话清理
+        Index('ix_sessions_expires', 'expires_at'),
+    )
     
     id = Column(String(36), primary_key=True)  # Session ID (UUID)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -216,6 +318,9 @@ class Session(Base):
 # 会话事件审计模型
 class SessionEvent(Base):
     __tablename__ = 'session_events'
+    __table_args__ = (
+        Index('ix_session_events_session', 'session_id'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String(36), ForeignKey('sessions.id'), nullable=False)
@@ -229,9 +334,115 @@ class SessionEvent(Base):
     session = relationship("Session")
     user = relationship("User")
 
-# 创建数据库引擎
+# 数据库连接池配置
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./xxdfq.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # 获取连接的最长等待时间（秒）
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # 连接回收时间（秒），需小于MySQL的wait_timeout
+
+# SQLite连接参数
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # WAL模式下NORMAL即可保证一致性
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+class PoolMetrics:
+    """连接池获取连接的等待时间统计"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+    
+    def record(self, wait_ms: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+    
+    def stats(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.total_wait_ms / max(self.checkouts, 1), 3),
+            "max_wait_ms": round(self.max_wait_ms, 3)
+        }
+
+pool_metrics = PoolMetrics()
+
+class TimedQueuePool(QueuePool):
+    """记录获取连接等待时间的连接池"""
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            pool_metrics.record((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        pool_metrics.record((time.perf_counter() - started) * 1000)
+        return connection
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLite连接参数：WAL模式下读操作不会被写操作阻塞"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+def create_db_engine(database_url: str = DATABASE_URL):
+    """
+    创建数据库引擎
+    
+    SQLite: 开启WAL、设置busy_timeout和mmap
+    MySQL/PostgreSQL: 配置连接池大小、溢出、回收和连接检测
+    """
+    if database_url.startswith("sqlite"):
+        # 内存数据库使用SQLAlchemy默认的单连接池
+        if ":memory:" in database_url or database_url.rstrip("/") == "sqlite:":
+            return create_engine(database_url, connect_args={"check_same_thread": False})
+        
+        sqlite_engine = create_engine(
+            database_url,
+            connect_args={"check_same_thread": False},
+            poolclass=TimedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT
+        )
+        event.listen(sqlite_engine, "connect", _set_sqlite_pragmas)
+        return sqlite_engine
+    
+    return create_engine(
+        database_url,
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True
+    )
+
+def get_pool_stats() -> dict:
+    """获取连接池状态和等待时间统计"""
+    stats = pool_metrics.stats()
+    if isinstance(engine.pool, QueuePool):
+        stats.update({
+            "pool_size": engine.pool.size(),
+            "checked_out": engine.pool.checkedout(),
+            "overflow": engine.pool.overflow()
+        })
+    return stats
+
+# 创建数据库引擎
+engine = create_db_engine(DATABASE_URL)
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
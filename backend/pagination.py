@@ -0,0 +1,160 @@
+"""
+列表分页与字段投影
+基于排序键的游标（keyset）分页：按上一页最后一行的排序键继续查询，
+翻页成本与页码无关；fields参数只加载需要的列
+"""
+
+import json
+import base64
+from datetime import datetime
+from typing import List, Tuple, Optional, Sequence, Any, Dict
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_, DateTime
+from sqlalchemy.orm import Query, load_only
+
+
+# 默认/最大每页条数（只带游标、不带limit时使用默认值）
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# 游标分页的下一页游标响应头
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """把排序键编码为不透明游标"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, keys: Sequence[Tuple[Any, bool]]) -> List[Any]:
+    """
+    解析游标
+    
+    Args:
+        cursor: encode_cursor生成的游标
+        keys: 排序键 [(列, 是否降序)]
+        
+    Returns:
+        与排序键一一对应的值
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError("游标长度不匹配")
+        
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) and value is not None else value
+            for (column, _), value in zip(keys, values)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+
+def keyset_condition(keys: Sequence[Tuple[Any, bool]], values: Sequence[Any]):
+    """
+    生成"排在游标之后"的条件，支持升降序混合
+    
+    (a, b, c) 之后 = a>va OR (a=va AND b>vb) OR (a=va AND b=vb AND c>vc)
+    """
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        equal = [keys[j][0] == values[j] for j in range(i)]
+        after = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal, after))
+    return or_(*clauses)
+
+
+def paginate(query: Query, keys: Sequence[Tuple[Any, bool]],
+             cursor: Optional[str], limit: Optional[int]) -> Tuple[List[Any], Optional[str]]:
+    """
+    按排序键做游标分页
+    
+    排序键必须唯一确定顺序（最后一个键通常为主键）且不为NULL。
+    limit和cursor都未指定时不分页，按同样的顺序返回全部数据（兼容不翻页的调用方）
+    
+    Args:
+        query: 已应用筛选条件的查询
+        keys: 排序键 [(列, 是否降序)]
+        cursor: 上一页返回的游标，第一页为None
+        limit: 每页条数，None表示不分页（带游标时使用DEFAULT_PAGE_SIZE）
+        
+    Returns:
+        (当前页数据, 下一页游标，没有下一页时为None)
+    """
+    if cursor:
+        query = query.filter(keyset_condition(keys, decode_cursor(cursor, keys)))
+    
+    query = query.order_by(*[column.desc() if descending else column for column, descending in keys])
+    if limit is None and not cursor:
+        return query.all(), None
+    
+    limit = limit or DEFAULT_PAGE_SIZE
+    rows = query.limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column, _ in keys])
+    
+    return rows, next_cursor
+
+
+def cursor_headers(next_cursor: Optional[str]) -> Dict[str, str]:
+    """下一页游标响应头（没有下一页时为空）"""
+    return {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> Optional[List[str]]:
+    """
+    解析fields参数（逗号分隔的字段名）
+    
+    Returns:
+        请求的字段列表，未指定时返回None（返回全部字段）
+    """
+    if not fields:
+        return None
+    
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支持的字段: {', '.join(unknown)}"
+        )
+    
+    return requested
+
+
+def project_columns(model, requested: Optional[List[str]], keys: Sequence[Tuple[Any, bool]],
+                    depends: Optional[Dict[str, List[str]]] = None):
+    """
+    字段投影对应的load_only选项（额外加载排序键，用于生成游标）
+    
+    Args:
+        model: ORM模型
+        requested: 请求的字段
+        keys: 排序键
+        depends: 计算字段依赖的列，如 {"duration_formatted": ["duration"]}
+        
+    Returns:
+        load_only选项，未指定字段时返回None
+    """
+    if requested is None:
+        return None
+    
+    names = []
+    for name in requested:
+        names.extend((depends or {}).get(name, [name]))
+    names.extend(column.key for column, _ in keys)
+    
+    columns = [getattr(model, name) for name in dict.fromkeys(names) if name in model.__table__.columns]
+    return load_only(*columns)
+
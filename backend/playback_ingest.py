@@ -0,0 +1,206 @@
+"""
+播放心跳写入缓冲
+/api/vod/playback/record 的心跳先写入内存，按 (用户, 视频) 合并
+（进度取最大值、播放时长累加），由后台任务定期批量写入video_play_records；
+心跳请求只写内存，不在请求线程中刷盘
+"""
+
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Any, Tuple, List, Optional
+
+from models import SessionLocal
+
+
+# 播放心跳缓冲配置
+PLAYBACK_FLUSH_SECONDS = int(os.getenv("PLAYBACK_FLUSH_SECONDS", "5"))  # 进程崩溃时最多丢失的心跳时间窗口
+PLAYBACK_BUFFER_MAX_ENTRIES = int(os.getenv("PLAYBACK_BUFFER_MAX_ENTRIES", "5000"))  # 待写入条目达到上限时提前唤醒刷盘任务
+PLAYBACK_BUFFER_HARD_LIMIT = int(os.getenv("PLAYBACK_BUFFER_HARD_LIMIT", "20000"))  # 超过该条目数时拒绝新的 (用户, 视频) 心跳
+
+
+class PlaybackBufferFull(Exception):
+    """缓冲区达到硬上限，新的心跳被拒绝"""
+    pass
+
+
+class PlaybackBuffer:
+    """播放心跳合并缓冲区"""
+    
+    def __init__(self, max_entries: int = PLAYBACK_BUFFER_MAX_ENTRIES,
+                 hard_limit: int = PLAYBACK_BUFFER_HARD_LIMIT):
+        """
+        初始化缓冲区
+        
+        Args:
+            max_entries: 待写入的 (用户, 视频) 条目上限，达到后调用on_full唤醒刷盘任务
+            hard_limit: 待写入条目的硬上限，达到后新的 (用户, 视频) 心跳被拒绝（已有条目照常合并）
+        """
+        self.max_entries = max_entries
+        self.hard_limit = max(hard_limit, max_entries)
+        # 缓冲区写满时的通知回调（由应用启动时设置为刷盘任务的wake），在写入心跳的线程中调用
+        self.on_full: Optional[Callable[[], None]] = None
+        
+        self._pending: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        
+        self.received = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.failures = 0
+        self.shed = 0
+        self.wakeups = 0
+    
+    def add(self, user_id: int, video_id: int, play_duration: int, progress: int,
+            device_type: str = "web", ip_address: str = "", user_agent: str = "") -> Dict[str, Any]:
+        """
+        写入一次播放心跳（仅写内存）
+        
+        Args:
+            user_id: 用户ID
+            video_id: 视频ID
+            play_duration: 本次播放时长（秒）
+            progress: 播放进度（0-100）
+            device_type: 设备类型
+            ip_address: IP地址
+            user_agent: 用户代理
+            
+        Returns:
+            合并后的待写入条目副本
+            
+        Raises:
+            PlaybackBufferFull: 缓冲区达到硬上限（刷盘跟不上写入）
+        """
+        now = datetime.utcnow()
+        key = (user_id, video_id)
+        
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                if len(self._pending) >= self.hard_limit:
+                    self.shed += 1
+                    raise PlaybackBufferFull()
+                
+                entry = {
+                    "user_id": user_id,
+                    "video_id": video_id,
+                    "play_duration": 0,
+                    "progress": 0,
+                    "device_type": "",
+                    "ip_address": "",
+                    "user_agent": "",
+                    "first_seen": now
+                }
+                self._pending[key] = entry
+            
+            entry["play_duration"] += max(0, int(play_duration or 0))
+            entry["progress"] = max(entry["progress"], int(progress or 0))
+            entry["last_seen"] = now
+            if device_type:
+                entry["device_type"] = device_type
+            if ip_address:
+                entry["ip_address"] = ip_address
+            if user_agent:
+                entry["user_agent"] = user_agent
+            
+            self.received += 1
+            snapshot = dict(entry)
+            full = len(self._pending) >= self.max_entries
+        
+        # 只通知后台任务提前刷盘，请求线程不执行数据库写入
+        if full and self.on_full is not None:
+            self.wakeups += 1
+            self.on_full()
+        
+        return snapshot
+    
+    def pending_for(self, user_id: int, video_id: int) -> Dict[str, Any]:
+        """获取尚未写入数据库的心跳合并结果（没有时返回空字典）"""
+        with self._lock:
+            return dict(self._pending.get((user_id, video_id), {}))
+    
+    def flush(self, db, wait: bool = True) -> int:
+        """
+        批量写入缓冲的心跳
+        
+        同一时间只有一个刷盘在执行；写入失败时条目合并回缓冲区等待下次刷盘
+        
+        Args:
+            db: 数据库会话
+            wait: 已有刷盘在执行时是否等待（否则直接返回）
+            
+        Returns:
+            写入的条目数量
+        """
+        if not self._flush_lock.acquire(blocking=wait):
+            return 0
+        
+        try:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            
+            if not pending:
+                return 0
+            
+            entries = list(pending.values())
+            try:
+                # 延迟导入，避免与vod_service循环依赖
+                from vod_service import VodManager
+                written = VodManager(db).apply_playback_batch(entries)
+            except Exception:
+                db.rollback()
+                self.failures += 1
+                self._requeue(entries)
+                raise
+            
+            self.flushed += written
+            self.dropped += len(entries) - written
+            self.flushes += 1
+            return written
+        finally:
+            self._flush_lock.release()
+    
+    def _requeue(self, entries: List[Dict[str, Any]]):
+        """把写入失败的条目合并回缓冲区"""
+        with self._lock:
+            for failed in entries:
+                key = (failed["user_id"], failed["video_id"])
+                entry = self._pending.get(key)
+                if entry is None:
+                    self._pending[key] = failed
+                    continue
+                
+                entry["play_duration"] += failed["play_duration"]
+                entry["progress"] = max(entry["progress"], failed["progress"])
+                entry["first_seen"] = min(entry["first_seen"], failed["first_seen"])
+                for field in ("device_type", "ip_address", "user_agent"):
+                    entry[field] = entry[field] or failed[field]
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "max_entries": self.max_entries,
+            "hard_limit": self.hard_limit,
+            "received": self.received,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "failures": self.failures,
+            "shed": self.shed,
+            "wakeups": self.wakeups
+        }
+
+
+# 进程级单例
+playback_buffer = PlaybackBuffer()
+
+
+def flush_playback_buffer(wait: bool = True):
+    """将缓冲的播放心跳写入数据库（由后台任务和关闭钩子调用）"""
+    db = SessionLocal()
+    try:
+        playback_buffer.flush(db, wait=wait)
+    finally:
+        db.close()
@@ -0,0 +1,194 @@
+"""
+播放分析汇总
+心跳刷盘时按小时/天、按视频/课程/设备类型增量累加播放次数、去重观看人数、
+观看时长和完成次数；看板按时间区间读取预聚合的汇总表，不再扫描播放记录
+"""
+
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, PlaybackRollup, PlaybackRollupViewer
+
+
+# 播放分析汇总配置
+PLAYBACK_SESSION_GAP_SECONDS = int(os.getenv("PLAYBACK_SESSION_GAP_SECONDS", "1800"))  # 距上次播放超过该间隔记为新的一次播放
+ROLLUP_VIEWER_RETENTION_DAYS = int(os.getenv("ROLLUP_VIEWER_RETENTION_DAYS", "2"))  # 观看人明细保留天数（去重只需要当前时间段）
+ROLLUP_SWEEP_INTERVAL_SECONDS = int(os.getenv("ROLLUP_SWEEP_INTERVAL_SECONDS", "3600"))  # 观看人明细清理间隔（秒）
+
+# 时间粒度（按UTC对齐）与维度
+ROLLUP_GRANULARITIES = ("hour", "day")
+ROLLUP_DIMENSIONS = ("video", "course", "device")
+
+# 单次查询最多的维度取值数
+MAX_ROLLUP_KEYS = 200
+# 单次查询的最大时间跨度（天）
+ROLLUP_MAX_RANGE_DAYS = {"hour": 31, "day": 366}
+
+ROLLUP_METRICS = ("plays", "unique_viewers", "watch_seconds", "completions")
+
+
+def bucket_start(at: datetime, granularity: str) -> datetime:
+    """时间所在时间段的起点"""
+    if granularity == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _dialect_insert(db: Session, table, rows: List[Dict[str, Any]]):
+    """按数据库类型生成INSERT语句（用于ON CONFLICT/ON DUPLICATE KEY）"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        return mysql_insert(table).values(rows), dialect
+    if dialect == "postgresql":
+        return postgresql_insert(table).values(rows), dialect
+    if dialect == "sqlite":
+        return sqlite_insert(table).values(rows), dialect
+    raise ValueError(f"不支持的数据库类型: {dialect}")
+
+
+def _add_viewers(db: Session, key: Tuple[str, str, str, datetime], user_ids: Sequence[int]) -> int:
+    """
+    写入时间段的观看人明细
+    
+    Returns:
+        新增的观看人数（已存在的忽略）
+    """
+    granularity, dimension, dimension_key, start = key
+    stmt, dialect = _dialect_insert(db, PlaybackRollupViewer.__table__, [
+        {
+            "granularity": granularity,
+            "bucket_start": start,
+            "dimension": dimension,
+            "dimension_key": dimension_key,
+            "user_id": user_id
+        }
+        for user_id in user_ids
+    ])
+    stmt = stmt.prefix_with("IGNORE") if dialect == "mysql" else stmt.on_conflict_do_nothing()
+    return db.execute(stmt).rowcount
+
+
+def record_playback_rollups(db: Session, plays: List[Dict[str, Any]]):
+    """
+    把一批播放心跳累加到汇总表（不提交，与播放记录同一事务）
+    
+    Args:
+        db: 数据库会话
+        plays: 每项包含user_id、course_id、video_id、device_type、play_duration、at（最后心跳时间）、
+               new_play（是否为新的一次播放）、completed_now（本批次是否首次完成）
+    """
+    if not plays:
+        return
+    
+    counters = defaultdict(lambda: {"plays": 0, "watch_seconds": 0, "completions": 0, "user_ids": set()})
+    for play in plays:
+        dimensions = [("video", str(play["video_id"])), ("device", play["device_type"] or "web")]
+        if play["course_id"]:
+            dimensions.append(("course", str(play["course_id"])))
+        
+        for granularity in ROLLUP_GRANULARITIES:
+            start = bucket_start(play["at"], granularity)
+            for dimension, dimension_key in dimensions:
+                counter = counters[(granularity, dimension, dimension_key, start)]
+                counter["plays"] += 1 if play["new_play"] else 0
+                counter["watch_seconds"] += play["play_duration"]
+                counter["completions"] += 1 if play["completed_now"] else 0
+                counter["user_ids"].add(play["user_id"])
+    
+    now = datetime.utcnow()
+    rows = []
+    for key, counter in counters.items():
+        granularity, dimension, dimension_key, start = key
+        rows.append({
+            "granularity": granularity,
+            "bucket_start": start,
+            "dimension": dimension,
+            "dimension_key": dimension_key,
+            "plays": counter["plays"],
+            "unique_viewers": _add_viewers(db, key, sorted(counter["user_ids"])),
+            "watch_seconds": counter["watch_seconds"],
+            "completions": counter["completions"],
+            "updated_at": now
+        })
+    
+    table = PlaybackRollup.__table__
+    stmt, dialect = _dialect_insert(db, table, rows)
+    incoming = stmt.inserted if dialect == "mysql" else stmt.excluded
+    updates = {metric: table.c[metric] + incoming[metric] for metric in ROLLUP_METRICS}
+    updates["updated_at"] = incoming.updated_at
+    
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(updates)
+    else:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["granularity", "dimension", "dimension_key", "bucket_start"],
+            set_=updates
+        )
+    db.execute(stmt)
+
+
+def query_rollups(db: Session, dimension: str, keys: Optional[Sequence[str]], granularity: str,
+                  start: datetime, end: datetime) -> Dict[str, Any]:
+    """
+    查询时间区间内的汇总数据
+    
+    汇总值为各时间段之和，unique_viewers在各时间段内去重（跨时间段相加，不是区间内的去重人数）
+    
+    Args:
+        db: 数据库会话
+        dimension: video/course/device
+        keys: 维度取值（视频ID/课程ID/设备类型），None表示该维度的全部取值
+        granularity: hour/day
+        start: 起始时间（含）
+        end: 结束时间（不含）
+        
+    Returns:
+        {"series": {取值: [各时间段]}, "totals": {取值: 区间合计}}
+    """
+    query = db.query(PlaybackRollup).filter(
+        PlaybackRollup.granularity == granularity,
+        PlaybackRollup.dimension == dimension,
+        PlaybackRollup.bucket_start >= bucket_start(start, granularity),
+        PlaybackRollup.bucket_start < end
+    )
+    if keys is not None:
+        query = query.filter(PlaybackRollup.dimension_key.in_(keys))
+    
+    series: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    totals: Dict[str, Dict[str, int]] = defaultdict(lambda: dict.fromkeys(ROLLUP_METRICS, 0))
+    for rollup in query.order_by(PlaybackRollup.dimension_key, PlaybackRollup.bucket_start).all():
+        point = {"bucket_start": rollup.bucket_start.isoformat()}
+        for metric in ROLLUP_METRICS:
+            point[metric] = getattr(rollup, metric)
+            totals[rollup.dimension_key][metric] += getattr(rollup, metric)
+        series[rollup.dimension_key].append(point)
+    
+    return {"series": dict(series), "totals": dict(totals)}
+
+
+def prune_rollup_viewers(db: Session, before: datetime) -> int:
+    """删除早于before的观看人明细（对应时间段已不会再有心跳写入）"""
+    deleted = db.query(PlaybackRollupViewer).filter(
+        PlaybackRollupViewer.bucket_start < before
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def sweep_rollup_viewers():
+    """清理过期的观看人明细（由后台任务调用）"""
+    db = SessionLocal()
+    try:
+        before = bucket_start(datetime.utcnow() - timedelta(days=ROLLUP_VIEWER_RETENTION_DAYS), "day")
+        deleted = prune_rollup_viewers(db, before)
+        if deleted:
+            print(f"已清理 {deleted} 条播放汇总观看人明细")
+    finally:
+        db.close()
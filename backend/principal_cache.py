@@ -0,0 +1,128 @@
+"""
+用户认证主体缓存
+按JWT subject和用户ID缓存User快照，避免每次认证都查询users表
+"""
+
+import os
+import threading
+from typing import Optional, Dict, Any, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from cache_utils import TTLCache
+from models import User
+
+
+# 认证主体缓存配置
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "4096"))
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "30"))  # 秒
+
+
+class UserPrincipalCache:
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        """
+        初始化认证主体缓存
+        
+        Args:
+            maxsize: 最大缓存用户数
+            ttl: 缓存存活时间(秒)
+        """
+        self.users = TTLCache(maxsize=maxsize, ttl=ttl, name="principals")
+        self.subjects = TTLCache(maxsize=maxsize, ttl=ttl, name="principal_subjects")
+        
+        # 用户ID -> 指向该用户的subject集合（用于失效）
+        self._subjects_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+    
+    def get_by_id(self, db: Session, user_id: int) -> Optional[User]:
+        """
+        按用户ID获取用户（会话认证使用）
+        
+        Args:
+            db: 数据库会话
+            user_id: 用户ID
+            
+        Returns:
+            绑定到当前数据库会话的User对象，不存在时返回None
+        """
+        snapshot = self.users.get(user_id)
+        if snapshot is not None:
+            return db.merge(snapshot, load=False)
+        
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is not None:
+            self._store(user)
+        return user
+    
+    def get_by_subject(self, db: Session, subject: str) -> Optional[User]:
+        """
+        按JWT subject（用户名或邮箱）获取用户
+        
+        Args:
+            db: 数据库会话
+            subject: JWT中的sub字段
+            
+        Returns:
+            绑定到当前数据库会话的User对象，不存在时返回None
+        """
+        user_id = self.subjects.get(subject)
+        if user_id is not None:
+            snapshot = self.users.get(user_id)
+            if snapshot is not None:
+                return db.merge(snapshot, load=False)
+        
+        user = db.query(User).filter(
+            (User.username == subject) | (User.email == subject)
+        ).first()
+        
+        if user is not None:
+            self._store(user, subject)
+        return user
+    
+    def invalidate(self, user_id: int):
+        """使用户的缓存失效（角色变更、禁用、会话批量失效时调用）"""
+        self.users.pop(user_id)
+        
+        with self._lock:
+            subjects = self._subjects_by_user.pop(user_id, set())
+        for subject in subjects:
+            self.subjects.pop(subject)
+    
+    def clear(self):
+        """清空缓存"""
+        self.users.clear()
+        self.subjects.clear()
+        with self._lock:
+            self._subjects_by_user.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "users": self.users.stats(),
+            "subjects": self.subjects.stats()
+        }
+    
+    def _store(self, user: User, subject: Optional[str] = None):
+        """缓存User的列属性快照（脱离数据库会话）"""
+        snapshot = User(**{
+            attr.key: getattr(user, attr.key)
+            for attr in inspect(User).column_attrs
+        })
+        make_transient_to_detached(snapshot)
+        self.users.set(user.id, snapshot)
+        
+        if subject is not None:
+            self.subjects.set(subject, user.id)
+            with self._lock:
+                self._subjects_by_user.setdefault(user.id, set()).add(subject)
+
+
+# 进程级单例
+user_principal_cache = UserPrincipalCache()
+
+
+# 用户信息变更（角色、禁用状态等）时自动失效
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target):
+    user_principal_cache.invalidate(target.id)
@@ -0,0 +1,201 @@
+"""
+视频续播位置
+播放心跳上报的秒级播放位置先写入内存（同时作为读缓存），由后台任务定期批量写入resume_positions表；
+开始播放时按 (用户, 视频) 主键读取，不需要扫描播放历史
+"""
+
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+
+from sqlalchemy import case
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from cache_utils import TTLCache
+from models import SessionLocal, ResumePosition, VodVideo
+
+
+# 续播位置配置
+RESUME_POSITION_FLUSH_SECONDS = int(os.getenv("RESUME_POSITION_FLUSH_SECONDS", "5"))  # 批量写入间隔
+RESUME_POSITION_CACHE_SIZE = int(os.getenv("RESUME_POSITION_CACHE_SIZE", "10000"))
+RESUME_POSITION_CACHE_TTL = int(os.getenv("RESUME_POSITION_CACHE_TTL", "600"))  # 秒
+
+# 缓存"没有续播位置"，避免未播放过的视频每次都查库
+_NO_POSITION = ()
+
+
+class ResumePositionStore:
+    """续播位置的内存层：待写入的位置 + 读缓存"""
+    
+    def __init__(self, maxsize: int = RESUME_POSITION_CACHE_SIZE, ttl: float = RESUME_POSITION_CACHE_TTL):
+        """
+        初始化续播位置存储
+        
+        Args:
+            maxsize: 最大缓存条目数
+            ttl: 缓存存活时间(秒)
+        """
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl, name="resume_positions")
+        self._pending: Dict[Tuple[int, int], Tuple[float, datetime]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        
+        self.db_reads = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.dropped = 0
+    
+    def set(self, user_id: int, video_id: int, position: float, at: Optional[datetime] = None):
+        """
+        记录播放位置（仅写内存）
+        
+        Args:
+            user_id: 用户ID
+            video_id: 视频ID
+            position: 播放位置（秒）
+            at: 上报时间，默认当前时间
+        """
+        key = (user_id, video_id)
+        value = (max(0.0, round(float(position), 3)), at or datetime.utcnow())
+        
+        with self._lock:
+            current = self._pending.get(key) or self.cache.get(key)
+            if current and current[1] > value[1]:
+                return
+            self._pending[key] = value
+        self.cache.set(key, value)
+    
+    def get(self, db: Session, user_id: int, video_id: int) -> Optional[Dict[str, Any]]:
+        """
+        获取续播位置
+        
+        依次读取待写入的位置、读缓存，都没有时按主键查一次数据库
+        
+        Returns:
+            {"position": 秒, "updated_at": ISO时间}，没有播放过时返回None
+        """
+        key = (user_id, video_id)
+        
+        with self._lock:
+            value = self._pending.get(key)
+        if value is None:
+            value = self.cache.get(key)
+        
+        if value is None:
+            row = db.query(ResumePosition.position, ResumePosition.updated_at).filter(
+                ResumePosition.user_id == user_id,
+                ResumePosition.video_id == video_id
+            ).first()
+            value = (row.position, row.updated_at) if row else _NO_POSITION
+            self.db_reads += 1
+            self.cache.set(key, value)
+        
+        if value == _NO_POSITION:
+            return None
+        
+        position, updated_at = value
+        return {"position": position, "updated_at": updated_at.isoformat()}
+    
+    def flush(self, db: Session) -> int:
+        """
+        批量写入待写入的位置
+        
+        同一 (用户, 视频) 只保留上报时间较新的位置（多个进程并发写入时也成立）；
+        视频已不存在的条目被丢弃，写入失败时放回缓冲区等待下次刷盘
+        
+        Args:
+            db: 数据库会话
+            
+        Returns:
+            写入的条目数量
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            
+            if not pending:
+                return 0
+            
+            try:
+                existing = {
+                    video_id for (video_id,) in db.query(VodVideo.id).filter(
+                        VodVideo.id.in_({video_id for _, video_id in pending})
+                    ).all()
+                }
+                rows = [
+                    {"user_id": user_id, "video_id": video_id, "position": position, "updated_at": at}
+                    for (user_id, video_id), (position, at) in pending.items()
+                    if video_id in existing
+                ]
+                if rows:
+                    db.execute(upsert_statement(db, rows))
+                db.commit()
+            except Exception:
+                db.rollback()
+                with self._lock:
+                    for key, value in pending.items():
+                        current = self._pending.get(key)
+                        if current is None or current[1] < value[1]:
+                            self._pending[key] = value
+                raise
+            
+            self.flushed += len(rows)
+            self.dropped += len(pending) - len(rows)
+            self.flushes += 1
+            return len(rows)
+    
+    def clear(self):
+        self.cache.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        stats = self.cache.stats()
+        stats.update({
+            "pending": len(self._pending),
+            "db_reads": self.db_reads,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "dropped": self.dropped
+        })
+        return stats
+
+
+def upsert_statement(db: Session, rows):
+    """续播位置的upsert语句：已存在时仅在上报时间不早于已保存的时间时覆盖"""
+    table = ResumePosition.__table__
+    dialect = db.get_bind().dialect.name
+    
+    if dialect == "mysql":
+        stmt = mysql_insert(table).values(rows)
+        newer = table.c.updated_at <= stmt.inserted.updated_at
+        # MySQL按顺序执行赋值，position需在updated_at之前更新
+        return stmt.on_duplicate_key_update([
+            ("position", case((newer, stmt.inserted.position), else_=table.c.position)),
+            ("updated_at", case((newer, stmt.inserted.updated_at), else_=table.c.updated_at))
+        ])
+    
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite_insert if dialect == "sqlite" else postgresql_insert)(table).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=["user_id", "video_id"],
+            set_={"position": stmt.excluded.position, "updated_at": stmt.excluded.updated_at},
+            where=table.c.updated_at <= stmt.excluded.updated_at
+        )
+    
+    raise ValueError(f"不支持的数据库类型: {dialect}")
+
+
+# 进程级单例
+resume_position_store = ResumePositionStore()
+
+
+def flush_resume_positions():
+    """将缓冲的续播位置写入数据库（由后台任务和关闭钩子调用）"""
+    db = SessionLocal()
+    try:
+        resume_position_store.flush(db)
+    finally:
+        db.close()
@@ -3,6 +3,8 @@ HttpOnly Cookie + Server-Side Session 管理器
 """
 
 import json
+import os
+import time
 import uuid
 import base64
 from datetime import datetime, timedelta
@@ -11,11 +13,15 @@ from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import secrets
 from sqlalchemy.orm import Session as DBSession
 
-from models import User, Session, SessionEvent
+from models import User, Session, SessionEvent, SessionLocal
+from session_store import SessionStore, ActivityTracker, session_store, activity_tracker
+from principal_cache import user_principal_cache
 
 
 class WebSessionManager:
-    def __init__(self, db: DBSession, secret_key: str, session_timeout: int = 3600):
+    def __init__(self, db: DBSession, secret_key: str, session_timeout: int = 3600,
+                 store: Optional[SessionStore] = None,
+                 activity: Optional[ActivityTracker] = None):
         """
         初始化Web会话管理器
         
@@ -23,10 +29,14 @@ class WebSessionManager:
             db: 数据库会话
             secret_key: 加密密钥 (32字节)
             session_timeout: 会话超时时间(秒)，默认1小时
+            store: 会话缓存存储，默认使用进程级单例
+            activity: 活动时间写回缓冲区，默认使用进程级单例
         """
         self.db = db
         self.secret_key = secret_key.encode() if isinstance(secret_key, str) else secret_key
         self.session_timeout = session_timeout
+        self.store = store if store is not None else session_store
+        self.activity = activity if activity is not None else activity_tracker
         
         if len(self.secret_key) != 32:
             raise ValueError("Secret key must be 32 bytes for AES-256")
@@ -96,6 +106,10 @@ class WebSessionManager:
         self.db.add(event)
         self.db.commit()
         
+        # 写入会话缓存
+        entry = self._cache_session(session)
+        entry["data"] = session_data_dict
+        
         return session_id
     
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
@@ -108,48 +122,51 @@ class WebSessionManager:
         Returns:
             会话数据字典，如果会话不存在或已过期则返回None
         """
-        # 清理过期会话
-        self._cleanup_expired_sessions()
-        
-        # 查询会话
-        session = self.db.query(Session).filter(
-            Session.id == session_id,
-            Session.expires_at > datetime.utcnow()
-        ).first()
-        
-        if not session:
-            return None
-        
-        # 更新最后活动时间
-        session.last_activity_at = datetime.utcnow()
+        # 过期会话由后台清理任务（SessionSweeper）批量删除，读取路径不写数据库
+        now = datetime.utcnow()
         
-        try:
-            # 解密会话数据
-            session_data = self._decrypt_session_data(session.session_data)
-            
-            # 更新会话数据中的最后活动时间
-            session_data["last_activity"] = session.last_activity_at.isoformat()
-            
-            # 重新加密并保存
-            session.session_data = self._encrypt_session_data(session_data)
+        # 优先从会话缓存读取，未命中时查询数据库
+        entry = self.store.get(session_id)
+        if entry is None:
+            session = self.db.query(Session).filter(
+                Session.id == session_id,
+                Session.expires_at > now
+            ).first()
             
-            self.db.commit()
-            
-            # 返回会话数据（包含元数据）
-            return {
-                "session_id": session_id,
-                "user_id": session.user_id,
-                "session_data": session_data,
-                "device_info": session.device_info,
-                "ip_address": session.ip_address,
-                "last_activity_at": session.last_activity_at,
-                "expires_at": session.expires_at
-            }
+            if not session:
+                return None
             
-        except Exception:
-            # 解密失败，删除损坏的会话
-            self._invalidate_session(session_id, "decryption_failed")
+            entry = self._cache_session(session)
+        
+        if entry["expires_at"] <= now:
+            self.store.delete(session_id)
             return None
+        
+        # 解密结果缓存在进程内条目中，只需解密一次
+        if entry.get("data") is None:
+            try:
+                entry["data"] = self._decrypt_session_data(entry["session_data"])
+            except Exception:
+                # 解密失败，删除损坏的会话
+                self._invalidate_session(session_id, "decryption_failed")
+                return None
+        
+        # 最后活动时间只写入内存缓冲区，由后台任务批量刷盘
+        self.activity.touch(session_id, now)
+        
+        session_data = dict(entry["data"])
+        session_data["last_activity"] = now.isoformat()
+        
+        # 返回会话数据（包含元数据）
+        return {
+            "session_id": session_id,
+            "user_id": entry["user_id"],
+            "session_data": session_data,
+            "device_info": entry["device_info"],
+            "ip_address": entry["ip_address"],
+            "last_activity_at": now,
+            "expires_at": entry["expires_at"]
+        }
     
     def invalidate_session(self, session_id: str, reason: str = "logout") -> bool:
         """
@@ -179,6 +196,8 @@ class WebSessionManager:
         self.db.delete(session)
         self.db.commit()
         
+        self._evict_session(session_id)
+        
         # 可选：在另一个表中记录注销事件（不依赖外键）
         # 这里我们只是返回成功，事件记录可以在应用日志中查看
         
@@ -196,6 +215,7 @@ class WebSessionManager:
             失效的会话数量
         """
         sessions = self.db.query(Session).filter(Session.user_id == user_id).all()
+        session_ids = [session.id for session in sessions]
         
         count = 0
         for session in sessions:
@@ -209,6 +229,13 @@ class WebSessionManager:
         if count > 0:
             self.db.commit()
         
+        # 提交后再清缓存，避免其他进程在提交前从数据库读回并重新缓存
+        for session_id in session_ids:
+            self._evict_session(session_id)
+        
+        # 同时清除该用户的认证主体缓存
+        user_principal_cache.invalidate(user_id)
+        
         return count
     
     def get_user_sessions(self, user_id: int) -> list:
@@ -228,11 +255,14 @@ class WebSessionManager:
         
         result = []
         for session in sessions:
+            # 合并尚未刷盘的活动时间
+            last_activity_at = self.activity.last_activity(session.id) or session.last_activity_at
+            
             result.append({
                 "session_id": session.id,
                 "device_info": session.device_info,
                 "ip_address": session.ip_address,
-                "last_activity_at": session.last_activity_at,
+                "last_activity_at": last_activity_at,
                 "expires_at": session.expires_at,
                 "created_at": session.created_at
             })
@@ -263,9 +293,33 @@ class WebSessionManager:
         session.last_activity_at = datetime.utcnow()
         
         self.db.commit()
+        
+        # 更新缓存中的过期时间
+        self.activity.discard(session_id)
+        self._cache_session(session)
         return True
     
     # 私有方法
+    def _cache_session(self, session: Session) -> Dict[str, Any]:
+        """将会话记录写入缓存，返回缓存条目"""
+        entry = {
+            "user_id": session.user_id,
+            "session_data": session.session_data,
+            "device_info": session.device_info,
+            "ip_address": session.ip_address,
+            "last_activity_at": session.last_activity_at,
+            "expires_at": session.expires_at,
+            "created_at": session.created_at
+        }
+        ttl = (session.expires_at - datetime.utcnow()).total_seconds()
+        self.store.set(session.id, entry, ttl)
+        return entry
+    
+    def _evict_session(self, session_id: str):
+        """从缓存和活动缓冲区中移除会话"""
+        self.store.delete(session_id)
+        self.activity.discard(session_id)
+    
     def _encrypt_session_data(self, data: Dict[str, Any]) -> str:
         """加密会话数据"""
         json_data = json.dumps(data, ensure_ascii=False)
@@ -331,25 +385,6 @@ class WebSessionManager:
         
         return f"{device} - {os} - {browser}"
     
-    def _cleanup_expired_sessions(self):
-        """清理过期会话"""
-        now = datetime.utcnow()
-        
-        # 查找过期会话
-        expired_sessions = self.db.query(Session).filter(
-            Session.expires_at <= now
-        ).all()
-        
-        for session in expired_sessions:
-            # 先删除相关的会话事件记录
-            self.db.query(SessionEvent).filter(SessionEvent.session_id == session.id).delete()
-            
-            # 然后删除会话
-            self.db.delete(session)
-        
-        if expired_sessions:
-            self.db.commit()
-    
     def _invalidate_session(self, session_id: str, reason: str):
         """内部方法：使会话失效"""
         session = self.db.query(Session).filter(Session.id == session_id).first()
@@ -361,3 +396,124 @@ class WebSessionManager:
             # 然后删除会话
             self.db.delete(session)
             self.db.commit()
+        
+        self._evict_session(session_id)
+
+
+class SessionSweeper:
+    """过期会话清理器：后台分批删除过期会话及其事件记录"""
+    
+    def __init__(self, batch_size: int = 500, max_batches: int = 20,
+                 store: Optional[SessionStore] = None,
+                 activity: Optional[ActivityTracker] = None):
+        """
+        初始化过期会话清理器
+        
+        Args:
+            batch_size: 每批删除的会话数量
+            max_batches: 单次运行最多处理的批数（剩余部分留到下次运行）
+            store: 会话缓存存储，默认使用进程级单例
+            activity: 活动时间写回缓冲区，默认使用进程级单例
+        """
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.store = store if store is not None else session_store
+        self.activity = activity if activity is not None else activity_tracker
+        
+        # 进度计数
+        self.runs = 0
+        self.batches = 0
+        self.sessions_deleted = 0
+        self.events_deleted = 0
+        self.backlogged_runs = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_run_deleted = 0
+        self.last_run_ms = 0.0
+    
+    def sweep(self, db: DBSession) -> int:
+        """
+        分批删除过期会话
+        
+        Args:
+            db: 数据库会话
+            
+        Returns:
+            本次删除的会话数量
+        """
+        started = time.monotonic()
+        now = datetime.utcnow()
+        deleted = 0
+        
+        for _ in range(self.max_batches):
+            expired_ids = [
+                row[0] for row in db.query(Session.id).filter(
+                    Session.expires_at <= now
+                ).limit(self.batch_size).all()
+            ]
+            
+            if not expired_ids:
+                break
+            
+            # 先删除相关的会话事件记录，再删除会话
+            events = db.query(SessionEvent).filter(
+                SessionEvent.session_id.in_(expired_ids)
+            ).delete(synchronize_session=False)
+            
+            db.query(Session).filter(
+                Session.id.in_(expired_ids)
+            ).delete(synchronize_session=False)
+            
+            db.commit()
+            
+            for session_id in expired_ids:
+                self.store.delete(session_id)
+                self.activity.discard(session_id)
+            
+            deleted += len(expired_ids)
+            self.batches += 1
+            self.sessions_deleted += len(expired_ids)
+            self.events_deleted += events
+            
+            if len(expired_ids) < self.batch_size:
+                break
+        else:
+            # 达到单次批数上限，仍有积压
+            self.backlogged_runs += 1
+        
+        self.runs += 1
+        self.last_run_at = now
+        self.last_run_deleted = deleted
+        self.last_run_ms = round((time.monotonic() - started) * 1000, 2)
+        return deleted
+    
+    def stats(self) -> Dict[str, Any]:
+        """获取清理进度计数"""
+        return {
+            "runs": self.runs,
+            "batches": self.batches,
+            "sessions_deleted": self.sessions_deleted,
+            "events_deleted": self.events_deleted,
+            "backlogged_runs": self.backlogged_runs,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_run_deleted": self.last_run_deleted,
+            "last_run_ms": self.last_run_ms
+        }
+
+
+# 过期会话清理配置
+SESSION_SWEEP_INTERVAL_SECONDS = int(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "300"))
+SESSION_SWEEP_BATCH_SIZE = int(os.getenv("SESSION_SWEEP_BATCH_SIZE", "500"))
+
+session_sweeper = SessionSweeper(batch_size=SESSION_SWEEP_BATCH_SIZE)
+
+
+def sweep_expired_sessions():
+    """清理过期会话（由后台任务调用）"""
+    db = SessionLocal()
+    try:
+        session_sweeper.sweep(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,272 @@
+"""
+Web会话存储层
+进程内LRU/TTL缓存 + 可选的共享缓存（Redis协议兼容服务），
+会话最后活动时间批量异步写回数据库
+"""
+
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+from sqlalchemy import update, bindparam
+from sqlalchemy.orm import Session as DBSession
+
+from cache_utils import TTLCache
+from models import Session, SessionLocal
+
+try:
+    import redis
+except ImportError:  # 共享缓存为可选依赖
+    redis = None
+
+
+# 会话存储配置
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "5"))  # 本地缓存只存活几秒，其他进程撤销的会话最多在该时间内仍被接受
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "")
+SESSION_ACTIVITY_FLUSH_SECONDS = int(os.getenv("SESSION_ACTIVITY_FLUSH_SECONDS", "30"))
+
+# 不写入共享缓存的字段（仅进程内使用，如解密后的会话数据）
+_LOCAL_ONLY_FIELDS = ("data",)
+_DATETIME_FIELDS = ("last_activity_at", "expires_at", "created_at")
+
+
+class SessionStore(ABC):
+    """会话存储接口"""
+    
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取会话缓存条目，不存在时返回None"""
+    
+    @abstractmethod
+    def set(self, session_id: str, entry: Dict[str, Any], ttl: float):
+        """写入会话缓存条目，ttl为存活秒数"""
+    
+    @abstractmethod
+    def delete(self, session_id: str):
+        """删除会话缓存条目"""
+    
+    def exists(self, session_id: str) -> bool:
+        """会话是否仍在存储中（用于校验其他层缓存的条目是否已被撤销）"""
+        return self.get(session_id) is not None
+    
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class MemorySessionStore(SessionStore):
+    """进程内LRU/TTL会话存储"""
+    
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE, ttl: float = SESSION_CACHE_TTL):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl, name="sessions")
+    
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.cache.get(session_id)
+    
+    def set(self, session_id: str, entry: Dict[str, Any], ttl: float):
+        self.cache.set(session_id, entry, min(ttl, self.cache.ttl))
+    
+    def delete(self, session_id: str):
+        self.cache.pop(session_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
+
+
+class RedisSessionStore(SessionStore):
+    """共享会话存储（Redis协议兼容服务）"""
+    
+    def __init__(self, url: str, prefix: str = "xxdfq:session:"):
+        if redis is None:
+            raise ImportError("请安装redis库: pip install redis")
+        
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.prefix = prefix
+        self.errors = 0
+    
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = self.client.get(self.prefix + session_id)
+        except Exception:
+            # 共享缓存不可用时退回数据库
+            self.errors += 1
+            return None
+        
+        if raw is None:
+            return None
+        
+        entry = json.loads(raw)
+        for field in _DATETIME_FIELDS:
+            if entry.get(field):
+                entry[field] = datetime.fromisoformat(entry[field])
+        return entry
+    
+    def set(self, session_id: str, entry: Dict[str, Any], ttl: float):
+        payload = {
+            key: (value.isoformat() if isinstance(value, datetime) else value)
+            for key, value in entry.items()
+            if key not in _LOCAL_ONLY_FIELDS
+        }
+        try:
+            self.client.set(self.prefix + session_id, json.dumps(payload), ex=max(int(ttl), 1))
+        except Exception:
+            self.errors += 1
+    
+    def delete(self, session_id: str):
+        try:
+            self.client.delete(self.prefix + session_id)
+        except Exception:
+            self.errors += 1
+    
+    def exists(self, session_id: str) -> bool:
+        try:
+            return bool(self.client.exists(self.prefix + session_id))
+        except Exception:
+            # 无法确认时按不存在处理，由调用方回源数据库
+            self.errors += 1
+            return False
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"name": "sessions_shared", "errors": self.errors}
+
+
+class TieredSessionStore(SessionStore):
+    """
+    两级会话存储：先查进程内缓存，再查共享缓存
+    
+    会话撤销时只有执行撤销的进程能清掉自己的本地缓存，
+    因此本地命中后还要确认共享缓存中的条目仍在（一次EXISTS，不传输会话内容）
+    """
+    
+    def __init__(self, local: SessionStore, shared: SessionStore):
+        self.local = local
+        self.shared = shared
+        self.revoked = 0
+    
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        entry = self.local.get(session_id)
+        if entry is not None:
+            if self.shared.exists(session_id):
+                return entry
+            
+            # 已被其他进程撤销（或共享缓存不可用），交给调用方回源数据库
+            self.local.delete(session_id)
+            self.revoked += 1
+            return None
+        
+        entry = self.shared.get(session_id)
+        if entry is not None:
+            ttl = (entry["expires_at"] - datetime.utcnow()).total_seconds()
+            self.local.set(session_id, entry, ttl)
+        return entry
+    
+    def set(self, session_id: str, entry: Dict[str, Any], ttl: float):
+        self.local.set(session_id, entry, ttl)
+        self.shared.set(session_id, entry, ttl)
+    
+    def delete(self, session_id: str):
+        self.local.delete(session_id)
+        self.shared.delete(session_id)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"local": self.local.stats(), "shared": self.shared.stats(), "revoked": self.revoked}
+
+
+class ActivityTracker:
+    """会话最后活动时间的写回缓冲区，定期批量刷入sessions表"""
+    
+    def __init__(self):
+        self._pending: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self.flushed = 0
+        self.flushes = 0
+    
+    def touch(self, session_id: str, when: datetime):
+        """记录会话活动时间（仅写内存）"""
+        with self._lock:
+            self._pending[session_id] = when
+    
+    def last_activity(self, session_id: str) -> Optional[datetime]:
+        """获取尚未刷盘的最后活动时间"""
+        return self._pending.get(session_id)
+    
+    def discard(self, session_id: str):
+        """丢弃会话的待写回活动时间（会话已删除时调用）"""
+        with self._lock:
+            self._pending.pop(session_id, None)
+    
+    def flush(self, db: DBSession) -> int:
+        """
+        批量写回活动时间
+        
+        Args:
+            db: 数据库会话
+            
+        Returns:
+            写回的会话数量
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        if not pending:
+            return 0
+        
+        try:
+            db.execute(
+                update(Session.__table__)
+                .where(Session.__table__.c.id == bindparam("sid"))
+                .values(last_activity_at=bindparam("ts")),
+                [{"sid": session_id, "ts": ts} for session_id, ts in pending.items()]
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 写回失败，放回缓冲区等待下次刷盘（保留较新的时间）
+            with self._lock:
+                for session_id, ts in pending.items():
+                    current = self._pending.get(session_id)
+                    if current is None or current < ts:
+                        self._pending[session_id] = ts
+            raise
+        
+        self.flushed += len(pending)
+        self.flushes += 1
+        return len(pending)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "flushed": self.flushed,
+            "flushes": self.flushes
+        }
+
+
+def build_session_store() -> SessionStore:
+    """根据环境变量构建会话存储"""
+    local = MemorySessionStore()
+    
+    if not SESSION_REDIS_URL:
+        return local
+    
+    try:
+        return TieredSessionStore(local, RedisSessionStore(SESSION_REDIS_URL))
+    except ImportError as e:
+        print(f"共享会话缓存未启用: {str(e)}")
+        return local
+
+
+# 进程级单例
+session_store = build_session_store()
+activity_tracker = ActivityTracker()
+
+
+def flush_session_activity():
+    """将缓冲的会话活动时间写回数据库（由后台任务调用）"""
+    db = SessionLocal()
+    try:
+        activity_tracker.flush(db)
+    finally:
+        db.close()
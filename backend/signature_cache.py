@@ -0,0 +1,102 @@
+"""
+播放签名缓存
+进程内缓存已生成的psign，签名到期前提前失效并重新生成；
+play_signatures表作为可选的持久化层（VOD_SIGNATURE_PERSIST=true时启用）。
+psign本身不包含用户信息，免费内容按视频和签发时间段共享同一个签名
+"""
+
+import os
+import time
+import threading
+from typing import Optional, Dict, Any, Hashable, Tuple
+
+from cache_utils import TTLCache
+
+
+# 播放签名缓存配置
+VOD_SIGNATURE_CACHE_SIZE = int(os.getenv("VOD_SIGNATURE_CACHE_SIZE", "10000"))
+VOD_SIGNATURE_CACHE_TTL = int(os.getenv("VOD_SIGNATURE_CACHE_TTL", "86400"))  # 秒
+VOD_SIGNATURE_REFRESH_AHEAD = int(os.getenv("VOD_SIGNATURE_REFRESH_AHEAD", "3600"))  # 到期前多少秒重新生成
+VOD_SIGNATURE_PERSIST = os.getenv("VOD_SIGNATURE_PERSIST", "false").lower() == "true"
+# 免费内容共享签名的签发时间对齐粒度（秒）：同一时间段内所有观众、所有进程得到相同的签名
+VOD_SHARED_SIGNATURE_BUCKET = int(os.getenv("VOD_SHARED_SIGNATURE_BUCKET", "86400"))
+
+
+class PlaySignatureCache:
+    def __init__(self, maxsize: int = VOD_SIGNATURE_CACHE_SIZE, ttl: float = VOD_SIGNATURE_CACHE_TTL,
+                 refresh_ahead: float = VOD_SIGNATURE_REFRESH_AHEAD, persist: bool = VOD_SIGNATURE_PERSIST):
+        """
+        初始化播放签名缓存
+        
+        Args:
+            maxsize: 最大缓存签名数
+            ttl: 缓存存活时间上限(秒)
+            refresh_ahead: 签名到期前多少秒视为需要刷新（保证返回给客户端的签名至少还有这么久有效期）
+            persist: 是否同时读写play_signatures表
+        """
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl, name="play_signatures")
+        self.refresh_ahead = refresh_ahead
+        self.persist = persist
+        
+        self.generated = 0
+        self.shared_generated = 0
+        self.db_hits = 0
+        self.db_writes = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """获取缓存的签名信息，不存在或临近到期时返回None"""
+        return self.entries.get(key)
+    
+    def set(self, key: Hashable, sign_info: Dict[str, Any]):
+        """
+        缓存签名信息
+        
+        缓存存活时间截止到签名到期前refresh_ahead秒，之后的请求会重新生成签名
+        
+        Args:
+            key: 缓存键
+            sign_info: 签名信息，需包含expire_time（Unix时间戳）
+        """
+        ttl = min(self.entries.ttl, sign_info["expire_time"] - time.time() - self.refresh_ahead)
+        self.entries.set(key, sign_info, ttl=ttl)
+    
+    def shared_key(self, file_id: str) -> Tuple[str, str, int]:
+        """
+        内容级共享签名的缓存键：(file_id, "shared", 签发时间段起点)
+        
+        Returns:
+            缓存键，最后一项同时作为签名的签发时间
+        """
+        bucket = VOD_SHARED_SIGNATURE_BUCKET
+        return (file_id, "shared", int(time.time()) // bucket * bucket)
+    
+    def is_fresh(self, expire_time: float) -> bool:
+        """签名是否仍在刷新窗口之外（持久化层读出的签名使用）"""
+        return expire_time - time.time() > self.refresh_ahead
+    
+    def record(self, generated: int = 0, shared_generated: int = 0, db_hits: int = 0, db_writes: int = 0):
+        with self._lock:
+            self.generated += generated
+            self.shared_generated += shared_generated
+            self.db_hits += db_hits
+            self.db_writes += db_writes
+    
+    def clear(self):
+        self.entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        stats = self.entries.stats()
+        stats.update({
+            "refresh_ahead": self.refresh_ahead,
+            "persist": self.persist,
+            "generated": self.generated,
+            "shared_generated": self.shared_generated,
+            "db_hits": self.db_hits,
+            "db_writes": self.db_writes
+        })
+        return stats
+
+
+# 进程级单例
+play_signature_cache = PlaySignatureCache()
@@ -0,0 +1,27 @@
+"""
+测试公共配置
+导入应用前指向临时SQLite数据库，并填入腾讯云点播的测试配置
+"""
+
+import os
+import sys
+import tempfile
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ.setdefault("SECRET_KEY", "test-secret-key-" + "x" * 16)  # Web会话加密要求32字节
+os.environ.setdefault("TENCENT_SECRET_ID", "test-id")
+os.environ.setdefault("TENCENT_SECRET_KEY", "test-key")
+os.environ.setdefault("TENCENT_VOD_APP_ID", "1")
+os.environ.setdefault("TENCENT_VOD_PLAY_KEY", "test-play-key")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def client():
+    import main
+    
+    with TestClient(main.app, base_url="https://testserver") as client:
+        yield client
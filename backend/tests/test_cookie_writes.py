@@ -0,0 +1,95 @@
+"""
+Cookie会话的跨站请求伪造防护测试
+修改数据的管理接口只接受Bearer令牌；其他接口拒绝跨站来源携带的Cookie会话
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from auth import get_password_hash, create_access_token
+from models import SessionLocal, User, Course, UserCourse
+
+
+@pytest.fixture(scope="module")
+def cookie_client(client):
+    db = SessionLocal()
+    user = User(username="cookie-user", email="cookie@example.com", password_hash=get_password_hash("pw"))
+    course = Course(title="Cookie课程", status="published", access_level="free")
+    db.add_all([user, course])
+    db.flush()
+    db.add(UserCourse(user_id=user.id, course_id=course.id, progress=0, completed=False))
+    db.commit()
+    course_id = course.id
+    db.close()
+    
+    cookie_client = TestClient(main.app, base_url="https://testserver")
+    response = cookie_client.post("/api/auth/web/login", json={"username": "cookie-user", "password": "pw"})
+    assert response.status_code == 200
+    cookie_client.course_id = course_id
+    return cookie_client
+
+
+def test_enroll_requires_bearer_token(cookie_client):
+    response = cookie_client.post(
+        f"/api/user/courses/{cookie_client.course_id}/enroll",
+        json={"course_id": cookie_client.course_id}
+    )
+    
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize("origin, status_code", [
+    ("https://evil.example", 401),
+    ("null", 401),
+    ("http://localhost:8080", 200),
+    ("https://testserver", 200),
+])
+def test_cookie_progress_update_checks_origin(cookie_client, origin, status_code):
+    response = cookie_client.put(
+        f"/api/user/courses/{cookie_client.course_id}/progress",
+        json={"progress": 10},
+        headers={"Origin": origin}
+    )
+    
+    assert response.status_code == status_code
+
+
+def test_enroll_accepts_bearer_token_alongside_cookie(cookie_client, monkeypatch):
+    import auth
+    
+    token = cookie_client.post("/api/auth/login", json={"username": "cookie-user", "password": "pw"}).json()["access_token"]
+    lookups = []
+    get_by_subject = auth.user_principal_cache.get_by_subject
+    monkeypatch.setattr(
+        auth.user_principal_cache, "get_by_subject",
+        lambda db, subject: lookups.append(subject) or get_by_subject(db, subject)
+    )
+    
+    response = cookie_client.post(
+        f"/api/user/courses/{cookie_client.course_id}/enroll",
+        json={"course_id": cookie_client.course_id},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    
+    assert response.status_code != 401
+    # 令牌在请求内只解析一次，与其他认证依赖共享
+    assert lookups == ["cookie-user"]
+
+
+def test_bearer_only_route_rejects_disabled_user(client):
+    db = SessionLocal()
+    db.add(User(username="disabled-user", email="disabled@example.com",
+                password_hash=get_password_hash("pw"), is_active=False))
+    db.commit()
+    db.close()
+    token = create_access_token({"sub": "disabled-user"})
+    
+    response = client.post(
+        "/api/admin/courses",
+        json={"title": "x", "description": "", "age_range": "", "stage": "", "duration": "", "icon": "", "color": ""},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    
+    assert response.status_code == 400
+    assert response.json()["detail"] == "用户已被禁用"
@@ -0,0 +1,158 @@
+"""
+播放心跳刷盘的批量写入测试
+刷盘执行的语句数量与条目数量无关，学习统计按用户合并累加；
+缓冲区写满时只唤醒后台刷盘任务，超过硬上限时拒绝新的心跳
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from background import PeriodicTask
+from models import engine, create_tables, SessionLocal, User, VodVideo, UserLearningStats
+from playback_ingest import PlaybackBuffer, PlaybackBufferFull
+
+
+USER_COUNT = 20
+VIDEO_COUNT = 5
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    create_tables()
+    db = SessionLocal()
+    users = [
+        User(username=f"flush{i}", email=f"flush{i}@example.com", password_hash="-")
+        for i in range(USER_COUNT)
+    ]
+    videos = [
+        VodVideo(file_id=f"52858900000000003{i:02d}", title="刷盘视频", status="ready", duration=60)
+        for i in range(VIDEO_COUNT)
+    ]
+    db.add_all(users + videos)
+    db.commit()
+    
+    ids = [user.id for user in users], [video.id for video in videos]
+    db.close()
+    return ids
+
+
+def flush_statements(user_ids, video_ids, rounds):
+    """写入 用户数×视频数×rounds 次心跳后刷盘，返回刷盘执行的语句数量"""
+    buffer = PlaybackBuffer(max_entries=10 ** 6)
+    for _ in range(rounds):
+        for user_id in user_ids:
+            for video_id in video_ids:
+                buffer.add(user_id, video_id, play_duration=5, progress=50)
+    
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+    
+    db = SessionLocal()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        assert buffer.flush(db) == len(user_ids) * len(video_ids)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+        db.close()
+    return len(statements)
+
+
+def test_flush_statement_count_does_not_grow_with_entries(seeded):
+    user_ids, video_ids = seeded
+    
+    # 首次刷盘会回填统计行，先各写一次，比较的是之后的稳定状态
+    flush_statements(user_ids, video_ids, rounds=1)
+    
+    # 播放分析汇总按 (视频, 时间桶) 写入，比较时视频集合保持不变
+    small = flush_statements(user_ids[:2], video_ids, rounds=1)
+    large = flush_statements(user_ids, video_ids, rounds=3)
+    
+    assert large == small
+
+
+def test_flush_backfills_missing_stats_in_one_batch(seeded):
+    user_ids, video_ids = seeded
+    db = SessionLocal()
+    db.query(UserLearningStats).filter(UserLearningStats.user_id.in_(user_ids)).delete()
+    db.commit()
+    db.close()
+    
+    # 回填查询按用户分组，语句数量与缺失统计行的用户数无关
+    few = flush_statements(user_ids[:2], video_ids, rounds=1)
+    db = SessionLocal()
+    db.query(UserLearningStats).filter(UserLearningStats.user_id.in_(user_ids)).delete()
+    db.commit()
+    db.close()
+    many = flush_statements(user_ids, video_ids, rounds=1)
+    
+    assert many == few
+
+
+def test_flush_accumulates_learning_seconds_per_user(seeded):
+    user_ids, video_ids = seeded
+    db = SessionLocal()
+    before = {
+        stats.user_id: stats.total_learning_seconds
+        for stats in db.query(UserLearningStats).filter(UserLearningStats.user_id.in_(user_ids))
+    }
+    db.close()
+    
+    flush_statements(user_ids, video_ids, rounds=2)
+    
+    db = SessionLocal()
+    try:
+        for stats in db.query(UserLearningStats).filter(UserLearningStats.user_id.in_(user_ids)):
+            assert stats.total_learning_seconds == before[stats.user_id] + VIDEO_COUNT * 2 * 5
+            assert stats.last_learning_date == datetime.utcnow().date()
+            assert stats.last_activity_at > datetime.utcnow() - timedelta(minutes=1)
+    finally:
+        db.close()
+
+
+def test_full_buffer_wakes_flusher_instead_of_flushing_inline(seeded, monkeypatch):
+    import playback_ingest
+    
+    def flush_inline(*args, **kwargs):
+        raise AssertionError("心跳请求线程不应刷盘")
+    
+    monkeypatch.setattr(playback_ingest, "flush_playback_buffer", flush_inline)
+    wakeups = []
+    buffer = PlaybackBuffer(max_entries=2, hard_limit=3)
+    buffer.on_full = lambda: wakeups.append(True)
+    
+    buffer.add(1, 1, play_duration=5, progress=10)
+    assert not wakeups
+    buffer.add(1, 2, play_duration=5, progress=10)
+    assert len(wakeups) == 1
+    buffer.add(1, 3, play_duration=5, progress=10)
+    
+    # 达到硬上限后拒绝新的条目，已有条目继续合并
+    with pytest.raises(PlaybackBufferFull):
+        buffer.add(1, 4, play_duration=5, progress=10)
+    assert buffer.add(1, 1, play_duration=5, progress=20)["play_duration"] == 10
+    assert buffer.stats()["shed"] == 1
+    assert buffer.stats()["pending"] == 3
+
+
+def test_periodic_task_runs_early_when_woken():
+    runs = []
+    task = PeriodicTask("wake-test", lambda: runs.append(True), interval=3600)
+    
+    async def scenario():
+        task.start()
+        await asyncio.sleep(0)
+        # 在其他线程唤醒，模拟心跳请求的线程池线程
+        await asyncio.to_thread(task.wake)
+        for _ in range(100):
+            if runs:
+                break
+            await asyncio.sleep(0.01)
+        await task.stop()
+    
+    asyncio.run(scenario())
+    assert runs == [True]
@@ -0,0 +1,85 @@
+"""
+播放心跳接口的参数校验测试
+非法参数返回400且不写入心跳缓冲和续播位置
+"""
+
+import pytest
+
+from auth import get_password_hash
+from models import SessionLocal, User, VodVideo
+from playback_ingest import playback_buffer
+from resume_positions import resume_position_store
+
+
+@pytest.fixture(scope="module")
+def headers(client):
+    db = SessionLocal()
+    db.add(User(username="viewer", email="viewer@example.com", password_hash=get_password_hash("pw")))
+    video = VodVideo(file_id="5285890000000000201", title="心跳视频", status="ready", duration=60)
+    db.add(video)
+    db.commit()
+    db.close()
+    
+    response = client.post("/api/auth/login", json={"username": "viewer", "password": "pw"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def video_id(headers):
+    db = SessionLocal()
+    try:
+        return db.query(VodVideo.id).filter(VodVideo.file_id == "5285890000000000201").scalar()
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("payload, status_code", [
+    ({"video_id": "abc"}, 400),
+    ({"video_id": 999999}, 404),
+    ({"video_id": None}, 400),
+    ({"position": "abc"}, 400),
+    ({"position": -1}, 400),
+    ({"position": float("inf")}, 400),
+    ({"position": float("nan")}, 400),
+    ({"progress": "half"}, 400),
+])
+def test_invalid_heartbeat_is_rejected(client, headers, video_id, payload, status_code):
+    body = {"video_id": video_id, "play_duration": 5, "progress": 10, **payload}
+    
+    response = client.post("/api/vod/playback/record", json=body, headers=headers)
+    
+    assert response.status_code == status_code
+    assert playback_buffer.stats()["pending"] == 0
+    assert resume_position_store.stats()["pending"] == 0
+
+
+def test_valid_heartbeat_is_buffered(client, headers, video_id):
+    response = client.post(
+        "/api/vod/playback/record",
+        json={"video_id": video_id, "play_duration": 5, "progress": 10, "position": 12.5},
+        headers=headers
+    )
+    
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["buffered"] is True
+    # 缓冲写入前保留原有响应字段
+    assert {"record_id", "play_duration", "progress", "completed", "updated_at"} <= data.keys()
+    assert data["record_id"] is None and data["updated_at"] is None
+    
+    resume = client.get(f"/api/vod/playback/resume/{video_id}", headers=headers).json()
+    assert resume["data"]["position"] == 12.5
+
+
+def test_heartbeat_is_shed_when_buffer_is_over_hard_limit(client, headers, video_id, monkeypatch):
+    monkeypatch.setattr(playback_buffer, "_pending", {})
+    monkeypatch.setattr(playback_buffer, "hard_limit", 0)
+    
+    response = client.post(
+        "/api/vod/playback/record",
+        json={"video_id": video_id, "play_duration": 5, "progress": 10},
+        headers=headers
+    )
+    
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
@@ -0,0 +1,70 @@
+"""
+播放器启动接口的权限测试
+匿名用户请求付费课程视频、未发布课程的视频时不能拿到任何视频信息
+"""
+
+import pytest
+
+from models import SessionLocal, Course, Lesson, VodVideo
+
+
+@pytest.fixture(scope="module", autouse=True)
+def videos(client):
+    db = SessionLocal()
+    courses = {
+        "free": Course(title="免费课", status="published", access_level="free"),
+        "premium": Course(title="付费课", status="published", access_level="premium"),
+        "draft": Course(title="草稿课", status="draft", access_level="internal"),
+    }
+    db.add_all(courses.values())
+    db.flush()
+    
+    seeds = [
+        ("free", "5285890000000000101", "ready", "https://cdn.example/free.mp4"),
+        ("premium", "5285890000000000102", "ready", "https://cdn.example/paid.mp4"),
+        ("draft", "5285890000000000103", "processing", "https://cdn.example/internal.mp4"),
+    ]
+    for level, file_id, video_status, play_url in seeds:
+        lesson = Lesson(course_id=courses[level].id, title=f"{level}章节", sort_order=0)
+        db.add(lesson)
+        db.flush()
+        db.add(VodVideo(
+            file_id=file_id, title=f"{level}视频", description="内部描述",
+            course_id=courses[level].id, lesson_id=lesson.id,
+            status=video_status, play_url=play_url, duration=60
+        ))
+    db.commit()
+    db.close()
+
+
+def video_id(file_id: str) -> int:
+    db = SessionLocal()
+    try:
+        return db.query(VodVideo.id).filter(VodVideo.file_id == file_id).scalar()
+    finally:
+        db.close()
+
+
+def test_anonymous_free_video(client):
+    response = client.get(f"/api/vod/video/{video_id('5285890000000000101')}/bootstrap")
+    
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert data["has_access"] is True
+    assert data["playback"]["psign"]
+
+
+def test_anonymous_premium_video_is_forbidden(client):
+    response = client.get(f"/api/vod/video/{video_id('5285890000000000102')}/bootstrap")
+    
+    assert response.status_code == 403
+    assert "cdn.example" not in response.text
+    assert "内部描述" not in response.text
+
+
+def test_draft_course_video_is_not_served(client):
+    response = client.get(f"/api/vod/video/{video_id('5285890000000000103')}/bootstrap")
+    
+    assert response.status_code == 404
+    assert "cdn.example" not in response.text
+    assert "内部描述" not in response.text
@@ -5,22 +5,44 @@
 
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Body, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from typing import Optional, Dict, Any, List
 import json
+import math
+from datetime import datetime, timedelta
 
 from models import get_db, User, VodVideo, Course, Lesson
-from auth import get_current_user, get_current_user_optional, verify_video_token
-from vod_service import VodManager, validate_file_id, format_duration
+from auth import verify_video_token
+from dependencies import get_current_user_hybrid, require_current_user_hybrid, get_current_user_from_token
+from vod_service import VodManager, get_vod_service, reload_vod_service, validate_file_id, format_duration
+from playback_ingest import playback_buffer, PlaybackBufferFull, PLAYBACK_FLUSH_SECONDS
+from resume_positions import resume_position_store
+from playback_rollups import (
+    ROLLUP_DIMENSIONS, ROLLUP_GRANULARITIES, MAX_ROLLUP_KEYS, ROLLUP_MAX_RANGE_DAYS, query_rollups
+)
+from pagination import MAX_PAGE_SIZE, paginate, parse_fields, project_columns
 
 router = APIRouter(prefix="/api/vod", tags=["腾讯云点播"])
 security = HTTPBearer()
 
+# 课程视频列表分页排序键与可选字段
+VIDEO_PAGE_KEYS = [(VodVideo.created_at, False), (VodVideo.id, False)]
+VIDEO_FIELDS = [
+    "id", "title", "description", "duration", "duration_formatted", "size",
+    "resolution", "cover_url", "status", "has_access", "created_at", "lesson"
+]
+# 计算字段依赖的列
+VIDEO_FIELD_COLUMNS = {
+    "duration_formatted": ["duration"],
+    "has_access": [],
+    "lesson": ["lesson_id"]
+}
+
 
 @router.get("/signature")
-async def get_playback_signature(
+def get_playback_signature(
     file_id: str = Query(..., description="腾讯云视频FileID"),
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_current_user_hybrid),
     db: Session = Depends(get_db)
 ):
     """
@@ -36,9 +58,11 @@ async def get_playback_signature(
                 detail="无效的FileID格式"
             )
         
-        # 获取播放签名
+        # 获取播放签名（免费内容使用共享签名）
         vod_manager = VodManager(db)
-        sign_info = vod_manager.get_or_create_signature(file_id, current_user.id)
+        sign_info = vod_manager.get_or_create_signature(
+            file_id, current_user.id, shared=vod_manager.is_shared_content(file_id)
+        )
         
         return {
             "success": True,
@@ -54,9 +78,9 @@ async def get_playback_signature(
 
 
 @router.get("/video/{video_id}")
-async def get_video_info(
+def get_video_info(
     video_id: int,
-    current_user: Optional[User] = Depends(get_current_user_optional),
+    current_user: Optional[User] = Depends(get_current_user_hybrid),
     db: Session = Depends(get_db)
 ):
     """
@@ -81,6 +105,10 @@ async def get_video_info(
         # 获取视频信息和播放签名
         video_info = vod_manager.get_video_with_signature(video_id, user_id)
         
+        # 登录用户附带续播位置
+        if user_id:
+            video_info["resume_position"] = resume_position_store.get(db, user_id, video_id)
+        
         return {
             "success": True,
             "data": video_info,
@@ -97,10 +125,54 @@ async def get_video_info(
         )
 
 
+@router.get("/video/{video_id}/bootstrap")
+def get_video_bootstrap(
+    video_id: int,
+    current_user: Optional[User] = Depends(get_current_user_hybrid),
+    db: Session = Depends(get_db)
+):
+    """
+    获取播放器启动数据
+    
+    一次返回视频信息、播放参数、续播位置和前后章节。
+    权限规则与/video/{id}相同：免费课程支持匿名访问，无权限时返回403
+    """
+    try:
+        user_id = current_user.id if current_user else None
+        
+        bootstrap = VodManager(db).get_playback_bootstrap(video_id, user_id)
+        if bootstrap is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="视频不存在"
+            )
+        
+        if not bootstrap["has_access"]:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="您没有权限观看此视频"
+            )
+        
+        return {
+            "success": True,
+            "data": bootstrap,
+            "message": "播放数据获取成功",
+            "is_anonymous": user_id is None
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"获取播放数据失败: {str(e)}"
+        )
+
+
 @router.post("/playback/record")
-async def record_playback(
+def record_playback(
     data: Dict[str, Any] = Body(...),
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_current_user_hybrid),
     db: Session = Depends(get_db),
     user_agent: Optional[str] = Header(None),
     x_forwarded_for: Optional[str] = Header(None, alias="X-Forwarded-For")
@@ -108,47 +180,89 @@ async def record_playback(
     """
     记录视频播放行为
     
-    记录用户的播放进度、时长等信息
+    记录用户的播放进度、时长等信息。心跳先写入内存缓冲并按 (用户, 视频) 合并，
+    由后台任务每PLAYBACK_FLUSH_SECONDS秒批量写入数据库（缓冲写满时提前写入，
+    超过硬上限时返回503）；携带position（当前播放位置，秒）时同时更新续播位置
+    
+    返回字段与同步写入时保持一致：record_id、updated_at在写入数据库前为null，
+    play_duration为上次写入后累计的时长；buffered为true表示已接收、尚未写入
     """
     try:
-        video_id = data.get("video_id")
-        play_duration = data.get("play_duration", 0)
-        progress = data.get("progress", 0)
         device_type = data.get("device_type", "web")
         
-        if not video_id:
+        if not data.get("video_id"):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="缺少必要参数: video_id"
             )
         
+        # 先校验全部参数再写入缓冲，避免只写入一半
+        try:
+            video_id = int(data["video_id"])
+            play_duration = int(data.get("play_duration") or 0)
+            progress = int(data.get("progress") or 0)
+            position = data.get("position")
+            if position is not None:
+                position = float(position)
+        except (TypeError, ValueError, OverflowError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="播放参数必须为数字"
+            )
+        
+        if position is not None and not (math.isfinite(position) and position >= 0):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="无效的播放位置"
+            )
+        
+        if not VodManager(db).video_exists(video_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="视频不存在"
+            )
+        
         # 获取IP地址
         ip_address = x_forwarded_for.split(",")[0].strip() if x_forwarded_for else ""
         
-        # 记录播放行为
-        vod_manager = VodManager(db)
-        record = vod_manager.record_playback(
-            user_id=current_user.id,
-            video_id=video_id,
-            play_duration=play_duration,
-            progress=progress,
-            device_type=device_type,
-            ip_address=ip_address,
-            user_agent=user_agent
-        )
+        # 写入心跳缓冲（刷盘前视频被删除的条目在刷盘时丢弃）
+        try:
+            entry = playback_buffer.add(
+                user_id=current_user.id,
+                video_id=video_id,
+                play_duration=play_duration,
+                progress=progress,
+                device_type=device_type,
+                ip_address=ip_address,
+                user_agent=user_agent or ""
+            )
+        except PlaybackBufferFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="播放记录繁忙，请稍后重试",
+                headers={"Retry-After": str(PLAYBACK_FLUSH_SECONDS)}
+            )
+        
+        if position is not None:
+            resume_position_store.set(current_user.id, entry["video_id"], position)
         
+        # 保留原有响应字段，写入数据库前record_id和updated_at为null
         return {
             "success": True,
             "data": {
-                "record_id": record.id,
-                "play_duration": record.play_duration,
-                "progress": record.progress,
-                "completed": record.completed,
-                "updated_at": record.updated_at.isoformat() if record.updated_at else None
+                "record_id": None,
+                "video_id": entry["video_id"],
+                "play_duration": entry["play_duration"],
+                "progress": entry["progress"],
+                "completed": entry["progress"] >= 95,
+                "updated_at": None,
+                "buffered": True
             },
-            "message": "播放记录保存成功"
+            "message": "播放记录已接收"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -156,27 +270,55 @@ async def record_playback(
         )
 
 
+@router.get("/playback/resume/{video_id}")
+def get_resume_position(
+    video_id: int,
+    current_user: User = Depends(require_current_user_hybrid),
+    db: Session = Depends(get_db)
+):
+    """
+    获取续播位置
+    
+    返回用户上次播放到的位置（秒），没有播放过时position为null
+    """
+    resume = resume_position_store.get(db, current_user.id, video_id)
+    
+    return {
+        "success": True,
+        "data": {
+            "video_id": video_id,
+            "position": resume["position"] if resume else None,
+            "updated_at": resume["updated_at"] if resume else None
+        },
+        "message": "续播位置获取成功"
+    }
+
+
 @router.get("/playback/history")
-async def get_playback_history(
-    current_user: User = Depends(get_current_user),
+def get_playback_history(
+    current_user: User = Depends(require_current_user_hybrid),
     db: Session = Depends(get_db),
-    limit: int = Query(20, ge=1, le=100, description="返回记录数量")
+    limit: int = Query(20, ge=1, le=100, description="返回记录数量"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的next_cursor）")
 ):
     """
     获取用户播放历史
     
-    返回用户最近观看的视频记录
+    按最后播放时间倒序返回用户最近观看的视频记录，next_cursor用于获取下一页
     """
     try:
         vod_manager = VodManager(db)
-        history = vod_manager.get_user_playback_history(current_user.id, limit)
+        history, next_cursor = vod_manager.get_user_playback_history(current_user.id, limit, cursor)
         
         return {
             "success": True,
             "data": history,
+            "next_cursor": next_cursor,
             "message": "播放历史获取成功"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -185,17 +327,22 @@ async def get_playback_history(
 
 
 @router.get("/course/{course_id}/videos")
-async def get_course_videos(
+def get_course_videos(
     course_id: int,
-    current_user: User = Depends(get_current_user),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的next_cursor）"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页条数，不传且不带游标时返回全部"),
+    fields: Optional[str] = Query(None, description="返回字段，逗号分隔，如 id,title,duration"),
+    current_user: User = Depends(require_current_user_hybrid),
     db: Session = Depends(get_db)
 ):
     """
     获取课程关联的视频列表
     
-    返回课程下的所有视频信息
+    按上传时间游标分页返回课程下的视频信息，fields可指定只返回部分字段
     """
     try:
+        requested = parse_fields(fields, VIDEO_FIELDS)
+        
         # 检查课程是否存在
         course = db.query(Course).filter(Course.id == course_id).first()
         if not course:
@@ -204,37 +351,46 @@ async def get_course_videos(
                 detail="课程不存在"
             )
         
-        # 获取课程视频
-        videos = db.query(VodVideo).filter(
+        # 获取课程视频（只加载请求的列）
+        query = db.query(VodVideo).filter(
             VodVideo.course_id == course_id,
             VodVideo.status == "ready"
-        ).order_by(VodVideo.created_at).all()
+        )
+        columns = project_columns(VodVideo, requested, VIDEO_PAGE_KEYS, VIDEO_FIELD_COLUMNS)
+        if columns is not None:
+            query = query.options(columns)
+        
+        # 关联章节随视频一起加载，避免逐行懒加载
+        if requested is None or "lesson" in requested:
+            query = query.options(joinedload(VodVideo.lesson).load_only(Lesson.id, Lesson.title))
+        
+        videos, next_cursor = paginate(query, VIDEO_PAGE_KEYS, cursor, limit)
+        
+        # 整页视频一次性检查播放权限
+        permissions = {}
+        if requested is None or "has_access" in requested:
+            permissions = VodManager(db).check_playback_permissions(
+                current_user.id, [video.id for video in videos]
+            )
         
         result = []
         for video in videos:
-            # 检查用户是否有权限观看
-            vod_manager = VodManager(db)
-            has_access = vod_manager.check_playback_permission(current_user.id, video.id)
-            
-            video_info = {
-                "id": video.id,
-                "title": video.title,
-                "description": video.description,
-                "duration": video.duration,
-                "duration_formatted": format_duration(video.duration) if video.duration else "00:00",
-                "size": video.size,
-                "resolution": video.resolution,
-                "cover_url": video.cover_url,
-                "status": video.status,
-                "has_access": has_access,
-                "created_at": video.created_at.isoformat() if video.created_at else None
-            }
-            
-            if video.lesson:
-                video_info["lesson"] = {
-                    "id": video.lesson.id,
-                    "title": video.lesson.title
-                }
+            video_info = {}
+            for name in requested or VIDEO_FIELDS:
+                if name == "has_access":
+                    video_info[name] = permissions.get(video.id, False)
+                elif name == "duration_formatted":
+                    video_info[name] = format_duration(video.duration) if video.duration else "00:00"
+                elif name == "created_at":
+                    video_info[name] = video.created_at.isoformat() if video.created_at else None
+                elif name == "lesson":
+                    if video.lesson:
+                        video_info[name] = {
+                            "id": video.lesson.id,
+                            "title": video.lesson.title
+                        }
+                else:
+                    video_info[name] = getattr(video, name)
             
             result.append(video_info)
         
@@ -246,7 +402,8 @@ async def get_course_videos(
                     "title": course.title,
                     "description": course.description
                 },
-                "videos": result
+                "videos": result,
+                "next_cursor": next_cursor
             },
             "message": "课程视频列表获取成功"
         }
@@ -261,9 +418,9 @@ async def get_course_videos(
 
 
 @router.post("/upload/init")
-async def init_video_upload(
+def init_video_upload(
     data: Dict[str, Any] = Body(...),
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_from_token),
     db: Session = Depends(get_db)
 ):
     """
@@ -315,8 +472,7 @@ async def init_video_upload(
                 )
         
         # 初始化腾讯云点播服务
-        from vod_service import TencentVodService
-        vod_service = TencentVodService()
+        vod_service = get_vod_service()
         
         # 创建上传任务
         upload_info = vod_service.create_upload_video(title, description, course_id, lesson_id)
@@ -337,9 +493,9 @@ async def init_video_upload(
 
 
 @router.post("/upload/confirm")
-async def confirm_video_upload(
+def confirm_video_upload(
     data: Dict[str, Any] = Body(...),
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_user_from_token),
     db: Session = Depends(get_db)
 ):
     """
@@ -367,8 +523,7 @@ async def confirm_video_upload(
             )
         
         # 确认上传
-        from vod_service import TencentVodService
-        vod_service = TencentVodService()
+        vod_service = get_vod_service()
         confirm_info = vod_service.confirm_upload(vod_session_key)
         
         # 创建视频记录
@@ -405,9 +560,9 @@ async def confirm_video_upload(
 
 
 @router.get("/statistics/{video_id}")
-async def get_video_statistics(
+def get_video_statistics(
     video_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(require_current_user_hybrid),
     db: Session = Depends(get_db)
 ):
     """
@@ -439,9 +594,74 @@ async def get_video_statistics(
         )
 
 
+@router.get("/analytics/playback")
+def get_playback_analytics(
+    dimension: str = Query("video", description="汇总维度: video/course/device"),
+    keys: Optional[str] = Query(None, description="逗号分隔的视频ID/课程ID/设备类型，不传返回该维度全部取值"),
+    granularity: str = Query("day", description="时间粒度: hour/day"),
+    start: Optional[datetime] = Query(None, description="起始时间（UTC，含），默认按粒度取最近24小时/7天"),
+    end: Optional[datetime] = Query(None, description="结束时间（UTC，不含），默认当前时间"),
+    current_user: User = Depends(require_current_user_hybrid),
+    db: Session = Depends(get_db)
+):
+    """
+    查询播放分析汇总
+    
+    按小时/天返回多个视频、课程或设备类型的播放次数、去重观看人数、观看时长和完成次数
+    （仅管理员和教师可访问）
+    """
+    if current_user.role not in ["admin", "teacher"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="您没有权限查看统计信息"
+        )
+    
+    if dimension not in ROLLUP_DIMENSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支持的汇总维度: {dimension}"
+        )
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不支持的时间粒度: {granularity}"
+        )
+    
+    key_list = None
+    if keys:
+        key_list = list(dict.fromkeys(key.strip() for key in keys.split(",") if key.strip()))
+        if len(key_list) > MAX_ROLLUP_KEYS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"一次最多查询{MAX_ROLLUP_KEYS}个取值"
+            )
+    
+    end = end or datetime.utcnow()
+    start = start or end - (timedelta(hours=24) if granularity == "hour" else timedelta(days=7))
+    if start >= end or end - start > timedelta(days=ROLLUP_MAX_RANGE_DAYS[granularity]):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"时间范围无效，按{granularity}查询最多{ROLLUP_MAX_RANGE_DAYS[granularity]}天"
+        )
+    
+    result = query_rollups(db, dimension, key_list, granularity, start, end)
+    
+    return {
+        "success": True,
+        "data": {
+            "dimension": dimension,
+            "granularity": granularity,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            **result
+        },
+        "message": "播放分析获取成功"
+    }
+
+
 @router.post("/cleanup/signatures")
-async def cleanup_expired_signatures(
-    current_user: User = Depends(get_current_user),
+def cleanup_expired_signatures(
+    current_user: User = Depends(get_current_user_from_token),
     db: Session = Depends(get_db)
 ):
     """
@@ -475,6 +695,39 @@ async def cleanup_expired_signatures(
         )
 
 
+@router.post("/config/reload")
+def reload_vod_config(
+    current_user: User = Depends(get_current_user_from_token)
+):
+    """
+    重新加载点播配置
+    
+    重新读取.env中的腾讯云点播配置并重建客户端（仅管理员可访问）
+    """
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="您没有权限执行此操作"
+        )
+    
+    try:
+        vod_service = reload_vod_service()
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    return {
+        "success": True,
+        "data": {
+            "app_id": vod_service.app_id,
+            "region": vod_service.region
+        },
+        "message": "点播配置已重新加载"
+    }
+
+
 @router.get("/health")
 async def vod_health_check():
     """
@@ -483,10 +736,8 @@ async def vod_health_check():
     检查服务是否正常
     """
     try:
-        from vod_service import TencentVodService
-        
-        # 尝试初始化服务
-        vod_service = TencentVodService()
+        # 获取（必要时初始化）服务
+        vod_service = get_vod_service()
         
         return {
             "success": True,
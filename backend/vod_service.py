@@ -8,41 +8,85 @@ import time
 import hashlib
 import base64
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 import json
+import threading
 
 from tencentcloud.common import credential
 from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
+from tencentcloud.common.profile.client_profile import ClientProfile
+from tencentcloud.common.profile.http_profile import HttpProfile
 from tencentcloud.vod.v20180717 import vod_client, models
-from sqlalchemy.orm import Session
+from sqlalchemy import func, case, tuple_, and_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, load_only, joinedload
+from fastapi import HTTPException
+from dotenv import load_dotenv
 
-from models import VodVideo, PlaySignature, VideoPlayRecord, User, Course, Lesson
+from models import VodVideo, PlaySignature, VideoPlayRecord, Course, Lesson
+from learning_stats import record_learning_activities
+from principal_cache import user_principal_cache
+from entitlements import entitlement_resolver
+from signature_cache import play_signature_cache
+from cache_utils import TTLCache
+from pagination import paginate
+from resume_positions import resume_position_store
+from playback_rollups import record_playback_rollups, PLAYBACK_SESSION_GAP_SECONDS
+
+
+# 点播API请求超时（秒）
+TENCENT_VOD_REQUEST_TIMEOUT = int(os.getenv("TENCENT_VOD_REQUEST_TIMEOUT", "30"))
+# 播放签名有效期（秒）
+TENCENT_VOD_SIGNATURE_EXPIRE_SECONDS = int(os.getenv("TENCENT_VOD_SIGNATURE_EXPIRE_SECONDS", "315360000"))
+# 视频统计缓存（管理后台看板），过期前统计最多落后这么久
+VIDEO_STATS_CACHE_TTL = int(os.getenv("VIDEO_STATS_CACHE_TTL", "30"))  # 秒
+# 用户播放历史缓存，写入新的播放记录时失效
+PLAYBACK_HISTORY_CACHE_SIZE = int(os.getenv("PLAYBACK_HISTORY_CACHE_SIZE", "2000"))
+PLAYBACK_HISTORY_CACHE_TTL = int(os.getenv("PLAYBACK_HISTORY_CACHE_TTL", "60"))  # 秒
+
+
+def read_vod_config() -> Dict[str, Optional[str]]:
+    """从环境变量读取点播配置"""
+    return {
+        "secret_id": os.getenv('TENCENT_SECRET_ID'),
+        "secret_key": os.getenv('TENCENT_SECRET_KEY'),
+        "app_id": os.getenv('TENCENT_VOD_APP_ID'),
+        "region": os.getenv('TENCENT_VOD_REGION', 'ap-shanghai'),
+        "play_domain": os.getenv('TENCENT_VOD_PLAY_DOMAIN', ''),
+        "play_key": os.getenv('TENCENT_VOD_PLAY_KEY'),
+    }
 
 
 class TencentVodService:
     """腾讯云点播服务"""
     
-    def __init__(self):
+    def __init__(self, config: Optional[Dict[str, Optional[str]]] = None):
         # 从环境变量获取配置
-        self.secret_id = os.getenv('TENCENT_SECRET_ID')
-        self.secret_key = os.getenv('TENCENT_SECRET_KEY')
-        self.app_id = os.getenv('TENCENT_VOD_APP_ID')
-        self.region = os.getenv('TENCENT_VOD_REGION', 'ap-shanghai')
-        self.play_domain = os.getenv('TENCENT_VOD_PLAY_DOMAIN', '')
+        config = config or read_vod_config()
+        self.secret_id = config["secret_id"]
+        self.secret_key = config["secret_key"]
+        self.app_id = config["app_id"]
+        self.region = config["region"]
+        self.play_domain = config["play_domain"]
+        self.play_key = config["play_key"]
         
         # 验证配置
         if not all([self.secret_id, self.secret_key, self.app_id]):
             raise ValueError("腾讯云点播配置不完整，请检查环境变量")
         
-        # 初始化腾讯云客户端
+        # 初始化腾讯云客户端（保持长连接，复用到点播API的TLS连接）
         self.cred = credential.Credential(self.secret_id, self.secret_key)
-        self.client = vod_client.VodClient(self.cred, self.region)
+        http_profile = HttpProfile(keepAlive=True, reqTimeout=TENCENT_VOD_REQUEST_TIMEOUT)
+        self.client = vod_client.VodClient(self.cred, self.region, ClientProfile(httpProfile=http_profile))
         
         # 签名有效期（秒）
-        # 设置为10年（315360000秒），接近永不过期
-        self.signature_expire_seconds = 315360000  # 10年
+        # 默认10年（315360000秒），接近永不过期
+        self.signature_expire_seconds = TENCENT_VOD_SIGNATURE_EXPIRE_SECONDS
         
-    def generate_psign(self, file_id: str, user_id: Optional[int] = None) -> Dict[str, Any]:
+    def generate_psign(self, file_id: str, user_id: Optional[int] = None,
+                       issued_at: Optional[int] = None) -> Dict[str, Any]:
         """
         生成播放签名(psign) - 根据腾讯云官方文档（JWT格式）
         
@@ -62,6 +106,7 @@ class TencentVodService:
         Args:
             file_id: 腾讯云视频FileID
             user_id: 用户ID（可选，仅用于记录，不包含在JWT中）
+            issued_at: 签发时间戳（可选，默认当前时间；相同的签发时间生成相同的签名）
             
         Returns:
             包含psign和相关信息的字典
@@ -70,12 +115,12 @@ class TencentVodService:
             import jwt
             
             # 检查播放密钥是否配置
-            play_key = os.getenv('TENCENT_VOD_PLAY_KEY')
+            play_key = self.play_key
             if not play_key:
                 raise ValueError("播放密钥未配置，请设置TENCENT_VOD_PLAY_KEY环境变量")
             
             # 计算时间戳
-            current_time = int(time.time())
+            current_time = int(time.time()) if issued_at is None else int(issued_at)
             expire_time = current_time + self.signature_expire_seconds
             
             # 构建JWT Header
@@ -321,69 +366,316 @@ class TencentVodService:
             raise Exception(f"获取任务状态失败: {str(e)}")
 
 
+# FileID -> 是否为免费内容（决定/signature接口是否使用共享签名）
+shared_content_cache = TTLCache(maxsize=10000, ttl=300, name="shared_content")
+
+# 视频ID -> 视频存在（播放心跳校验视频ID，只缓存存在的结果）
+video_exists_cache = TTLCache(maxsize=10000, ttl=300, name="video_exists")
+
+# 视频ID -> 统计结果
+video_stats_cache = TTLCache(maxsize=1000, ttl=VIDEO_STATS_CACHE_TTL, name="video_statistics")
+
+# 用户ID -> {(游标, 每页条数): (播放历史, 下一页游标)}
+playback_history_cache = TTLCache(
+    maxsize=PLAYBACK_HISTORY_CACHE_SIZE, ttl=PLAYBACK_HISTORY_CACHE_TTL, name="playback_history"
+)
+
+# 播放历史按最后播放时间倒序的游标分页键
+HISTORY_PAGE_KEYS = [(VideoPlayRecord.ended_at, True), (VideoPlayRecord.id, True)]
+
+
+# 进程级点播服务单例：按配置指纹复用，配置变化时重建
+_vod_service: Optional[TencentVodService] = None
+_vod_service_fingerprint: Optional[tuple] = None
+_vod_service_lock = threading.Lock()
+
+
+def get_vod_service() -> TencentVodService:
+    """
+    获取进程级点播服务（线程安全，首次使用时创建）
+    
+    每次调用都会比对环境变量配置，配置变更后自动重建客户端
+    
+    Raises:
+        ValueError: 点播配置不完整
+    """
+    global _vod_service, _vod_service_fingerprint
+    
+    config = read_vod_config()
+    fingerprint = tuple(sorted(config.items()))
+    
+    service = _vod_service
+    if service is not None and _vod_service_fingerprint == fingerprint:
+        return service
+    
+    with _vod_service_lock:
+        if _vod_service is None or _vod_service_fingerprint != fingerprint:
+            _vod_service = TencentVodService(config)
+            _vod_service_fingerprint = fingerprint
+            print(f"腾讯云点播服务已初始化: app_id={_vod_service.app_id}, region={_vod_service.region}")
+        return _vod_service
+
+
+def reload_vod_service() -> TencentVodService:
+    """重新加载.env中的点播配置并重建服务"""
+    global _vod_service
+    
+    load_dotenv(override=True)
+    with _vod_service_lock:
+        _vod_service = None
+    return get_vod_service()
+
+
+def is_shared_playback(course_id: Optional[int], course_status: Optional[str],
+                       access_level: Optional[str]) -> bool:
+    """
+    视频是否为免费内容（可使用所有人共享的播放签名）
+    
+    未关联课程，或所属课程为已发布的免费课程
+    """
+    return not course_id or (access_level == "free" and course_status == "published")
+
+
+def video_payload(video: VodVideo) -> Dict[str, Any]:
+    """视频信息（含已加载的课程和章节）"""
+    payload = {
+        "id": video.id,
+        "title": video.title,
+        "description": video.description,
+        "duration": video.duration,
+        "size": video.size,
+        "resolution": video.resolution,
+        "format": video.format,
+        "cover_url": video.cover_url,
+        "play_url": video.play_url,
+        "status": video.status,
+        "created_at": video.created_at.isoformat() if video.created_at else None,
+        "updated_at": video.updated_at.isoformat() if video.updated_at else None
+    }
+    
+    # 添加关联信息
+    if video.course:
+        payload["course"] = {
+            "id": video.course.id,
+            "title": video.course.title
+        }
+    
+    if video.lesson:
+        payload["lesson"] = {
+            "id": video.lesson.id,
+            "title": video.lesson.title
+        }
+    
+    return payload
+
+
+def play_record_values(video: VodVideo, user_id: int, play_duration: int, progress: int,
+                       device_type: str, ip_address: str, user_agent: str,
+                       started_at: datetime, ended_at: datetime) -> Dict[str, Any]:
+    """构造一行播放记录（upsert_play_records的输入）"""
+    return {
+        "user_id": user_id,
+        "video_id": video.id,
+        "course_id": video.course_id,
+        "lesson_id": video.lesson_id,
+        "play_duration": play_duration,
+        "total_duration": video.duration,
+        "progress": progress,
+        "completed": progress >= 95,  # 95%以上视为完成
+        "device_type": device_type or "web",
+        "ip_address": ip_address or "",
+        "user_agent": user_agent or "",
+        "started_at": started_at,
+        "ended_at": ended_at,
+        "updated_at": ended_at
+    }
+
+
+def upsert_play_records(db: Session, rows: List[Dict[str, Any]]):
+    """
+    插入播放记录，(user_id, video_id)已存在时在数据库端合并
+    
+    一条语句完成：播放时长累加、进度取最大值、完成状态按合并后的进度计算，
+    设备信息非空时覆盖；不需要先读出记录，也不会在Python代码执行期间持有行锁。
+    支持SQLite/PostgreSQL（ON CONFLICT）和MySQL（ON DUPLICATE KEY UPDATE），
+    依赖uq_play_records_user_video唯一索引
+    
+    Args:
+        db: 数据库会话
+        rows: play_record_values生成的记录，(user_id, video_id)不能重复
+    """
+    if not rows:
+        return
+    
+    table = VideoPlayRecord.__table__
+    dialect = db.get_bind().dialect.name
+    
+    if dialect == "mysql":
+        stmt = mysql_insert(table).values(rows)
+        incoming = stmt.inserted
+    elif dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite_insert if dialect == "sqlite" else postgresql_insert)(table).values(rows)
+        incoming = stmt.excluded
+    else:
+        raise ValueError(f"不支持的数据库类型: {dialect}")
+    
+    # SQLite的多参数max()即标量最大值
+    greatest = func.max if dialect == "sqlite" else func.greatest
+    progress = greatest(func.coalesce(table.c.progress, 0), incoming.progress)
+    
+    # MySQL按顺序执行赋值，completed读到的progress可能已是新值，取最大值的结果不变
+    updates = {
+        "play_duration": func.coalesce(table.c.play_duration, 0) + incoming.play_duration,
+        "progress": progress,
+        "completed": progress >= 95,
+        "device_type": func.coalesce(func.nullif(incoming.device_type, ""), table.c.device_type),
+        "ip_address": func.coalesce(func.nullif(incoming.ip_address, ""), table.c.ip_address),
+        "user_agent": func.coalesce(func.nullif(incoming.user_agent, ""), table.c.user_agent),
+        "ended_at": incoming.ended_at,
+        "updated_at": incoming.updated_at
+    }
+    
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(updates)
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=["user_id", "video_id"], set_=updates)
+    
+    db.execute(stmt)
+
+
 class VodManager:
     """点播视频管理器"""
     
     def __init__(self, db: Session):
         self.db = db
-        self.vod_service = TencentVodService()
     
-    def get_or_create_signature(self, file_id: str, user_id: Optional[int] = None) -> Dict[str, Any]:
+    @property
+    def vod_service(self) -> TencentVodService:
+        """点播服务（只在需要调用点播API或生成签名时获取）"""
+        return get_vod_service()
+    
+    def get_or_create_signature(self, file_id: str, user_id: Optional[int] = None,
+                                shared: bool = False) -> Dict[str, Any]:
         """
         获取或创建播放签名
         
+        先查进程内缓存；启用持久化时再查play_signatures表；都没有时生成新签名。
+        默认不访问数据库，签名生成只是本地HMAC计算
+        
         Args:
             file_id: 视频FileID
             user_id: 用户ID
+            shared: 是否使用内容级共享签名（免费内容，所有观众共用）
             
         Returns:
             播放签名信息
         """
+        if shared:
+            return self.get_shared_signature(file_id)
+        
+        cache_key = (file_id, user_id)
+        
+        cached = play_signature_cache.get(cache_key)
+        if cached is not None:
+            return {**cached, "from_cache": True}
+        
         try:
-            # 检查是否有未过期的缓存签名
-            now = datetime.utcnow()
-            signature = self.db.query(PlaySignature).filter(
-                PlaySignature.file_id == file_id,
-                PlaySignature.user_id == user_id,
-                PlaySignature.expires_at > now
-            ).first()
-            
-            if signature:
-                return {
-                    "psign": signature.psign,
-                    "app_id": self.vod_service.app_id,
-                    "file_id": file_id,
-                    "expire_at": signature.expires_at.isoformat(),
-                    "from_cache": True
-                }
+            # 持久化层中未临近到期的签名
+            if play_signature_cache.persist:
+                signature = self.db.query(PlaySignature).filter(
+                    PlaySignature.file_id == file_id,
+                    PlaySignature.user_id == user_id,
+                    PlaySignature.expires_at > datetime.utcnow()
+                ).order_by(PlaySignature.expires_at.desc()).first()
+                
+                if signature and play_signature_cache.is_fresh(signature.expires_at.timestamp()):
+                    sign_info = {
+                        "psign": signature.psign,
+                        "app_id": self.vod_service.app_id,
+                        "file_id": file_id,
+                        "expire_at": signature.expires_at.isoformat(),
+                        "expire_time": int(signature.expires_at.timestamp())
+                    }
+                    play_signature_cache.set(cache_key, sign_info)
+                    play_signature_cache.record(db_hits=1)
+                    return {**sign_info, "from_cache": True}
             
             # 生成新签名
-            sign_info = self.vod_service.generate_psign(file_id, user_id)
+            generated = self.vod_service.generate_psign(file_id, user_id)
+            sign_info = {
+                "psign": generated["psign"],
+                "app_id": generated["app_id"],
+                "file_id": file_id,
+                "expire_at": generated["expire_at"],
+                "expire_time": generated["expire_time"]
+            }
+            play_signature_cache.set(cache_key, sign_info)
+            play_signature_cache.record(generated=1)
             
             # 保存到数据库
-            expires_at = datetime.fromtimestamp(sign_info["expire_time"])
-            new_signature = PlaySignature(
-                file_id=file_id,
-                user_id=user_id,
-                psign=sign_info["psign"],
-                expires_at=expires_at
-            )
-            
-            self.db.add(new_signature)
-            self.db.commit()
+            if play_signature_cache.persist:
+                self.db.add(PlaySignature(
+                    file_id=file_id,
+                    user_id=user_id,
+                    psign=sign_info["psign"],
+                    expires_at=datetime.fromtimestamp(sign_info["expire_time"])
+                ))
+                self.db.commit()
+                play_signature_cache.record(db_writes=1)
             
-            return {
-                "psign": sign_info["psign"],
-                "app_id": sign_info["app_id"],
-                "file_id": file_id,
-                "expire_at": sign_info["expire_at"],
-                "from_cache": False
-            }
+            return {**sign_info, "from_cache": False}
             
         except Exception as e:
             self.db.rollback()
             raise Exception(f"获取播放签名失败: {str(e)}")
     
+    def get_shared_signature(self, file_id: str) -> Dict[str, Any]:
+        """
+        获取内容级共享播放签名（免费内容）
+        
+        签发时间对齐到VOD_SHARED_SIGNATURE_BUCKET，同一时间段内的签名完全相同，
+        各进程无需共享存储也能得到一致的结果，因此不写入数据库
+        
+        Args:
+            file_id: 视频FileID
+            
+        Returns:
+            播放签名信息
+        """
+        cache_key = play_signature_cache.shared_key(file_id)
+        
+        cached = play_signature_cache.get(cache_key)
+        if cached is not None:
+            return {**cached, "from_cache": True}
+        
+        generated = self.vod_service.generate_psign(file_id, issued_at=cache_key[2])
+        sign_info = {
+            "psign": generated["psign"],
+            "app_id": generated["app_id"],
+            "file_id": file_id,
+            "expire_at": generated["expire_at"],
+            "expire_time": generated["expire_time"],
+            "shared": True
+        }
+        play_signature_cache.set(cache_key, sign_info)
+        play_signature_cache.record(shared_generated=1)
+        
+        return {**sign_info, "from_cache": False}
+    
+    def is_shared_content(self, file_id: str) -> bool:
+        """视频是否为免费内容（可使用共享签名，规则见is_shared_playback）"""
+        shared = shared_content_cache.get(file_id)
+        if shared is not None:
+            return shared
+        
+        row = self.db.query(VodVideo.course_id, Course.access_level, Course.status).outerjoin(
+            Course, Course.id == VodVideo.course_id
+        ).filter(VodVideo.file_id == file_id).first()
+        
+        shared = row is not None and is_shared_playback(row.course_id, row.status, row.access_level)
+        shared_content_cache.set(file_id, shared)
+        return shared
+    
     def create_video_record(self, file_id: str, title: str, 
                            course_id: Optional[int] = None, 
                            lesson_id: Optional[int] = None) -> VodVideo:
@@ -450,25 +742,18 @@ class VodManager:
             if video.status != "ready":
                 raise Exception(f"视频状态不可用: {video.status}")
             
-            # 获取播放签名
-            sign_info = self.get_or_create_signature(video.file_id, user_id)
+            # 获取播放签名（免费内容使用共享签名）
+            course = video.course
+            shared = is_shared_playback(
+                video.course_id,
+                course.status if course else None,
+                course.access_level if course else None
+            )
+            sign_info = self.get_or_create_signature(video.file_id, user_id, shared=shared)
             
             # 构建返回数据
             result = {
-                "video": {
-                    "id": video.id,
-                    "title": video.title,
-                    "description": video.description,
-                    "duration": video.duration,
-                    "size": video.size,
-                    "resolution": video.resolution,
-                    "format": video.format,
-                    "cover_url": video.cover_url,
-                    "play_url": video.play_url,
-                    "status": video.status,
-                    "created_at": video.created_at.isoformat() if video.created_at else None,
-                    "updated_at": video.updated_at.isoformat() if video.updated_at else None
-                },
+                "video": video_payload(video),
                 "playback": {
                     "file_id": video.file_id,
                     "app_id": sign_info["app_id"],
@@ -477,24 +762,117 @@ class VodManager:
                 }
             }
             
-            # 添加关联信息
-            if video.course:
-                result["video"]["course"] = {
-                    "id": video.course.id,
-                    "title": video.course.title
-                }
-            
-            if video.lesson:
-                result["video"]["lesson"] = {
-                    "id": video.lesson.id,
-                    "title": video.lesson.title
-                }
-            
             return result
             
         except Exception as e:
             raise Exception(f"获取视频信息失败: {str(e)}")
     
+    def get_playback_bootstrap(self, video_id: int, user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """
+        获取播放器启动所需的全部数据
+        
+        视频、课程、章节一次联表加载，权限按已加载的课程判断，签名走签名缓存，
+        续播位置走内存层，前后章节用一次查询取出。
+        与/video/{id}一致：视频未就绪或课程未发布时视为不存在，无权限时不返回任何视频信息
+        
+        Args:
+            video_id: 视频记录ID
+            user_id: 用户ID（可为None表示匿名用户）
+            
+        Returns:
+            视频信息、播放参数、续播位置和前后章节；视频不存在或不可播放时返回None，
+            无权限时只返回{"has_access": False}
+        """
+        video = self.db.query(VodVideo).options(
+            joinedload(VodVideo.course).load_only(
+                Course.id, Course.title, Course.status, Course.access_level
+            ),
+            joinedload(VodVideo.lesson).load_only(Lesson.id, Lesson.title, Lesson.course_id)
+        ).filter(VodVideo.id == video_id).first()
+        if not video or video.status != "ready":
+            return None
+        
+        course = video.course
+        if video.course_id and (course is None or course.status != "published"):
+            return None
+        
+        if not self._playback_allowed(
+            user_id, video.status, video.course_id,
+            course.status if course else None,
+            course.access_level if course else None,
+            {}
+        ):
+            return {"has_access": False}
+        
+        # 免费内容使用共享签名
+        shared = is_shared_playback(
+            video.course_id,
+            course.status if course else None,
+            course.access_level if course else None
+        )
+        sign_info = self.get_or_create_signature(video.file_id, user_id, shared=shared)
+        
+        return {
+            "video": video_payload(video),
+            "has_access": True,
+            "playback": {
+                "file_id": video.file_id,
+                "app_id": sign_info["app_id"],
+                "psign": sign_info["psign"],
+                "expire_at": sign_info["expire_at"]
+            },
+            "resume_position": resume_position_store.get(self.db, user_id, video_id) if user_id else None,
+            "adjacent": self.get_adjacent_lessons(video.lesson) if video.lesson else {"previous": None, "next": None}
+        }
+    
+    def get_adjacent_lessons(self, lesson: Lesson) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        获取同一课程中的上一章节和下一章节（附带章节最早上传的可播放视频ID）
+        
+        课程章节数量有限，章节和视频ID用一次分组查询取出，
+        按 (sort_order, created_at, id) 排序，与课程章节列表一致
+        
+        Returns:
+            {"previous": 章节或None, "next": 章节或None}
+        """
+        rows = self.db.query(
+            Lesson.id, Lesson.title, Lesson.is_free_preview, func.min(VodVideo.id).label("video_id")
+        ).outerjoin(
+            VodVideo, and_(VodVideo.lesson_id == Lesson.id, VodVideo.status == "ready")
+        ).filter(
+            Lesson.course_id == lesson.course_id
+        ).group_by(
+            Lesson.id, Lesson.title, Lesson.is_free_preview, Lesson.sort_order, Lesson.created_at
+        ).order_by(
+            Lesson.sort_order, Lesson.created_at, Lesson.id
+        ).all()
+        
+        def lesson_info(index: int) -> Optional[Dict[str, Any]]:
+            if index < 0 or index >= len(rows):
+                return None
+            row = rows[index]
+            return {
+                "id": row.id,
+                "title": row.title,
+                "is_free_preview": row.is_free_preview,
+                "video_id": row.video_id
+            }
+        
+        index = next((i for i, row in enumerate(rows) if row.id == lesson.id), None)
+        if index is None:
+            return {"previous": None, "next": None}
+        return {"previous": lesson_info(index - 1), "next": lesson_info(index + 1)}
+    
+    def video_exists(self, video_id: int) -> bool:
+        """视频是否存在（按主键查询，存在的结果缓存5分钟）"""
+        if video_exists_cache.get(video_id):
+            return True
+        
+        exists = self.db.query(VodVideo.id).filter(VodVideo.id == video_id).first() is not None
+        if exists:
+            video_exists_cache.set(video_id, True)
+        return exists
+    
     def check_playback_permission(self, user_id: Optional[int], video_id: int) -> bool:
         """
         检查用户播放权限（支持匿名用户）
@@ -506,74 +884,106 @@ class VodManager:
         Returns:
             是否有播放权限
         """
-        try:
-            # 获取视频记录
-            video = self.db.query(VodVideo).filter(VodVideo.id == video_id).first()
-            if not video:
-                return False
-            
-            # 检查视频状态
-            if video.status != "ready":
-                return False
+        return self.check_playback_permissions(user_id, [video_id]).get(video_id, False)
+    
+    def _playback_allowed(self, user_id: Optional[int], video_status: Optional[str],
+                          course_id: Optional[int], course_status: Optional[str],
+                          access_level: Optional[str], principal: Dict[str, Any]) -> bool:
+        """
+        按视频和所属课程的状态判断播放权限
+        
+        Args:
+            user_id: 用户ID（可为None表示匿名用户）
+            video_status: 视频状态
+            course_id: 所属课程ID
+            course_status: 课程状态（课程不存在时为None）
+            access_level: 课程访问级别
+            principal: 同一批检查共享的用户/权益缓存，用户和权益在第一次需要时加载
+        """
+        # 检查视频状态
+        if video_status != "ready":
+            return False
+        
+        # 没有课程关联的视频，默认允许访问
+        if not course_id:
+            return True
+        
+        # 课程不存在或未发布
+        if course_status != "published":
+            return False
+        
+        # 免费课程允许匿名访问
+        if access_level == "free":
+            return True
+        
+        # 付费课程需要登录
+        if not user_id:
+            return False
+        
+        # 获取用户信息
+        if "user" not in principal:
+            principal["user"] = user_principal_cache.get_by_id(self.db, user_id)
+        user = principal["user"]
+        if not user or not user.is_active:
+            return False
+        
+        # 管理员有所有权限
+        if user.role == "admin":
+            return True
+        
+        # 付费课程权限检查：是否购买或报名
+        if access_level == "premium":
+            if "entitlements" not in principal:
+                principal["entitlements"] = entitlement_resolver.get(self.db, user_id)
+            entitlements = principal["entitlements"]
+            return entitlements.has_enrolled(course_id) or entitlements.has_paid(course_id)
+        
+        # 内部课程需要特定权限
+        if access_level == "internal":
+            return user.role in ["teacher", "admin"]
+        
+        return True
+    
+    def check_playback_permissions(self, user_id: Optional[int], video_ids: List[int]) -> Dict[int, bool]:
+        """
+        批量检查用户播放权限（支持匿名用户）
+        
+        视频和课程用一次联表查询加载，用户和权益各最多加载一次，查询次数与视频数量无关
+        
+        Args:
+            user_id: 用户ID（可为None表示匿名用户）
+            video_ids: 视频ID列表
             
-            # 检查课程关联
-            if video.course_id:
-                course = self.db.query(Course).filter(Course.id == video.course_id).first()
-                if not course:
-                    return False
-                
-                # 检查课程状态
-                if course.status != "published":
-                    return False
-                
-                # 免费课程允许匿名访问
-                if course.access_level == "free":
-                    return True
-                
-                # 付费课程需要登录
-                if not user_id:
-                    return False
-                
-                # 获取用户信息
-                user = self.db.query(User).filter(User.id == user_id).first()
-                if not user or not user.is_active:
-                    return False
-                
-                # 管理员有所有权限
-                if user.role == "admin":
-                    return True
-                
-                # 付费课程权限检查
-                if course.access_level == "premium":
-                    # 检查用户是否购买或报名
-                    from models import UserCourse, Enrollment
-                    
-                    user_course = self.db.query(UserCourse).filter(
-                        UserCourse.user_id == user_id,
-                        UserCourse.course_id == video.course_id
-                    ).first()
-                    
-                    if user_course:
-                        return True
-                    
-                    enrollment = self.db.query(Enrollment).filter(
-                        Enrollment.user_id == user_id,
-                        Enrollment.course_id == video.course_id,
-                        Enrollment.payment_status == "paid"
-                    ).first()
-                    
-                    return enrollment is not None
-                
-                # 内部课程需要特定权限
-                if course.access_level == "internal":
-                    return user.role in ["teacher", "admin"]
+        Returns:
+            视频ID -> 是否有播放权限（不存在的视频为False）
+        """
+        permissions = {video_id: False for video_id in video_ids}
+        if not permissions:
+            return permissions
+        
+        try:
+            rows = self.db.query(
+                VodVideo.id,
+                VodVideo.status.label("video_status"),
+                VodVideo.course_id,
+                Course.status.label("course_status"),
+                Course.access_level
+            ).outerjoin(
+                Course, Course.id == VodVideo.course_id
+            ).filter(VodVideo.id.in_(list(permissions))).all()
+            
+            # 用户和权益在第一次需要时加载
+            principal = {}
+            for row in rows:
+                permissions[row.id] = self._playback_allowed(
+                    user_id, row.video_status, row.course_id, row.course_status, row.access_level, principal
+                )
             
-            # 没有课程关联的视频，默认允许访问
-            return True
+            return permissions
             
         except Exception as e:
             print(f"检查播放权限失败: {str(e)}")
-            return False
+            return {video_id: False for video_id in video_ids}
     
     def record_playback(self, user_id: int, video_id: int, 
                        play_duration: int, progress: int,
@@ -596,77 +1006,153 @@ class VodManager:
             播放记录对象
         """
         try:
-            # 获取视频信息
-            video = self.db.query(VodVideo).filter(VodVideo.id == video_id).first()
-            if not video:
+            now = datetime.utcnow()
+            
+            # 与心跳刷盘走同一写入路径（播放记录upsert、学习统计、播放分析汇总）
+            written = self.apply_playback_batch([{
+                "user_id": user_id,
+                "video_id": video_id,
+                "play_duration": play_duration,
+                "progress": progress,
+                "device_type": device_type,
+                "ip_address": ip_address,
+                "user_agent": user_agent,
+                "first_seen": now,
+                "last_seen": now
+            }])
+            if not written:
                 raise Exception("视频不存在")
             
-            # 创建或更新播放记录
-            record = self.db.query(VideoPlayRecord).filter(
+            return self.db.query(VideoPlayRecord).filter(
                 VideoPlayRecord.user_id == user_id,
                 VideoPlayRecord.video_id == video_id
-            ).first()
-            
-            now = datetime.utcnow()
-            
-            if record:
-                # 更新现有记录
-                record.play_duration += play_duration
-                record.progress = max(record.progress, progress)
-                record.completed = record.progress >= 95  # 95%以上视为完成
-                record.ended_at = now
-                record.updated_at = now
-                
-                if device_type:
-                    record.device_type = device_type
-                if ip_address:
-                    record.ip_address = ip_address
-                if user_agent:
-                    record.user_agent = user_agent
-            else:
-                # 创建新记录
-                record = VideoPlayRecord(
-                    user_id=user_id,
-                    video_id=video_id,
-                    course_id=video.course_id,
-                    lesson_id=video.lesson_id,
-                    play_duration=play_duration,
-                    total_duration=video.duration,
-                    progress=progress,
-                    completed=progress >= 95,
-                    device_type=device_type,
-                    ip_address=ip_address,
-                    user_agent=user_agent,
-                    started_at=now,
-                    ended_at=now
-                )
-                self.db.add(record)
-            
-            self.db.commit()
-            self.db.refresh(record)
-            return record
+            ).one()
             
         except Exception as e:
             self.db.rollback()
             raise Exception(f"记录播放行为失败: {str(e)}")
     
-    def get_user_playback_history(self, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+    def apply_playback_batch(self, entries: List[Dict[str, Any]]) -> int:
+        """
+        批量写入合并后的播放心跳（由playback_ingest刷盘调用）
+        
+        视频信息和已有记录的进度各用一次查询加载，播放记录用一条多行upsert语句写入，
+        学习统计按用户合并后批量更新，同时累加播放分析汇总；所有条目在同一事务中提交
+        
+        Args:
+            entries: 按 (用户, 视频) 合并的心跳，包含play_duration、progress、
+                     first_seen、last_seen及最后一次的设备信息
+                     
+        Returns:
+            写入的条目数量（视频已不存在的条目被丢弃）
+        """
+        if not entries:
+            return 0
+        
+        video_ids = {entry["video_id"] for entry in entries}
+        videos = {
+            video.id: video
+            for video in self.db.query(VodVideo).options(
+                load_only(VodVideo.id, VodVideo.course_id, VodVideo.lesson_id, VodVideo.duration)
+            ).filter(VodVideo.id.in_(video_ids)).all()
+        }
+        
+        # 写入前的进度和最后播放时间，用于判断新的一次播放和首次完成
+        previous = {
+            (row.user_id, row.video_id): row
+            for row in self.db.query(
+                VideoPlayRecord.user_id, VideoPlayRecord.video_id,
+                VideoPlayRecord.progress, VideoPlayRecord.ended_at
+            ).filter(
+                tuple_(VideoPlayRecord.user_id, VideoPlayRecord.video_id).in_(
+                    [(entry["user_id"], entry["video_id"]) for entry in entries]
+                )
+            ).all()
+        }
+        session_gap = timedelta(seconds=PLAYBACK_SESSION_GAP_SECONDS)
+        
+        rows = []
+        plays = []
+        activities = {}
+        for entry in entries:
+            video = videos.get(entry["video_id"])
+            if not video:
+                continue
+            
+            rows.append(play_record_values(
+                video, entry["user_id"], entry["play_duration"], entry["progress"],
+                entry["device_type"], entry["ip_address"], entry["user_agent"],
+                entry["first_seen"], entry["last_seen"]
+            ))
+            # 同一用户的多条心跳合并为一次学习统计更新
+            activity = activities.setdefault(
+                entry["user_id"], {"seconds": 0, "at": entry["last_seen"], "days": set()}
+            )
+            activity["seconds"] += entry["play_duration"]
+            activity["at"] = max(activity["at"], entry["last_seen"])
+            activity["days"].add(entry["last_seen"].date())
+            
+            prev = previous.get((entry["user_id"], entry["video_id"]))
+            prev_progress = (prev.progress or 0) if prev else 0
+            plays.append({
+                "user_id": entry["user_id"],
+                "video_id": video.id,
+                "course_id": video.course_id,
+                "device_type": entry["device_type"],
+                "play_duration": entry["play_duration"],
+                "at": entry["last_seen"],
+                "new_play": not prev or not prev.ended_at or entry["first_seen"] - prev.ended_at > session_gap,
+                "completed_now": prev_progress < 95 <= entry["progress"]
+            })
+        
+        # 学习统计先于播放记录写入：缺失统计行时按写入前的历史数据回填
+        record_learning_activities(self.db, activities)
+        upsert_play_records(self.db, rows)
+        record_playback_rollups(self.db, plays)
+        self.db.commit()
+        
+        for user_id in {row["user_id"] for row in rows}:
+            playback_history_cache.pop(user_id)
+        return len(rows)
+    
+    def get_user_playback_history(self, user_id: int, limit: int = 20,
+                                  cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
         """
         获取用户播放历史
         
+        视频、课程、章节随播放记录一次联表加载（只取返回的列），
+        按最后播放时间游标分页；结果按用户缓存，写入新的播放记录时失效
+        
         Args:
             user_id: 用户ID
             limit: 返回记录数量
+            cursor: 上一页返回的游标，第一页为None
             
         Returns:
-            播放历史列表
+            (播放历史列表, 下一页游标，没有下一页时为None)
         """
+        page_key = (cursor, limit)
+        pages = playback_history_cache.get(user_id)
+        if pages is not None and page_key in pages:
+            return pages[page_key]
+        
         try:
-            records = self.db.query(VideoPlayRecord).filter(
-                VideoPlayRecord.user_id == user_id
-            ).order_by(
-                VideoPlayRecord.ended_at.desc()
-            ).limit(limit).all()
+            query = self.db.query(VideoPlayRecord).options(
+                load_only(
+                    VideoPlayRecord.id, VideoPlayRecord.play_duration, VideoPlayRecord.progress,
+                    VideoPlayRecord.completed, VideoPlayRecord.device_type,
+                    VideoPlayRecord.started_at, VideoPlayRecord.ended_at
+                ),
+                joinedload(VideoPlayRecord.video).load_only(
+                    VodVideo.id, VodVideo.title, VodVideo.cover_url, VodVideo.duration
+                ),
+                joinedload(VideoPlayRecord.course).load_only(Course.id, Course.title),
+                joinedload(VideoPlayRecord.lesson).load_only(Lesson.id, Lesson.title)
+            ).filter(
+                VideoPlayRecord.user_id == user_id,
+                VideoPlayRecord.ended_at.isnot(None)
+            )
+            records, next_cursor = paginate(query, HISTORY_PAGE_KEYS, cursor, limit)
             
             result = []
             for record in records:
@@ -700,8 +1186,13 @@ class VodManager:
                     "ended_at": record.ended_at.isoformat() if record.ended_at else None
                 })
             
-            return result
+            pages = dict(pages or {})
+            pages[page_key] = (result, next_cursor)
+            playback_history_cache.set(user_id, pages)
+            return result, next_cursor
             
+        except HTTPException:
+            raise
         except Exception as e:
             raise Exception(f"获取播放历史失败: {str(e)}")
     
@@ -735,30 +1226,36 @@ class VodManager:
         Returns:
             视频统计信息
         """
+        cached = video_stats_cache.get(video_id)
+        if cached is not None:
+            return cached
+        
         try:
-            video = self.db.query(VodVideo).filter(VodVideo.id == video_id).first()
+            video = self.db.query(VodVideo).options(
+                load_only(VodVideo.id, VodVideo.title, VodVideo.created_at, VodVideo.updated_at)
+            ).filter(VodVideo.id == video_id).first()
             if not video:
                 raise Exception("视频不存在")
             
-            # 获取播放记录统计
-            play_records = self.db.query(VideoPlayRecord).filter(
+            # 播放记录统计由数据库聚合，耗时与播放记录数量无关
+            total_plays, total_duration, completed_plays, avg_progress = self.db.query(
+                func.count(VideoPlayRecord.id),
+                func.coalesce(func.sum(VideoPlayRecord.play_duration), 0),
+                func.coalesce(func.sum(case((VideoPlayRecord.completed == True, 1), else_=0)), 0),
+                func.coalesce(func.avg(VideoPlayRecord.progress), 0)
+            ).filter(
                 VideoPlayRecord.video_id == video_id
-            ).all()
+            ).one()
             
-            total_plays = len(play_records)
-            total_duration = sum(r.play_duration for r in play_records)
-            completed_plays = sum(1 for r in play_records if r.completed)
+            completion_rate = (completed_plays / total_plays) * 100 if total_plays > 0 else 0
             
-            # 计算平均进度
-            if total_plays > 0:
-                avg_progress = sum(r.progress for r in play_records) / total_plays
-                completion_rate = (completed_plays / total_plays) * 100
-            else:
-                avg_progress = 0
-                completion_rate = 0
-            
-            # 获取最近播放记录
-            recent_plays = self.db.query(VideoPlayRecord).filter(
+            # 获取最近播放记录（走ix_play_records_video_ended索引）
+            recent_plays = self.db.query(VideoPlayRecord).options(
+                load_only(
+                    VideoPlayRecord.id, VideoPlayRecord.user_id, VideoPlayRecord.progress,
+                    VideoPlayRecord.completed, VideoPlayRecord.ended_at
+                )
+            ).filter(
                 VideoPlayRecord.video_id == video_id
             ).order_by(
                 VideoPlayRecord.ended_at.desc()
@@ -773,18 +1270,20 @@ class VodManager:
                     "ended_at": record.ended_at.isoformat() if record.ended_at else None
                 })
             
-            return {
+            statistics = {
                 "video_id": video_id,
                 "title": video.title,
                 "total_plays": total_plays,
-                "total_duration": total_duration,
-                "completed_plays": completed_plays,
-                "average_progress": round(avg_progress, 2),
+                "total_duration": int(total_duration),
+                "completed_plays": int(completed_plays),
+                "average_progress": round(float(avg_progress), 2),
                 "completion_rate": round(completion_rate, 2),
                 "recent_plays": recent_play_info,
                 "created_at": video.created_at.isoformat() if video.created_at else None,
                 "updated_at": video.updated_at.isoformat() if video.updated_at else None
             }
+            video_stats_cache.set(video_id, statistics)
+            return statistics
             
         except Exception as e:
             raise Exception(f"获取视频统计失败: {str(e)}")
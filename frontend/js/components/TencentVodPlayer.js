@@ -112,7 +112,14 @@ window.TencentVodPlayer = {
             // API配置
             apiBaseUrl: window.API_BASE_URL || 'http://localhost:8000',
             // 轮询检查播放参数
-            paramCheckInterval: null
+            paramCheckInterval: null,
+            // 续播位置（秒）和播放心跳
+            resumePosition: null,
+            isAnonymous: true,
+            heartbeatInterval: null,
+            heartbeatSeconds: 15,
+            watchedSeconds: 0,
+            lastTimeUpdate: null
         };
     },
     computed: {
@@ -191,9 +198,9 @@ window.TencentVodPlayer = {
                     headers['Authorization'] = `Bearer ${this.authToken}`;
                 }
                 
-                // 调用后端API获取视频信息和播放签名
+                // 一次获取视频信息、播放签名、权限、续播位置和前后章节
                 const response = await fetch(
-                    `${this.apiBaseUrl}/api/vod/video/${this.videoId}`,
+                    `${this.apiBaseUrl}/api/vod/video/${this.videoId}/bootstrap`,
                     {
                         method: 'GET',
                         headers: headers
@@ -211,9 +218,16 @@ window.TencentVodPlayer = {
                     throw new Error(result.message || '获取播放参数失败');
                 }
                 
+                if (!result.data.has_access) {
+                    throw new Error('您没有权限观看此视频');
+                }
+                
                 // 保存播放参数和视频信息
                 this.playbackParams = result.data.playback;
                 this.videoInfo = result.data.video;
+                this.resumePosition = result.data.resume_position ? result.data.resume_position.position : null;
+                this.isAnonymous = !!result.is_anonymous;
+                this.$emit('adjacent-lessons', result.data.adjacent);
                 
                 console.log('播放参数获取成功:', {
                     file_id: this.playbackParams.file_id,
@@ -292,6 +306,48 @@ window.TencentVodPlayer = {
             }
         },
         
+        // 发送播放心跳（登录用户），上报本次观看时长、进度和当前位置
+        sendHeartbeat() {
+            if (!this.player || this.isAnonymous) return;
+            
+            const duration = this.player.duration();
+            const position = this.player.currentTime();
+            const playDuration = Math.round(this.watchedSeconds);
+            this.watchedSeconds = 0;
+            
+            this.recordPlayback({
+                play_duration: playDuration,
+                progress: duration ? Math.min(100, Math.round((position / duration) * 100)) : 0,
+                position: position,
+                device_type: 'web'
+            });
+        },
+        
+        // 从上次播放的位置继续（接近结尾时从头播放）
+        applyResumePosition() {
+            if (!this.player || !this.resumePosition) return;
+            
+            const duration = this.player.duration();
+            if (!duration || this.resumePosition < duration - 5) {
+                this.player.currentTime(this.resumePosition);
+            }
+            this.resumePosition = null;
+        },
+        
+        startHeartbeat() {
+            if (this.heartbeatInterval) return;
+            this.heartbeatInterval = setInterval(() => {
+                this.sendHeartbeat();
+            }, this.heartbeatSeconds * 1000);
+        },
+        
+        stopHeartbeat() {
+            if (this.heartbeatInterval) {
+                clearInterval(this.heartbeatInterval);
+                this.heartbeatInterval = null;
+            }
+        },
+        
         // 初始化TCPlayer播放器
         initPlayer() {
             if (!this.hasAccess) {
@@ -605,18 +661,24 @@ window.TencentVodPlayer = {
             // 播放事件
             this.player.on('play', () => {
                 this.isPlaying = true;
+                this.lastTimeUpdate = null;
+                this.startHeartbeat();
                 this.$emit('play');
             });
             
             // 暂停事件
             this.player.on('pause', () => {
                 this.isPlaying = false;
+                this.stopHeartbeat();
+                this.sendHeartbeat();
                 this.$emit('pause');
             });
             
             // 结束事件
             this.player.on('ended', () => {
                 this.isPlaying = false;
+                this.stopHeartbeat();
+                this.sendHeartbeat();
                 this.$emit('ended');
             });
             
@@ -630,6 +692,7 @@ window.TencentVodPlayer = {
             this.player.on('loadeddata', () => {
                 console.log('视频数据已加载');
                 this.isLoading = false;
+                this.applyResumePosition();
             });
             
             // 等待中
@@ -645,6 +708,16 @@ window.TencentVodPlayer = {
             // 时间更新
             this.player.on('timeupdate', () => {
                 this.currentTime = this.player.currentTime();
+                
+                // 累计实际观看时长（跳转产生的时间差不计入）
+                if (this.isPlaying && this.lastTimeUpdate !== null) {
+                    const delta = this.currentTime - this.lastTimeUpdate;
+                    if (delta > 0 && delta < 2) {
+                        this.watchedSeconds += delta;
+                    }
+                }
+                this.lastTimeUpdate = this.currentTime;
+                
                 this.$emit('timeupdate', {
                     currentTime: this.currentTime,
                     duration: this.player.duration(),
@@ -846,6 +919,7 @@ window.TencentVodPlayer = {
         
         // 销毁播放器
         destroyPlayer() {
+            this.stopHeartbeat();
             if (this.player) {
                 try {
                     this.player.dispose();
@@ -107,6 +107,7 @@ window.CourseDetailPage = {
                                     @pause="onVideoPause"
                                     @ended="onVideoEnded"
                                     @error="onVideoError"
+                                    @adjacent-lessons="onAdjacentLessons"
                                 ></tencent-vod-player>
                                 
                                 <div v-else-if="selectedLesson && !hasVideoAccess" style="padding: 40px 20px; text-align: center; background: #f8f9fa;">
@@ -125,6 +126,17 @@ window.CourseDetailPage = {
                                 </div>
                             </div>
                             
+                            <!-- 上一节/下一节（来自播放启动接口，无需另外请求） -->
+                            <div v-if="adjacentLessons.previous || adjacentLessons.next" style="padding: 10px 15px; border-top: 1px solid #eee; display: flex; justify-content: space-between; gap: 10px;">
+                                <button v-if="adjacentLessons.previous" class="art-btn art-btn-outline" @click="playAdjacentLesson(adjacentLessons.previous)" :title="adjacentLessons.previous.title" style="padding: 6px 12px; font-size: 0.85rem;">
+                                    <i class="fas fa-step-backward"></i> 上一节
+                                </button>
+                                <span v-else></span>
+                                <button v-if="adjacentLessons.next" class="art-btn art-btn-outline" @click="playAdjacentLesson(adjacentLessons.next)" :title="adjacentLessons.next.title" style="padding: 6px 12px; font-size: 0.85rem;">
+                                    下一节 <i class="fas fa-step-forward"></i>
+                                </button>
+                            </div>
+                            
                             <div style="padding: 15px; border-top: 1px solid #eee;">
                                 <h4 style="margin: 0 0 8px 0; color: #333; font-size: 0.95rem;">课程内容</h4>
                                 <p style="color: #666; font-size: 0.9rem; margin: 0; line-height: 1.5;">{{ selectedLesson.description || '暂无详细描述' }}</p>
@@ -151,6 +163,7 @@ window.CourseDetailPage = {
             error: null,
             hasVideoAccess: false,
             accessMessage: '',
+            adjacentLessons: { previous: null, next: null }, // 播放器返回的前后章节
             userAuthToken: '', // 用户认证令牌
             // 腾讯云点播配置
             tencentAppId: '1309648761', // 示例AppID，实际使用时从后端获取
@@ -284,6 +297,10 @@ window.CourseDetailPage = {
         
         // 获取课时对应的视频ID
         getVideoIdForLesson(lesson) {
+            // 前后章节导航时接口已给出视频ID
+            if (lesson.video_id) {
+                return lesson.video_id;
+            }
             // 这里应该从lesson数据中获取视频ID
             // 对于测试课时ID=21，对应的视频ID=1
             if (lesson.id === 21) {
@@ -323,12 +340,27 @@ window.CourseDetailPage = {
             // 可以在这里处理播放错误
         },
         
+        // 播放器加载视频后返回前后可播放的章节
+        onAdjacentLessons(adjacent) {
+            this.adjacentLessons = adjacent || { previous: null, next: null };
+        },
+        
+        // 切换到上一节/下一节（优先使用章节列表中的完整数据，视频ID以接口返回为准）
+        playAdjacentLesson(adjacent) {
+            const lesson = this.lessons.find(item => item.id === adjacent.id);
+            this.playLesson(lesson ? { ...lesson, video_id: adjacent.video_id } : adjacent);
+        },
+        
         onVideoTimeUpdate(data) {
             // 可以在这里记录播放进度
             // console.log('播放进度:', data.percentage);
         },
         
         selectLesson(lesson) {
+            // 切换到其他章节时清空前后章节，等待播放器加载新视频后重新返回
+            if (!this.selectedLesson || this.selectedLesson.id !== lesson.id) {
+                this.adjacentLessons = { previous: null, next: null };
+            }
             this.selectedLesson = lesson;
             this.checkVideoAccess();
         },